@@ -3,30 +3,122 @@ import os
 
 from flask import Flask, request, abort, jsonify, render_template
 from flask_cors import CORS
-from flask_sqlalchemy import SQLAlchemy
 
-from auth.auth import AuthError, requires_auth
-from models import setup_db, Movie, Actor
-
-db = SQLAlchemy()
+from auth.auth import (AuthError, auth_stats, check_permissions, requires_auth, requires_internal_token,
+                       use_pinned_keys)
+from bulk import (ACTOR_BULK_COLUMNS, MOVIE_BULK_COLUMNS, bulk_create, delete_many, get_bulk_changes,
+                  get_bulk_ids, get_bulk_items, update_many)
+from cache import LocalCache, ResponseCache, cached, create_cache_backend
+from casting import (ACTOR_RELATED_TABLES, MOVIE_RELATED_TABLES, add_cast, attach_related, get_includes,
+                     load_related, remove_cast)
+from compression import init_compression
+from conditional import versioned
+from dbpool import engine_options, pool_stats
+from filtering import ACTOR_FILTERS, ACTOR_SORTS, MOVIE_FILTERS, MOVIE_SORTS, get_filters
+from idempotency import IdempotencyStore, idempotent
+from metrics import render_metrics
+from models import (ACTOR_JSON_COLUMNS, MOVIE_JSON_COLUMNS, setup_db, delete_by_id, insert_unique, parse_columns,
+                    update_by_id, Movie, Actor)
+from pagination import get_page_args, get_sort_order, paginate
+from projection import get_fields
+from replicas import init_replicas, read_replica
+from search import SEARCH_TYPES, get_search_args, search
+from serializers import ISODateJSONEncoder, get_serializer, json_response
+from streaming import ndjson_response, wants_ndjson
+from timing import init_request_timing, phase
+from unit_of_work import abort_unprocessable, init_unit_of_work
 
 
 def create_app(test_config=None):
     # create app
     app = Flask(__name__)
+    app.json_encoder = ISODateJSONEncoder
+    app.config.from_mapping(
+        # connection pool of each worker, the size settings only apply to Postgres
+        DB_POOL_SIZE=int(os.getenv('DB_POOL_SIZE', 5)),
+        DB_MAX_OVERFLOW=int(os.getenv('DB_MAX_OVERFLOW', 10)),
+        DB_POOL_TIMEOUT=float(os.getenv('DB_POOL_TIMEOUT', 30)),
+        DB_POOL_RECYCLE=int(os.getenv('DB_POOL_RECYCLE', 1800)),
+        DB_POOL_PRE_PING=os.getenv('DB_POOL_PRE_PING', 'true').lower() in ('1', 'true', 'yes'),
+        # comma separated URLs of read replicas serving the read only end points, seconds a failed
+        # replica is skipped, and seconds a client reads from the primary after one of its writes
+        REPLICA_URLS=os.getenv('REPLICA_URLS', ''),
+        REPLICA_RETRY_SECONDS=float(os.getenv('REPLICA_RETRY_SECONDS', 30)),
+        READ_YOUR_WRITES_SECONDS=float(os.getenv('READ_YOUR_WRITES_SECONDS', 5)),
+        # statements slower than this are logged, and statements repeated this often in one request
+        SLOW_QUERY_MS=float(os.getenv('SLOW_QUERY_MS', 200)),
+        N_PLUS_ONE_THRESHOLD=int(os.getenv('N_PLUS_ONE_THRESHOLD', 10)),
+        # bearer token of the /internal/stats and /metrics end points, which are disabled when unset
+        INTERNAL_STATS_TOKEN=os.getenv('INTERNAL_STATS_TOKEN'),
+        # local jwks.json or PEM bundle, when set Auth0 is never contacted for the signing keys
+        AUTH0_JWKS_FILE=os.getenv('AUTH0_JWKS_FILE'),
+        # page size of the list end points when no "limit" is passed, and the largest one allowed
+        DEFAULT_PAGE_SIZE=int(os.getenv('DEFAULT_PAGE_SIZE', 50)),
+        MAX_PAGE_SIZE=int(os.getenv('MAX_PAGE_SIZE', 200)),
+        # largest number of items accepted by the bulk end points
+        BULK_MAX_ITEMS=int(os.getenv('BULK_MAX_ITEMS', 1000)),
+        # response cache of the read end points: "local", "redis://...", "memcached://..." or "none"
+        RESPONSE_CACHE_URL=os.getenv('RESPONSE_CACHE_URL', 'local'),
+        RESPONSE_CACHE_TTL=int(os.getenv('RESPONSE_CACHE_TTL', 30)),
+        RESPONSE_CACHE_MAX_ENTRIES=int(os.getenv('RESPONSE_CACHE_MAX_ENTRIES', 1024)),
+        RESPONSE_CACHE_MAX_BYTES=int(os.getenv('RESPONSE_CACHE_MAX_BYTES', 16 * 1024 * 1024)),
+        # search: number of ranked hits that can be paged through, and the least similarity of a hit (0 to 1)
+        SEARCH_MAX_RESULTS=int(os.getenv('SEARCH_MAX_RESULTS', 1000)),
+        SEARCH_MIN_SIMILARITY=float(os.getenv('SEARCH_MIN_SIMILARITY', 0.5)),
+        # responses of POST requests sent with an Idempotency-Key: same URLs as RESPONSE_CACHE_URL,
+        # seconds they are kept, size bounds of the "local" backend, and seconds a duplicate waits
+        # for the request in flight
+        IDEMPOTENCY_CACHE_URL=os.getenv('IDEMPOTENCY_CACHE_URL', 'local'),
+        IDEMPOTENCY_KEY_TTL=int(os.getenv('IDEMPOTENCY_KEY_TTL', 24 * 60 * 60)),
+        IDEMPOTENCY_MAX_ENTRIES=int(os.getenv('IDEMPOTENCY_MAX_ENTRIES', 10000)),
+        IDEMPOTENCY_MAX_BYTES=int(os.getenv('IDEMPOTENCY_MAX_BYTES', 64 * 1024 * 1024)),
+        IDEMPOTENCY_WAIT_TIMEOUT=float(os.getenv('IDEMPOTENCY_WAIT_TIMEOUT', 10)),
+        # response compression: encodings offered in order of preference ("br" needs the brotli
+        # package, empty disables compression), smallest body compressed in bytes, and the levels
+        COMPRESSION_ENCODINGS=os.getenv('COMPRESSION_ENCODINGS', 'br,gzip'),
+        COMPRESSION_MIN_SIZE=int(os.getenv('COMPRESSION_MIN_SIZE', 1024)),
+        COMPRESSION_GZIP_LEVEL=int(os.getenv('COMPRESSION_GZIP_LEVEL', 6)),
+        COMPRESSION_BROTLI_LEVEL=int(os.getenv('COMPRESSION_BROTLI_LEVEL', 4)),
+    )
+    if test_config:
+        app.config.update(test_config)
     setup_db(app)
+    if app.config['AUTH0_JWKS_FILE']:
+        use_pinned_keys(app.config['AUTH0_JWKS_FILE'])
+    cache_backend = create_cache_backend(
+        app.config['RESPONSE_CACHE_URL'],
+        default_timeout=app.config['RESPONSE_CACHE_TTL'],
+        max_entries=app.config['RESPONSE_CACHE_MAX_ENTRIES'],
+        max_bytes=app.config['RESPONSE_CACHE_MAX_BYTES'])
+    if cache_backend is not None:
+        app.extensions['response_cache'] = ResponseCache(cache_backend)
+    init_replicas(app, engine_options, cache_backend or LocalCache())
+    idempotency_backend = create_cache_backend(
+        app.config['IDEMPOTENCY_CACHE_URL'],
+        default_timeout=app.config['IDEMPOTENCY_KEY_TTL'],
+        max_entries=app.config['IDEMPOTENCY_MAX_ENTRIES'],
+        max_bytes=app.config['IDEMPOTENCY_MAX_BYTES'])
+    if idempotency_backend is not None:
+        app.extensions['idempotency_store'] = IdempotencyStore(
+            idempotency_backend, app.config['IDEMPOTENCY_KEY_TTL'], app.config['IDEMPOTENCY_WAIT_TIMEOUT'])
     CORS(app, resources={r"/api/*": {"origins": "*"}})
+    init_request_timing(app)
 
     @app.after_request
     def after_request(response):
         response.headers.add(
-            "Access-Control-Allow-Headers", "Content-Type,Authorization"
+            "Access-Control-Allow-Headers", "Content-Type,Authorization,Idempotency-Key"
         )
         response.headers.add(
             "Access-Control-Allow-Methods", "GET, POST, PATCH, DELETE, OPTIONS"
         )
         return response
 
+    # runs before the timing hook, so its time is part of the total
+    init_compression(app)
+    # registered last so it runs first among the after_request hooks: the others see the outcome of the commit
+    init_unit_of_work(app)
+
     @app.route('/')
     def home_page():
         """
@@ -52,48 +144,213 @@ def create_app(test_config=None):
 
     @app.route('/api/movie', methods=['GET'])
     @requires_auth('get:movie')
+    @read_replica
+    @cached('movies', related=MOVIE_RELATED_TABLES)
+    @versioned('movies', related=MOVIE_RELATED_TABLES)
     def get_movies(payload):
         """
-        API end point to get movie details
+        API end point to get movie details, one page at a time
+        Query parameters: limit (page size), cursor (next_cursor of the previous page),
+        fields (comma separated columns to return, only those are selected),
+        released_after, released_before (YYYY-MM-DD, exclusive),
+        sort (id, title or release_date, "-" prefix for descending order),
+        include (actors, to embed the cast of each movie, loaded with one query per page)
+        With "Accept: application/x-ndjson" all rows after the cursor are streamed instead
+        Answers 304 when If-None-Match carries the current ETag
         :param payload: Payload
         :return: JSON response
         """
-        movies = Movie.query.all()
-        if len(movies) == 0:
+        sort = get_sort_order(Movie, MOVIE_SORTS)
+        limit, after = get_page_args(sort.name)
+        criteria = get_filters(MOVIE_FILTERS)
+        includes = get_includes(Movie)
+        serialize = get_serializer(Movie, get_fields(Movie))
+        query = serialize.query(*sort.columns).filter(*criteria)
+        if wants_ndjson():
+            attach = (lambda rows, items: attach_related(Movie, includes, rows, items)) if includes else None
+            return ndjson_response(query, sort, after, serialize, attach)
+        movies, next_cursor = paginate(query, sort, limit, after)
+        if len(movies) == 0 and after is None and not criteria:
             abort(404, 'No movie present, please add movies using the API')
 
         try:
-            movie_list_json = [movie.serialize() for movie in movies]
-            return jsonify({
-                'success': True,
-                'movies': movie_list_json
-            })
+            with phase('serialize'):
+                movie_list_json = [serialize(movie) for movie in movies]
+                attach_related(Movie, includes, movies, movie_list_json)
+                return json_response({
+                    'success': True,
+                    'movies': movie_list_json,
+                    'next_cursor': next_cursor
+                })
         except Exception as e:
-            abort(422, str(e))
+            abort_unprocessable(e)
 
     @app.route('/api/actor', methods=['GET'])
     @requires_auth('get:actor')
+    @read_replica
+    @cached('actors', related=ACTOR_RELATED_TABLES)
+    @versioned('actors', related=ACTOR_RELATED_TABLES)
     def get_actors(payload):
         """
-        API end point to get the list of actors
+        API end point to get the list of actors, one page at a time
+        Query parameters: limit (page size), cursor (next_cursor of the previous page),
+        fields (comma separated columns to return, only those are selected),
+        min_age, max_age (inclusive), gender,
+        sort (id, name or age, "-" prefix for descending order),
+        include (movies, to embed the movies of each actor, loaded with one query per page)
+        With "Accept: application/x-ndjson" all rows after the cursor are streamed instead
+        Answers 304 when If-None-Match carries the current ETag
         :param payload: Payload
         :return: JSON response
         """
-        actors = Actor.query.all()
-        if len(actors) == 0:
+        sort = get_sort_order(Actor, ACTOR_SORTS)
+        limit, after = get_page_args(sort.name)
+        criteria = get_filters(ACTOR_FILTERS)
+        includes = get_includes(Actor)
+        serialize = get_serializer(Actor, get_fields(Actor))
+        query = serialize.query(*sort.columns).filter(*criteria)
+        if wants_ndjson():
+            attach = (lambda rows, items: attach_related(Actor, includes, rows, items)) if includes else None
+            return ndjson_response(query, sort, after, serialize, attach)
+        actors, next_cursor = paginate(query, sort, limit, after)
+        if len(actors) == 0 and after is None and not criteria:
             abort(404, 'No actor present, please add movies using the API')
 
         try:
-            actor_list_json = [actor.serialize() for actor in actors]
-            return jsonify({
-                'success': True,
-                'actors': actor_list_json
-            })
+            with phase('serialize'):
+                actor_list_json = [serialize(actor) for actor in actors]
+                attach_related(Actor, includes, actors, actor_list_json)
+                return json_response({
+                    'success': True,
+                    'actors': actor_list_json,
+                    'next_cursor': next_cursor
+                })
+        except Exception as e:
+            abort_unprocessable(e)
+
+    @app.route('/api/search', methods=['GET'])
+    @requires_auth('get:movie')
+    @read_replica
+    def search_movies_and_actors(payload):
+        """
+        API end point to search movie titles and actor names, best matches first.
+        Matching is by trigram similarity, so misspelled queries still find their target.
+        Query parameters: q (search text, at least 3 characters), type (movie or actor,
+        both when omitted), limit (page size), cursor (next_cursor of the previous page)
+        Actors are only searched for tokens having the get:actor permission
+        :param payload: Payload
+        :return: JSON response
+        """
+        types = request.args.get('type', None)
+        if types is None:
+            types = [name for name in SEARCH_TYPES if f'get:{name}' in payload['permissions']]
+        elif types in SEARCH_TYPES:
+            check_permissions(f'get:{types}', payload)
+            types = [types]
+        else:
+            abort(400, f'Invalid type {types}, expected one of {",".join(SEARCH_TYPES)}')
+        q, limit, offset = get_search_args()
+        hits, next_cursor = search(q, types, limit, offset)
+        return json_response({
+            'success': True,
+            'results': hits,
+            'next_cursor': next_cursor
+        })
+
+    @app.route('/api/movie/<int:movie_id>/actors', methods=['GET'])
+    @requires_auth('get:actor')
+    @read_replica
+    @cached('movies', 'actors', 'movie_actors')
+    def get_movie_actors(payload, movie_id):
+        """
+        API end point to get the cast of a movie
+        :param payload: Payload
+        :param movie_id: Id of the movie
+        :return: JSON response
+        """
+        if Movie.query.with_entities(Movie.id).filter(Movie.id == movie_id).scalar() is None:
+            abort(404, f'Movie with id: {movie_id} does not exist')
+        return json_response({
+            'success': True,
+            'movie': movie_id,
+            'actors': load_related(Movie, 'actors', [movie_id]).get(movie_id, [])
+        })
+
+    @app.route('/api/actor/<int:actor_id>/movies', methods=['GET'])
+    @requires_auth('get:movie')
+    @read_replica
+    @cached('movies', 'actors', 'movie_actors')
+    def get_actor_movies(payload, actor_id):
+        """
+        API end point to get the movies an actor is cast in
+        :param payload: Payload
+        :param actor_id: Id of the actor
+        :return: JSON response
+        """
+        if Actor.query.with_entities(Actor.id).filter(Actor.id == actor_id).scalar() is None:
+            abort(404, f'Actor with id: {actor_id} does not exist')
+        return json_response({
+            'success': True,
+            'actor': actor_id,
+            'movies': load_related(Actor, 'movies', [actor_id]).get(actor_id, [])
+        })
+
+    @app.route('/api/movie/<int:movie_id>/actors', methods=['POST'])
+    @requires_auth('patch:movie')
+    def add_movie_actors(payload, movie_id):
+        """
+        API end point to cast actors in a movie, actors already cast are skipped
+        Valid JSON body:
+        {
+            "actor_ids": [1, 2]
+        }
+        :param payload: Payload
+        :param movie_id: Id of the movie
+        :return: JSON response with the full cast
+        """
+        body = request.get_json()
+        if not body:
+            abort(400, 'JSON passed is empty')
+        actor_ids = body.get('actor_ids', None)
+        if not isinstance(actor_ids, list) or not actor_ids or \
+                not all(isinstance(actor_id, int) for actor_id in actor_ids):
+            abort(400, 'Invalid JSON, "actor_ids" must be a non empty list of actor ids')
+        if Movie.query.with_entities(Movie.id).filter(Movie.id == movie_id).scalar() is None:
+            abort(404, f'Movie with id: {movie_id} does not exist')
+        try:
+            added = add_cast(movie_id, actor_ids)
+        except LookupError as e:
+            abort(404, str(e))
         except Exception as e:
-            abort(422, str(e))
+            abort_unprocessable(e)
+        return json_response({
+            'success': True,
+            'movie': movie_id,
+            'added': added,
+            'actors': load_related(Movie, 'actors', [movie_id]).get(movie_id, [])
+        })
+
+    @app.route('/api/movie/<int:movie_id>/actors/<int:actor_id>', methods=['DELETE'])
+    @requires_auth('patch:movie')
+    def delete_movie_actor(payload, movie_id, actor_id):
+        """
+        API end point to remove an actor from the cast of a movie
+        :param payload: Payload
+        :param movie_id: Id of the movie
+        :param actor_id: Id of the actor
+        :return: JSON response
+        """
+        if not remove_cast(movie_id, actor_id):
+            abort(404, f'Actor with id: {actor_id} is not cast in movie with id: {movie_id}')
+        return jsonify({
+            'success': True,
+            'movie': movie_id,
+            'deleted': actor_id
+        })
 
     @app.route('/api/movie', methods=['POST'])
     @requires_auth('post:movie')
+    @idempotent
     def add_movie(payload):
         """
         API end point to post a new movie
@@ -112,19 +369,42 @@ def create_app(test_config=None):
         if 'title' not in body.keys() or 'release_date' not in body.keys():
             abort(400, 'Invalid JSON, "title" or "release_date" key is not present')
 
-        if Movie.query.filter_by(title=body['title']).first():
+        try:
+            values = Movie.columns_from_json(body)
+        except ValueError as e:
+            abort(400, str(e))
+        try:
+            movie = insert_unique(Movie, values, 'title')
+        except Exception as e:
+            abort_unprocessable(e)
+        if movie is None:
             abort(409, 'Movie with name ' + body['title'] + ' already exists.')
+        return jsonify(movie)
+
+    @app.route('/api/movie/bulk', methods=['POST'])
+    @requires_auth('post:movie')
+    @idempotent
+    def add_movies(payload):
+        """
+        API end point to post several movies at once
+        Valid JSON body:
+        [
+            {"title": "Ludo", "release_date: "2020-10-10"},
+            {"title": "Challang", "release_date: "2020-07-11"}
+        ]
+        :param payload: Payload
+        :return: JSON response with one result per movie
+        """
+        movies = get_bulk_items()
         try:
-            movie = Movie(
-                title=body['title'],
-                release_date=body['release_date'])
-            movie.insert()
-            return jsonify(movie.serialize())
+            results = bulk_create(Movie, movies, 'title')
         except Exception as e:
-            db.session.rollback()
-            abort(422, str(e))
-        finally:
-            db.session.close()
+            abort_unprocessable(e)
+        return jsonify({
+            'success': True,
+            'created': sum(result['success'] for result in results),
+            'results': results
+        })
 
     @app.route('/api/movie/<int:movie_id>', methods=['DELETE'])
     @requires_auth('delete:movie')
@@ -135,20 +415,35 @@ def create_app(test_config=None):
         :param movie_id: Id of the movie to be delete
         :return: JSON response
         """
-        movie = Movie.query.filter_by(id=movie_id).one_or_none()
-        if movie is None:
+        try:
+            deleted = delete_by_id(Movie, movie_id)
+        except Exception as e:
+            abort_unprocessable(e)
+        if not deleted:
             abort(404, f'Movie with id: {movie_id} does not exist')
+        return jsonify({
+            'success': True,
+            'deleted': movie_id
+        })
+
+    @app.route('/api/movie', methods=['DELETE'])
+    @requires_auth('delete:movie')
+    def delete_movies(payload):
+        """
+        API end point to delete several movies at once, e.g. DELETE /api/movie?ids=1,2,3
+        :param payload: Payload
+        :return: JSON response with the deleted ids and the ids that do not exist
+        """
+        ids = get_bulk_ids()
         try:
-            movie.delete()
-            return jsonify({
-                'success': True,
-                'deleted': movie_id
-            })
+            deleted, not_found = delete_many(Movie, ids)
         except Exception as e:
-            db.session.rollback()
-            abort(422, str(e))
-        finally:
-            db.session.close()
+            abort_unprocessable(e)
+        return jsonify({
+            'success': True,
+            'deleted': deleted,
+            'not_found': not_found
+        })
 
     @app.route('/api/movie/<int:movie_id>', methods=['PATCH'])
     @requires_auth('patch:movie')
@@ -164,35 +459,56 @@ def create_app(test_config=None):
         :param movie_id: Id of the movie to be updated
         :return: JSON response
         """
-        movie = Movie.query.filter_by(id=movie_id).one_or_none()
-        if movie is None:
-            abort(404, f'Movie with id: {movie_id} does not exist')
-
         body = request.get_json()
         if not body:
             # posting an empty json should return a 400 error.
             abort(400, 'JSON passed is empty')
-        title = body.get('title', None)
-        release_date = body.get('release_date', None)
-        if not title and not release_date:
+        # only the keys given a value are changed
+        values = {key: body[key] for key in ('title', 'release_date') if body.get(key)}
+        if not values:
             abort(400, 'Both title and release_date are "None"')
         try:
-            movie.title = title or movie.title
-            movie.release_date = release_date or movie.release_date
-            movie.update()
-            return jsonify({
-                'success': True,
-                'movie': movie.serialize()
-            })
+            values = parse_columns(values, MOVIE_JSON_COLUMNS)
+        except ValueError as e:
+            abort(400, str(e))
+        try:
+            movie = update_by_id(Movie, movie_id, values)
+        except Exception as e:
+            abort_unprocessable(e)
+        if movie is None:
+            abort(404, f'Movie with id: {movie_id} does not exist')
+        return jsonify({
+            'success': True,
+            'movie': movie
+        })
 
+    @app.route('/api/movie/bulk', methods=['PATCH'])
+    @requires_auth('patch:movie')
+    def update_movies(payload):
+        """
+        API end point to set the same values on several movies at once
+        Valid JSON body:
+        {
+            "ids": [1, 2, 3],
+            "set": {"release_date": "2020-10-10"}
+        }
+        :param payload: Payload
+        :return: JSON response with the updated ids and the ids that do not exist
+        """
+        ids, values = get_bulk_changes(MOVIE_BULK_COLUMNS)
+        try:
+            updated, not_found = update_many(Movie, ids, values)
         except Exception as e:
-            db.session.rollback()
-            abort(422, str(e))
-        finally:
-            db.session.close()
+            abort_unprocessable(e)
+        return jsonify({
+            'success': True,
+            'updated': updated,
+            'not_found': not_found
+        })
 
     @app.route('/api/actor', methods=['POST'])
     @requires_auth('post:actor')
+    @idempotent
     def add_actor(payload):
         """
         API end point to add an actor
@@ -212,20 +528,42 @@ def create_app(test_config=None):
         if 'name' not in body.keys() or 'age' not in body.keys() or 'gender' not in body.keys():
             abort(400, 'Invalid JSON, "name" or "age" or "gender" key is not present')
 
-        if Actor.query.filter_by(name=body['name']).first():
+        try:
+            values = Actor.columns_from_json(body)
+        except ValueError as e:
+            abort(400, str(e))
+        try:
+            actor = insert_unique(Actor, values, 'name')
+        except Exception as e:
+            abort_unprocessable(e)
+        if actor is None:
             abort(409, 'Actor with name ' + body['name'] + ' already exists.')
+        return jsonify(actor)
+
+    @app.route('/api/actor/bulk', methods=['POST'])
+    @requires_auth('post:actor')
+    @idempotent
+    def add_actors(payload):
+        """
+        API end point to add several actors at once
+        Valid json body:
+        [
+            {"name": "Amitabh Bachchan", "age": 78, "gender": "Male"},
+            {"name": "Aamir Khan", "age": 50, "gender": "Male"}
+        ]
+        :param payload: Payload
+        :return: JSON response with one result per actor
+        """
+        actors = get_bulk_items()
         try:
-            actor = Actor(
-                name=body['name'],
-                age=body['age'],
-                gender=body['gender'])
-            actor.insert()
-            return jsonify(actor.serialize())
+            results = bulk_create(Actor, actors, 'name')
         except Exception as e:
-            db.session.rollback()
-            abort(422, str(e))
-        finally:
-            db.session.close()
+            abort_unprocessable(e)
+        return jsonify({
+            'success': True,
+            'created': sum(result['success'] for result in results),
+            'results': results
+        })
 
     @app.route('/api/actor/<int:actor_id>', methods=['DELETE'])
     @requires_auth('delete:actor')
@@ -236,20 +574,35 @@ def create_app(test_config=None):
         :param actor_id: Id of an actor to be deleted
         :return: JSON response
         """
-        actor = Actor.query.filter_by(id=actor_id).one_or_none()
-        if actor is None:
+        try:
+            deleted = delete_by_id(Actor, actor_id)
+        except Exception as e:
+            abort_unprocessable(e)
+        if not deleted:
             abort(404, f'Actor with id: {actor_id} does not exist')
+        return jsonify({
+            'success': True,
+            'deleted': actor_id
+        })
+
+    @app.route('/api/actor', methods=['DELETE'])
+    @requires_auth('delete:actor')
+    def delete_actors(payload):
+        """
+        API end point to delete several actors at once, e.g. DELETE /api/actor?ids=1,2,3
+        :param payload: Payload
+        :return: JSON response with the deleted ids and the ids that do not exist
+        """
+        ids = get_bulk_ids()
         try:
-            actor.delete()
-            return jsonify({
-                'success': True,
-                'deleted': actor_id
-            })
+            deleted, not_found = delete_many(Actor, ids)
         except Exception as e:
-            db.session.rollback()
-            abort(422, str(e))
-        finally:
-            db.session.close()
+            abort_unprocessable(e)
+        return jsonify({
+            'success': True,
+            'deleted': deleted,
+            'not_found': not_found
+        })
 
     @app.route('/api/actor/<int:actor_id>', methods=['PATCH'])
     @requires_auth('patch:actor')
@@ -266,34 +619,83 @@ def create_app(test_config=None):
         :param actor_id: Actor if to be edited
         :return: JSON response
         """
-        actor = Actor.query.filter_by(id=actor_id).one_or_none()
-        if actor is None:
-            abort(404, f'Actor with id: {actor_id} does not exist')
-
         body = request.get_json()
         if not body:
             # posting an empty json should return a 400 error.
             abort(400, 'JSON passed is empty')
-        name = body.get('name', None)
-        age = body.get('age', None)
-        gender = body.get('gender', None)
-        if not name and not age and not gender:
+        # only the keys given a value are changed
+        values = {key: body[key] for key in ('name', 'age', 'gender') if body.get(key)}
+        if not values:
             abort(400, 'Name, Age and Gender are "None"')
         try:
-            actor.name = name or actor.name
-            actor.age = age or actor.age
-            actor.gender = age or actor.gender
-            actor.update()
-            return jsonify({
-                'success': True,
-                'updated_actor': actor.serialize()
-            })
+            values = parse_columns(values, ACTOR_JSON_COLUMNS)
+        except ValueError as e:
+            abort(400, str(e))
+        try:
+            actor = update_by_id(Actor, actor_id, values)
+        except Exception as e:
+            abort_unprocessable(e)
+        if actor is None:
+            abort(404, f'Actor with id: {actor_id} does not exist')
+        return jsonify({
+            'success': True,
+            'updated_actor': actor
+        })
 
+    @app.route('/api/actor/bulk', methods=['PATCH'])
+    @requires_auth('patch:actor')
+    def update_actors(payload):
+        """
+        API end point to set the same values on several actors at once
+        Valid JSON body:
+        {
+            "ids": [1, 2, 3],
+            "set": {"gender": "Female"}
+        }
+        :param payload: Payload
+        :return: JSON response with the updated ids and the ids that do not exist
+        """
+        ids, values = get_bulk_changes(ACTOR_BULK_COLUMNS)
+        try:
+            updated, not_found = update_many(Actor, ids, values)
         except Exception as e:
-            db.session.rollback()
-            abort(422, str(e))
-        finally:
-            db.session.close()
+            abort_unprocessable(e)
+        return jsonify({
+            'success': True,
+            'updated': updated,
+            'not_found': not_found
+        })
+
+    @app.route('/internal/stats', methods=['GET'])
+    @requires_internal_token
+    def internal_stats():
+        """
+        Internal end point with the connection pool counters, replica health, response cache hit ratio
+        and signing key / token cache counters of the worker answering the request
+        Requires "Authorization: Bearer <INTERNAL_STATS_TOKEN>"
+        :return: JSON response
+        """
+        router = app.extensions.get('replica_router')
+        cache = app.extensions.get('response_cache')
+        return jsonify({
+            'success': True,
+            'pool': pool_stats.stats(Movie.query.session.get_bind().pool),
+            'replicas': router.stats() if router is not None else [],
+            'response_cache': cache.stats() if cache is not None else None,
+            **auth_stats()
+        })
+
+    @app.route('/metrics', methods=['GET'])
+    @requires_internal_token
+    def prometheus_metrics():
+        """
+        Request latency histograms (total and per phase) and status counts of all workers,
+        in the Prometheus text format
+        Requires "Authorization: Bearer <INTERNAL_STATS_TOKEN>"
+        :return: Prometheus text response
+        """
+        body, content_type = render_metrics()
+        return app.response_class(body, content_type=content_type)
 
     # Error handlers
     @app.errorhandler(400)
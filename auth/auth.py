@@ -1,15 +1,50 @@
-import json
+import hmac
+import logging
 import os
 from functools import wraps
-from urllib.request import urlopen
 
-from flask import request
+from flask import abort, current_app, g, request
 from jose import jwt
 
+from auth.jwks import JWKSFetchError, JWKSKeyStore, PinnedKeyStore
+from auth.token_cache import VerifiedTokenCache
+from timing import phase
+
+logger = logging.getLogger(__name__)
+
 AUTH0_DOMAIN = os.getenv('AUTH0_DOMAIN')
 ALGORITHMS = ['RS256']
 API_AUDIENCE = os.getenv('API_AUDIENCE')
 
+# Shared by every request handled by this process, see JWKSKeyStore.
+# Replaced by a PinnedKeyStore when the keys are loaded from a local file.
+jwks_store = JWKSKeyStore(
+    f'https://{AUTH0_DOMAIN}/.well-known/jwks.json',
+    ttl=int(os.getenv('JWKS_CACHE_TTL', 600)),
+    timeout=float(os.getenv('JWKS_FETCH_TIMEOUT', 2)))
+
+# Verified payloads of recently seen tokens, see VerifiedTokenCache
+token_cache = VerifiedTokenCache(
+    max_entries=int(os.getenv('TOKEN_CACHE_MAX_ENTRIES', 1024)),
+    max_bytes=int(os.getenv('TOKEN_CACHE_MAX_BYTES', 4 * 1024 * 1024)))
+
+
+def use_pinned_keys(path):
+    """
+    Loads the signing keys from a local jwks.json or PEM bundle and stops fetching them from Auth0
+    :param path: Path of the JWKS or PEM file
+    :return: Nothing
+    """
+    global jwks_store
+    jwks_store = PinnedKeyStore.from_file(path)
+
+
+def auth_stats():
+    """
+    :return: Counters of the signing key store and of the verified token cache of this process
+    """
+    return {'jwks': jwks_store.stats(), 'token_cache': token_cache.stats()}
+
 
 class AuthError(Exception):
     """
@@ -84,30 +119,27 @@ def verify_decode_jwt(token):
     :param token: a json web token (string)
     :return: the decoded payload
     """
-    json_url = urlopen(f'https://{AUTH0_DOMAIN}/.well-known/jwks.json')
-    jwks = json.loads(json_url.read())
     unverified_header = jwt.get_unverified_header(token)
-    rsa_key = {}
     if 'kid' not in unverified_header:
         raise AuthError({
             'code': 'invalid_header',
             'description': 'Authorization malformed.'
         }, 401)
 
-    for key in jwks['keys']:
-        if key['kid'] == unverified_header['kid']:
-            rsa_key = {
-                'kty': key['kty'],
-                'kid': key['kid'],
-                'use': key['use'],
-                'n': key['n'],
-                'e': key['e']
-            }
-    if rsa_key:
+    try:
+        key = jwks_store.get_key(unverified_header['kid'])
+    except JWKSFetchError as e:
+        logger.error('%s', e)
+        raise AuthError({
+            'code': 'jwks_unavailable',
+            'description': 'Unable to fetch the signing keys, please try again later.'
+        }, 503)
+
+    if key:
         try:
             payload = jwt.decode(
                 token,
-                rsa_key,
+                key,
                 algorithms=ALGORITHMS,
                 audience=API_AUDIENCE,
                 issuer='https://' + AUTH0_DOMAIN + '/'
@@ -127,7 +159,7 @@ def verify_decode_jwt(token):
                 'description': 'Incorrect claims. Please, check the audience and issuer.'
             }, 401)
         except Exception as e:
-            print(e)
+            logger.warning('Unable to parse authentication token: %s', e)
             raise AuthError({
                 'code': 'invalid_header',
                 'description': 'Unable to parse authentication token.'
@@ -148,11 +180,41 @@ def requires_auth(permission=''):
     def requires_auth_decorator(f):
         @wraps(f)
         def wrapper(*args, **kwargs):
-            token = get_token_auth_header()
-            payload = verify_decode_jwt(token)
-            check_permissions(permission, payload)
+            with phase('auth'):
+                token = get_token_auth_header()
+                payload = token_cache.get(token)
+                if payload is None:
+                    payload = verify_decode_jwt(token)
+                    token_cache.set(token, payload)
+                check_permissions(permission, payload)
+            # lets after_request hooks tell who sent the request, see replicas.init_replicas
+            g.token_payload = payload
             return f(payload, *args, **kwargs)
 
         return wrapper
 
     return requires_auth_decorator
+
+
+def requires_internal_token(f):
+    """
+    Protects the internal end points (stats) with the static INTERNAL_STATS_TOKEN of the app
+    instead of an Auth0 token. They answer 404 when no token is configured.
+    :param f: View function
+    :return: Wrapped view function
+    """
+
+    @wraps(f)
+    def wrapper(*args, **kwargs):
+        expected = current_app.config.get('INTERNAL_STATS_TOKEN')
+        if not expected:
+            abort(404)
+        token = get_token_auth_header()
+        if not hmac.compare_digest(token.encode(), expected.encode()):
+            raise AuthError({
+                'code': 'invalid_token',
+                'description': 'Invalid internal token.'
+            }, 401)
+        return f(*args, **kwargs)
+
+    return wrapper
@@ -0,0 +1,222 @@
+import base64
+import hashlib
+import json
+import re
+import threading
+import time
+from urllib.request import urlopen
+
+from jose import jwk
+
+PEM_BLOCK = re.compile(r'-----BEGIN ([A-Z ]+)-----.+?-----END \1-----', re.DOTALL)
+# optional line naming the kid of the PEM block below it, e.g. "kid: LpcGWXtVdmGxBbz5M0Tzf"
+PEM_KID = re.compile(r'^kid:[ \t]*(\S+)[ \t]*$', re.MULTILINE)
+
+
+class JWKSFetchError(Exception):
+    """
+    JWKSFetchError Exception
+    Raised when the key set could not be fetched and no cached copy is available
+    """
+
+
+def build_keys(jwks, algorithm='RS256'):
+    """
+    Builds the public key objects of a key set once, so they can be passed to jwt.decode as is
+    :param jwks: Parsed jwks.json document
+    :param algorithm: Signing algorithm the keys are used with
+    :return: {kid: Key}
+    """
+    return {
+        key['kid']: jwk.construct(key, algorithm)
+        for key in jwks['keys']
+        if key.get('use', 'sig') == 'sig'
+    }
+
+
+def jwk_thumbprint(key):
+    """
+    RFC 7638 thumbprint of an RSA public key, used as the kid of keys loaded from PEM files
+    :param key: Public Key object
+    :return: base64url encoded SHA-256 thumbprint
+    """
+    members = key.to_dict()
+    canonical = json.dumps(
+        {'e': members['e'], 'kty': members['kty'], 'n': members['n']},
+        separators=(',', ':'), sort_keys=True)
+    digest = hashlib.sha256(canonical.encode()).digest()
+    return base64.urlsafe_b64encode(digest).rstrip(b'=').decode()
+
+
+def load_keys_file(path, algorithm='RS256'):
+    """
+    Loads signing keys from a local jwks.json file or from a bundle of PEM public keys / certificates.
+    Keys loaded from PEM have their RFC 7638 thumbprint as kid, and also the kid of a
+    "kid: <kid>" line above the block, e.g. the kid the identity provider puts in its tokens.
+    :param path: Path of the JWKS or PEM file
+    :param algorithm: Signing algorithm the keys are used with
+    :return: {kid: Key}
+    """
+    with open(path) as f:
+        content = f.read()
+    if content.lstrip().startswith('{'):
+        return build_keys(json.loads(content), algorithm)
+
+    keys = {}
+    end = 0
+    for block in PEM_BLOCK.finditer(content):
+        key = jwk.construct(block.group(0), algorithm)
+        keys[jwk_thumbprint(key)] = key
+        labels = PEM_KID.findall(content, end, block.start())
+        if labels:
+            keys[labels[-1]] = key
+        end = block.end()
+    if not keys:
+        raise ValueError(f'No JWKS or PEM keys found in {path}')
+    return keys
+
+
+class PinnedKeyStore:
+    """
+    Signing keys loaded once from a local file, see load_keys_file.
+    Used for offline deployments where the request path must never touch the network.
+    A single pinned key is used whatever the kid of the token, as a PEM file does not
+    carry the kid of the identity provider, the signature is still verified against it.
+    """
+
+    def __init__(self, keys):
+        """
+        :param keys: {kid: Key}
+        """
+        self._keys = keys
+        distinct = list({id(key): key for key in keys.values()}.values())
+        self._fallback = distinct[0] if len(distinct) == 1 else None
+        self._count = len(distinct)
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'refreshes': 0, 'errors': 0}
+
+    @classmethod
+    def from_file(cls, path):
+        return cls(load_keys_file(path))
+
+    def get_key(self, kid):
+        key = self._keys.get(kid, self._fallback)
+        with self._lock:
+            self._stats['hits' if key is not None else 'misses'] += 1
+        return key
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, keys=self._count)
+
+
+class JWKSKeyStore:
+    """
+    Process wide cache of the JSON Web Key Set published by the identity provider.
+
+    Keys are served from memory for `ttl` seconds. Once the TTL has elapsed the
+    stale key set keeps being served while a background thread refetches it. A
+    synchronous refetch only happens on the very first lookup, or when a token
+    carries a `kid` that is not in the cached set (key rotation), and the
+    latter is rate limited by `min_refetch_interval`.
+    """
+
+    def __init__(self, url, ttl=600, timeout=2.0, min_refetch_interval=30):
+        """
+        :param url: URL of the jwks.json document
+        :param ttl: Seconds after which the key set is refreshed in the background
+        :param timeout: Socket timeout in seconds for a single fetch
+        :param min_refetch_interval: Minimum seconds between fetches triggered by unknown kids
+        """
+        self.url = url
+        self.ttl = ttl
+        self.timeout = timeout
+        self.min_refetch_interval = min_refetch_interval
+        self._keys = {}
+        self._fetched_at = None
+        # fetches finished so far, tells a thread waiting for _fetch_lock that another one fetched meanwhile
+        self._attempts = 0
+        self._refreshing = False
+        self._lock = threading.Lock()
+        self._fetch_lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'refreshes': 0, 'errors': 0}
+
+    def get_key(self, kid):
+        """
+        Looks up the signing key for a kid
+        :param kid: Key id from the token header
+        :return: The public Key object, or None if the identity provider does not know the kid
+        """
+        if self._fetched_at is None:
+            self.refresh()
+        elif time.monotonic() - self._fetched_at >= self.ttl:
+            self._refresh_in_background()
+
+        key = self._keys.get(kid)
+        if key is not None:
+            self._count('hits')
+            return key
+
+        self._count('misses')
+        if time.monotonic() - self._fetched_at >= self.min_refetch_interval:
+            self.refresh()
+            key = self._keys.get(kid)
+        return key
+
+    def refresh(self):
+        """
+        Fetches the key set synchronously. A failed fetch keeps the previously cached keys.
+        Concurrent callers share a single fetch: those that waited for it do not fetch again.
+        :return: Nothing
+        """
+        attempts = self._attempts
+        with self._fetch_lock:
+            if self._attempts != attempts:
+                if self._fetched_at is None:
+                    raise JWKSFetchError(f'Unable to fetch {self.url}')
+                return
+            try:
+                self._fetch()
+            finally:
+                self._attempts += 1
+
+    def _fetch(self):
+        try:
+            with urlopen(self.url, timeout=self.timeout) as response:
+                jwks = json.loads(response.read())
+            keys = build_keys(jwks)
+        except Exception as e:
+            self._count('errors')
+            if self._fetched_at is None:
+                raise JWKSFetchError(f'Unable to fetch {self.url}: {e}')
+            # keep serving the stale key set, retry after another ttl
+            self._fetched_at = time.monotonic()
+            return
+        self._keys = keys
+        self._fetched_at = time.monotonic()
+        self._count('refreshes')
+
+    def stats(self):
+        """
+        :return: Snapshot of the hit/miss/refresh/error counters
+        """
+        with self._lock:
+            return dict(self._stats, keys=len(self._keys))
+
+    def _refresh_in_background(self):
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+
+        def run():
+            try:
+                self.refresh()
+            finally:
+                self._refreshing = False
+
+        threading.Thread(target=run, name='jwks-refresh', daemon=True).start()
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
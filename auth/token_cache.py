@@ -0,0 +1,94 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+
+class VerifiedTokenCache:
+    """
+    Thread safe LRU cache of verified JWT payloads.
+
+    Entries are keyed by the SHA-256 digest of the raw token, so the tokens
+    themselves are never kept in memory, and expire at the token's `exp`
+    claim. The cache is bounded both by entry count and by an estimate of the
+    memory held by the cached payloads.
+    """
+
+    # rough per entry overhead of the digest key, the tuple and the dict slots
+    ENTRY_OVERHEAD = 200
+
+    def __init__(self, max_entries=1024, max_bytes=4 * 1024 * 1024):
+        """
+        :param max_entries: Maximum number of cached payloads, 0 disables the cache
+        :param max_bytes: Maximum estimated memory used by the cached payloads
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+    @staticmethod
+    def digest(token):
+        return hashlib.sha256(token.encode()).digest()
+
+    def get(self, token):
+        """
+        :param token: Raw bearer token
+        :return: The cached payload, or None if the token was not verified yet or has expired
+        """
+        key = self.digest(token)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._stats['misses'] += 1
+                return None
+            payload, expires_at, size = entry
+            if expires_at <= time.time():
+                self._remove(key)
+                self._stats['misses'] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats['hits'] += 1
+            return payload
+
+    def set(self, token, payload):
+        """
+        Caches a verified payload until its exp claim. Payloads without exp are not cached.
+        :param token: Raw bearer token
+        :param payload: Payload returned by verify_decode_jwt
+        :return: Nothing
+        """
+        expires_at = payload.get('exp')
+        if not self.max_entries or not isinstance(expires_at, (int, float)):
+            return
+        size = self.ENTRY_OVERHEAD + len(json.dumps(payload))
+        if size > self.max_bytes:
+            return
+        key = self.digest(token)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (payload, expires_at, size)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self._stats['evictions'] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        """
+        :return: Snapshot of the cache counters
+        """
+        with self._lock:
+            return dict(self._stats, entries=len(self._entries), bytes=self._bytes)
+
+    def _remove(self, key):
+        payload, expires_at, size = self._entries.pop(key)
+        self._bytes -= size
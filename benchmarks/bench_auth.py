@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+Measures the per request cost of requires_auth with and without the verified token cache.
+
+Usage: python benchmarks/bench_auth.py [iterations]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('AUTH0_DOMAIN', 'bench.auth0.local')
+os.environ.setdefault('API_AUDIENCE', 'bench')
+
+from cryptography.hazmat.primitives import serialization  # noqa: E402
+from cryptography.hazmat.primitives.asymmetric import rsa  # noqa: E402
+from flask import Flask  # noqa: E402
+from jose import jwk, jwt  # noqa: E402
+
+from auth import auth  # noqa: E402
+from auth.jwks import PinnedKeyStore, build_keys  # noqa: E402
+
+
+def make_token():
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    private_pem = private_key.private_bytes(
+        serialization.Encoding.PEM,
+        serialization.PrivateFormat.PKCS8,
+        serialization.NoEncryption()).decode()
+    public_pem = private_key.public_key().public_bytes(
+        serialization.Encoding.PEM,
+        serialization.PublicFormat.SubjectPublicKeyInfo).decode()
+    public_jwk = jwk.construct(public_pem, 'RS256').to_dict()
+    public_jwk.update(kid='bench', use='sig')
+    claims = {
+        'iss': f'https://{auth.AUTH0_DOMAIN}/',
+        'aud': auth.API_AUDIENCE,
+        'sub': 'auth0|bench',
+        'exp': int(time.time()) + 3600,
+        'permissions': ['get:movie'],
+    }
+    token = jwt.encode(claims, private_pem, algorithm='RS256', headers={'kid': 'bench'})
+    return token, public_jwk
+
+
+def run(iterations, use_cache):
+    app = Flask(__name__)
+    auth.token_cache.clear()
+    auth.token_cache.max_entries = 1024 if use_cache else 0
+
+    @auth.requires_auth('get:movie')
+    def view(payload):
+        return payload
+
+    with app.test_request_context(headers={'Authorization': f'Bearer {TOKEN}'}):
+        view()
+        started = time.perf_counter()
+        for _ in range(iterations):
+            view()
+        return (time.perf_counter() - started) / iterations
+
+
+if __name__ == '__main__':
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    TOKEN, public_jwk = make_token()
+    # pinned keys, so no network is involved in the measurement
+    auth.jwks_store = PinnedKeyStore(build_keys({'keys': [public_jwk]}))
+    without_cache = run(iterations, use_cache=False)
+    with_cache = run(iterations, use_cache=True)
+    print(f'requires_auth without token cache: {without_cache * 1e6:10.1f} us/request')
+    print(f'requires_auth with token cache:    {with_cache * 1e6:10.1f} us/request')
+    print(f'speedup: {without_cache / with_cache:.1f}x')
@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+"""
+Measures the CPU time spent compressing movie list responses against the bytes saved,
+for gzip and brotli at several levels and payload sizes.
+
+Usage: python benchmarks/bench_compression.py [comma separated row counts]
+"""
+import os
+import sys
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from compression import Encoder, brotli  # noqa: E402
+from serializers import dumps  # noqa: E402
+
+# (Content-Encoding, level)
+SETTINGS = [('gzip', 1), ('gzip', 6), ('gzip', 9), ('br', 1), ('br', 4), ('br', 6), ('br', 9)]
+
+
+def payload(rows):
+    start = date(1950, 1, 1)
+    movies = [{'id': i + 1, 'title': f'Movie {i}', 'release_date': start + timedelta(days=i % 25000)}
+              for i in range(rows)]
+    return dumps({'success': True, 'movies': movies, 'next_cursor': None})
+
+
+def measure(body, encoding, level):
+    repeat = max(1, 2000000 // len(body))
+    started = time.perf_counter()
+    for _ in range(repeat):
+        encoder = Encoder(encoding, level)
+        compressed = encoder.compress(body) + encoder.finish()
+    return (time.perf_counter() - started) / repeat, len(compressed)
+
+
+if __name__ == '__main__':
+    sizes = [int(size) for size in (sys.argv[1] if len(sys.argv) > 1 else '1,10,100,1000,10000,100000').split(',')]
+    settings = [setting for setting in SETTINGS if setting[0] == 'gzip' or brotli is not None]
+    print(f'{"rows":>8} {"bytes":>10} {"encoding":>9} {"compressed":>11} {"ratio":>7} {"time":>11} {"MB/s":>8}')
+    for size in sizes:
+        body = payload(size)
+        for encoding, level in settings:
+            elapsed, compressed = measure(body, encoding, level)
+            print(f'{size:>8} {len(body):>10} {encoding + str(level):>9} {compressed:>11} '
+                  f'{len(body) / compressed:>6.1f}x {elapsed * 1000:>8.3f} ms {len(body) / elapsed / 1e6:>8.1f}')
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""
+Compares the import of a generated movie CSV through bulk_io.import_rows with inserting
+and committing the rows one at a time, like manage.py add_test_data.
+
+Usage: python benchmarks/bench_import.py [number of rows]
+Set DATABASE_URL to benchmark against Postgres (COPY), a SQLite file in a temporary
+directory is used otherwise (executemany).
+"""
+import io
+import os
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask  # noqa: E402
+
+from bulk_io import import_rows, read_rows  # noqa: E402
+from models import Movie, db, setup_db  # noqa: E402
+
+# rows inserted one by one, the per row time is extrapolated to the full size
+ONE_BY_ONE_ROWS = 2000
+
+
+def movie_csv(rows):
+    start = date(1950, 1, 1)
+    lines = ['title,release_date\n']
+    lines.extend(f'Movie {i},{start + timedelta(days=i % 25000)}\n' for i in range(rows))
+    return ''.join(lines)
+
+
+def one_by_one(content):
+    started = time.perf_counter()
+    for _, row in read_rows(io.StringIO(content), 'csv'):
+        Movie(**Movie.columns_from_json(row)).insert()
+        db.session.commit()
+    return time.perf_counter() - started
+
+
+def batched(content):
+    started = time.perf_counter()
+    import_rows(Movie, 'title', read_rows(io.StringIO(content), 'csv'))
+    return time.perf_counter() - started
+
+
+if __name__ == '__main__':
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    directory = tempfile.mkdtemp()
+    app = Flask(__name__)
+    setup_db(app, os.getenv('DATABASE_URL') or f'sqlite:///{directory}/bench.db')
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        elapsed = one_by_one(movie_csv(ONE_BY_ONE_ROWS))
+        print(f'one by one: {ONE_BY_ONE_ROWS} rows in {elapsed:.2f} s, {ONE_BY_ONE_ROWS / elapsed:>9.0f} rows/s')
+        db.drop_all()
+        db.create_all()
+        elapsed = batched(movie_csv(rows))
+        print(f'import:     {rows} rows in {elapsed:.2f} s, {rows / elapsed:>9.0f} rows/s')
+        db.drop_all()
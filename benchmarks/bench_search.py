@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""
+Measures the latency of GET /api/search style queries (search.search) on a large catalog.
+
+Usage: python benchmarks/bench_search.py [number of movies] [number of actors]
+Set DATABASE_URL to benchmark against Postgres, an in memory SQLite database is used otherwise.
+"""
+import os
+import random
+import string
+import sys
+import time
+from datetime import date
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask  # noqa: E402
+
+from models import Actor, Movie, db, setup_db  # noqa: E402
+from search import search  # noqa: E402
+
+QUERIES = ['interstellar', 'intersteller', 'the godfather', 'amitabh', 'shahruk khan', 'zzqx']
+
+
+def random_words(rng, count):
+    return ' '.join(''.join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(3, 9)))
+                    for _ in range(count)).title()
+
+
+def seed(movies, actors):
+    db.drop_all()
+    db.create_all()
+    rng = random.Random(42)
+    for model, rows, make in [
+            (Movie, movies, lambda i: {'title': f'{random_words(rng, 3)} {i}', 'release_date': date(2000, 1, 1)}),
+            (Actor, actors, lambda i: {'name': f'{random_words(rng, 2)} {i}', 'age': 30, 'gender': 'Female'})]:
+        for start in range(0, rows, 10000):
+            db.session.execute(model.__table__.insert(), [make(i) for i in range(start, min(start + 10000, rows))])
+    db.session.execute(Movie.__table__.insert(), [
+        {'title': 'Interstellar', 'release_date': date(2014, 11, 7)},
+        {'title': 'The Godfather', 'release_date': date(1972, 3, 24)}])
+    db.session.execute(Actor.__table__.insert(), [
+        {'name': 'Amitabh Bachchan', 'age': 78, 'gender': 'Male'},
+        {'name': 'Shahrukh Khan', 'age': 55, 'gender': 'Male'}])
+    db.session.commit()
+
+
+if __name__ == '__main__':
+    movies = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    actors = int(sys.argv[2]) if len(sys.argv) > 2 else movies
+    app = Flask(__name__)
+    app.config.update(SEARCH_MAX_RESULTS=1000, SEARCH_MIN_SIMILARITY=0.5)
+    setup_db(app, os.getenv('DATABASE_URL', 'sqlite://'))
+    with app.app_context():
+        seed(movies, actors)
+        print(f'{movies} movies, {actors} actors')
+        for q in QUERIES:
+            started = time.perf_counter()
+            hits, _ = search(q, ['movie', 'actor'], 20)
+            elapsed = time.perf_counter() - started
+            best = hits[0]['name'] if hits else '-'
+            print(f'{q:>15} {elapsed * 1000:>8.1f} ms  {len(hits):>3} hits  best: {best}')
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""
+Compares building the movie list response through ORM objects, Movie.serialize() and
+jsonify with the row tuple path (RowSerializer + serializers.dumps).
+
+Usage: python benchmarks/bench_serialization.py [comma separated row counts]
+"""
+import os
+import sys
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask, jsonify  # noqa: E402
+
+from models import Movie, db, setup_db  # noqa: E402
+from serializers import RowSerializer, json_response  # noqa: E402
+
+
+def seed(rows):
+    db.drop_all()
+    db.create_all()
+    start = date(1950, 1, 1)
+    table = Movie.__table__
+    batch = []
+    for i in range(rows):
+        batch.append({'title': f'Movie {i}', 'release_date': start + timedelta(days=i % 25000)})
+        if len(batch) == 10000:
+            db.session.execute(table.insert(), batch)
+            batch = []
+    if batch:
+        db.session.execute(table.insert(), batch)
+    db.session.commit()
+
+
+def orm_path():
+    movies = Movie.query.order_by(Movie.id).all()
+    return jsonify({'success': True, 'movies': [movie.serialize() for movie in movies]})
+
+
+def row_path():
+    serialize = RowSerializer(Movie)
+    rows = serialize.query().order_by(Movie.id).all()
+    return json_response({'success': True, 'movies': [serialize(row) for row in rows]})
+
+
+def measure(path):
+    db.session.remove()
+    started = time.perf_counter()
+    response = path()
+    elapsed = time.perf_counter() - started
+    return elapsed, len(response.get_data())
+
+
+if __name__ == '__main__':
+    sizes = [int(size) for size in (sys.argv[1] if len(sys.argv) > 1 else '1000,100000,1000000').split(',')]
+    app = Flask(__name__)
+    setup_db(app, 'sqlite://')
+    with app.app_context():
+        print(f'{"rows":>10} {"orm + jsonify":>16} {"row tuples":>16} {"speedup":>8}')
+        for size in sizes:
+            seed(size)
+            orm_time, orm_bytes = measure(orm_path)
+            row_time, row_bytes = measure(row_path)
+            print(f'{size:>10} {orm_time * 1000:>13.1f} ms {row_time * 1000:>13.1f} ms {orm_time / row_time:>7.1f}x')
@@ -0,0 +1,162 @@
+from flask import abort, current_app, request
+
+from models import (ACTOR_JSON_COLUMNS, BATCH_SIZE, MOVIE_JSON_COLUMNS, db, bulk_delete, bulk_insert,
+                    bulk_update, parse_columns)
+
+
+# column: (parser, expected format) of the columns a bulk PATCH can set. Titles and
+# names are unique, so they cannot be set to the same value on several rows.
+MOVIE_BULK_COLUMNS = {
+    'release_date': MOVIE_JSON_COLUMNS['release_date'],
+}
+ACTOR_BULK_COLUMNS = {
+    'age': ACTOR_JSON_COLUMNS['age'],
+    'gender': ACTOR_JSON_COLUMNS['gender'],
+}
+
+
+def get_bulk_items():
+    """
+    Reads the JSON list of a bulk request, its length is capped at BULK_MAX_ITEMS
+    :return: List of items
+    """
+    body = request.get_json()
+    if not body:
+        abort(400, 'JSON passed is empty')
+    if not isinstance(body, list):
+        abort(400, 'JSON passed must be a list')
+    max_items = current_app.config['BULK_MAX_ITEMS']
+    if len(body) > max_items:
+        abort(400, f'At most {max_items} items can be sent at once')
+    return body
+
+
+def check_bulk_ids(ids):
+    """
+    Validates the ids of a bulk PATCH or DELETE, their number is capped at BULK_MAX_ITEMS
+    :param ids: List of ids
+    :return: The ids without duplicates, in request order
+    """
+    if not ids:
+        abort(400, '"ids" is missing or empty')
+    if not isinstance(ids, list) or not all(isinstance(row_id, int) and not isinstance(row_id, bool)
+                                            for row_id in ids):
+        abort(400, f'Invalid ids {ids}, expected a list of integers')
+    ids = list(dict.fromkeys(ids))
+    max_items = current_app.config['BULK_MAX_ITEMS']
+    if len(ids) > max_items:
+        abort(400, f'At most {max_items} ids can be sent at once')
+    return ids
+
+
+def get_bulk_ids():
+    """
+    Reads the comma separated "ids" query parameter of a bulk DELETE
+    :return: List of ids
+    """
+    value = request.args.get('ids', '')
+    try:
+        ids = [int(row_id) for row_id in value.split(',') if row_id.strip()]
+    except ValueError:
+        abort(400, f'Invalid ids {value}, expected comma separated integers')
+    return check_bulk_ids(ids)
+
+
+def get_bulk_changes(columns):
+    """
+    Reads the JSON body of a bulk PATCH: {"ids": [1, 2], "set": {"column": value}}
+    :param columns: MOVIE_BULK_COLUMNS or ACTOR_BULK_COLUMNS
+    :return: (ids, column dict of the values to set)
+    """
+    body = request.get_json()
+    if not body:
+        abort(400, 'JSON passed is empty')
+    if not isinstance(body, dict) or not isinstance(body.get('set'), dict) or not body['set']:
+        abort(400, 'Invalid JSON, "set" must be an object of the columns to change')
+    ids = check_bulk_ids(body.get('ids'))
+    for name in body['set']:
+        if name not in columns:
+            abort(400, f'Invalid column {name}, expected one of {",".join(columns)}')
+    try:
+        values = parse_columns(body['set'], columns)
+    except ValueError as e:
+        abort(400, str(e))
+    return ids, values
+
+
+def update_many(model, ids, values):
+    """
+    Applies a bulk PATCH within the current transaction
+    :param model: Movie or Actor
+    :param ids: Ids returned by get_bulk_changes
+    :param values: Column dict returned by get_bulk_changes
+    :return: (updated ids, ids not found), in request order
+    """
+    return _split_found(ids, bulk_update(model, ids, values))
+
+
+def delete_many(model, ids):
+    """
+    Applies a bulk DELETE within the current transaction
+    :param model: Movie or Actor
+    :param ids: Ids returned by get_bulk_ids
+    :return: (deleted ids, ids not found), in request order
+    """
+    return _split_found(ids, bulk_delete(model, ids))
+
+
+def _split_found(ids, found):
+    return [row_id for row_id in ids if row_id in found], [row_id for row_id in ids if row_id not in found]
+
+
+def bulk_create(model, items, key):
+    """
+    Creates the valid, non duplicate items of a bulk request within the current transaction.
+    Duplicates are looked up with one set based query per BATCH_SIZE items instead of one query per item.
+    :param model: Movie or Actor
+    :param items: Items returned by get_bulk_items
+    :param key: Name of the column that has to be unique
+    :return: One result per item, in request order
+    """
+    name = model.__name__
+    results = [None] * len(items)
+    rows = {}
+    for index, item in enumerate(items):
+        try:
+            row = model.columns_from_json(item)
+        except ValueError as e:
+            results[index] = {'index': index, 'success': False, 'error': 400, 'message': str(e)}
+            continue
+        if row[key] in rows:
+            results[index] = {
+                'index': index, 'success': False, 'error': 409,
+                'message': f'{name} with name {row[key]} is present more than once.'}
+            continue
+        rows[row[key]] = (index, row)
+
+    if not rows:
+        return results
+
+    column = getattr(model, key)
+    values = list(rows)
+    existing = set()
+    for start in range(0, len(values), BATCH_SIZE):
+        existing.update(value for value, in db.session.query(column)
+                        .filter(column.in_(values[start:start + BATCH_SIZE])))
+    for value in existing:
+        index, row = rows.pop(value)
+        results[index] = {
+            'index': index, 'success': False, 'error': 409,
+            'message': f'{name} with name {value} already exists.'}
+
+    ids = bulk_insert(model, [row for index, row in rows.values()], key)
+
+    for value, (index, row) in rows.items():
+        if value not in ids:
+            # inserted by a concurrent request since the duplicate check
+            results[index] = {
+                'index': index, 'success': False, 'error': 409,
+                'message': f'{name} with name {value} already exists.'}
+            continue
+        results[index] = {'index': index, 'success': True, name.lower(): dict(row, id=ids[value])}
+    return results
@@ -0,0 +1,323 @@
+import csv
+import io
+import json
+import time
+
+from sqlalchemy import bindparam, text
+
+from models import BATCH_SIZE, Actor, Movie, TableVersion, db, is_postgres
+from serializers import dumps, get_serializer
+
+# table name accepted by manage.py import and export: (model, unique column matching duplicates)
+TABLES = {
+    'movies': (Movie, 'title'),
+    'actors': (Actor, 'name'),
+}
+
+# parsers of the CSV columns that are not strings, JSONL values already have their type
+CSV_CONVERTERS = {'age': int}
+
+# rows per COPY on Postgres, committed together
+COPY_BATCH_SIZE = 10000
+# rows per executemany elsewhere, and ids per IN list, below the bound parameter
+# limit of older SQLite versions
+INSERT_BATCH_SIZE = BATCH_SIZE
+
+# rows fetched per round trip from the server side cursor of an export, written at once
+EXPORT_BATCH_SIZE = 1000
+
+# invalid rows reported with their line number, the others are only counted
+MAX_REPORTED_ERRORS = 10
+# seconds between two progress reports
+PROGRESS_INTERVAL = 2
+
+
+class ImportStats:
+    """
+    Counters of an import, rows are either inserted, updated, skipped as duplicates or invalid
+    """
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.read = 0
+        self.inserted = 0
+        self.updated = 0
+        self.duplicates = 0
+        self.invalid = 0
+
+    @property
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+    @property
+    def rate(self):
+        """
+        :return: Rows read per second
+        """
+        return self.read / max(self.elapsed, 1e-9)
+
+    def __str__(self):
+        return (f'{self.read} rows in {self.elapsed:.1f} s ({self.rate:.0f} rows/s): {self.inserted} inserted, '
+                f'{self.updated} updated, {self.duplicates} duplicates skipped, {self.invalid} invalid')
+
+
+def detect_format(path):
+    """
+    :param path: Path of the file to import
+    :return: "csv" or "jsonl", from the file extension
+    """
+    name = path.lower()
+    if name.endswith('.csv'):
+        return 'csv'
+    if name.endswith(('.jsonl', '.ndjson')):
+        return 'jsonl'
+    raise ValueError(f'Cannot tell the format of {path}, expected a .csv or .jsonl file or --format')
+
+
+def read_rows(file, file_format):
+    """
+    Streams the rows of a CSV file with a header line, or of a JSONL file with one object per line
+    :param file: Text file object
+    :param file_format: "csv" or "jsonl"
+    :return: Generator of (line number, row), rows are validated by the model
+    """
+    if file_format == 'csv':
+        reader = csv.DictReader(file)
+        for row in reader:
+            yield reader.line_num, {name: _convert(name, value) for name, value in row.items()}
+        return
+    for number, line in enumerate(file, 1):
+        if not line.strip():
+            continue
+        try:
+            yield number, json.loads(line)
+        except ValueError:
+            # rejected by columns_from_json like any row that is not an object
+            yield number, line
+
+
+def _convert(name, value):
+    try:
+        return CSV_CONVERTERS[name](value) if name in CSV_CONVERTERS else value
+    except ValueError:
+        # left as a string for columns_from_json to reject
+        return value
+
+
+def import_rows(model, key, rows, on_duplicate='skip', batch_size=None, report=None):
+    """
+    Imports rows in batches: on Postgres each batch is COPY'd into a temporary table and
+    moved with a single INSERT ... ON CONFLICT, other backends insert it with executemany
+    after looking up which keys exist. Each batch is committed on its own, so memory does
+    not grow with the number of rows, and an interrupted import can be run again.
+    Rows of a key repeated in the file are handled like a row already in the table: with
+    "skip" the first row of the key wins, with "update" the last one does.
+    :param model: Movie or Actor
+    :param key: Unique column matching duplicates, see TABLES
+    :param rows: Iterable of (line number, row), see read_rows
+    :param on_duplicate: "skip" leaves existing rows as they are, "update" overwrites them
+    :param batch_size: Rows per batch, defaults to COPY_BATCH_SIZE or INSERT_BATCH_SIZE
+    :param report: Function called with the invalid rows and the progress, as text
+    :return: ImportStats
+    """
+    write = _copy_batch if is_postgres() else _insert_batch
+    batch_size = batch_size or (COPY_BATCH_SIZE if is_postgres() else INSERT_BATCH_SIZE)
+    stats = ImportStats()
+    reported = stats.started
+    batch = []
+    for line, row in rows:
+        stats.read += 1
+        try:
+            batch.append(model.columns_from_json(row))
+        except ValueError as e:
+            stats.invalid += 1
+            if report and stats.invalid <= MAX_REPORTED_ERRORS:
+                report(f'Line {line}: {e}')
+            continue
+        if len(batch) >= batch_size:
+            _commit_batch(write, model, key, batch, on_duplicate, stats)
+            batch = []
+            if report and time.monotonic() - reported >= PROGRESS_INTERVAL:
+                report(str(stats))
+                reported = time.monotonic()
+    if batch:
+        _commit_batch(write, model, key, batch, on_duplicate, stats)
+    if report and stats.invalid > MAX_REPORTED_ERRORS:
+        report(f'{stats.invalid - MAX_REPORTED_ERRORS} more invalid rows')
+    return stats
+
+
+def _commit_batch(write, model, key, batch, on_duplicate, stats):
+    try:
+        inserted, updated = write(model, key, batch, on_duplicate)
+        if inserted or updated:
+            TableVersion.bump(model.__tablename__)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    stats.inserted += inserted
+    stats.updated += updated
+    stats.duplicates += len(batch) - inserted - updated
+
+
+def _copy_batch(model, key, rows, on_duplicate):
+    # COPY is not checked against the unique index, so the batch goes to a temporary table
+    # first, emptied by every commit, then DISTINCT ON keeps the first row of each key, or
+    # the last one when updating
+    table = model.__table__
+    columns = list(rows[0])
+    names = ', '.join(columns)
+    staging = f'import_{table.name}'
+    dialect = db.session.get_bind().dialect
+    types = ', '.join(f'{name} {table.c[name].type.compile(dialect=dialect)}' for name in columns)
+    db.session.execute(text(f'CREATE TEMPORARY TABLE IF NOT EXISTS {staging} '
+                            f'(position integer, {types}) ON COMMIT DELETE ROWS'))
+
+    buffer = io.StringIO()
+    # strings are quoted and None is not, so COPY reads None as NULL and '' as an empty string
+    writer = csv.writer(buffer, quoting=csv.QUOTE_NONNUMERIC)
+    writer.writerows([position] + [row[name] for name in columns] for position, row in enumerate(rows))
+    buffer.seek(0)
+    cursor = db.session.connection().connection.cursor()
+    try:
+        cursor.copy_expert(f'COPY {staging} (position, {names}) FROM STDIN WITH (FORMAT csv)', buffer)
+    finally:
+        cursor.close()
+
+    if on_duplicate == 'update':
+        conflict = 'DO UPDATE SET ' + ', '.join(f'{name} = EXCLUDED.{name}' for name in columns if name != key)
+        order = 'DESC'
+    else:
+        conflict = 'DO NOTHING'
+        order = 'ASC'
+    # xmax is 0 for inserted rows and set for updated ones
+    inserted, updated = db.session.execute(text(
+        f'WITH written AS ('
+        f'INSERT INTO {table.name} ({names}) '
+        f'SELECT DISTINCT ON ({key}) {names} FROM {staging} ORDER BY {key}, position {order} '
+        f'ON CONFLICT ({key}) {conflict} '
+        f'RETURNING xmax = 0 AS inserted) '
+        f'SELECT count(*) FILTER (WHERE inserted), count(*) FILTER (WHERE NOT inserted) FROM written')).first()
+    return inserted, updated
+
+
+def _insert_batch(model, key, rows, on_duplicate):
+    table = model.__table__
+    if on_duplicate == 'update':
+        kept = {row[key]: row for row in rows}
+    else:
+        kept = {}
+        for row in rows:
+            kept.setdefault(row[key], row)
+    keys = list(kept)
+    existing = set()
+    for start in range(0, len(keys), INSERT_BATCH_SIZE):
+        existing.update(value for value, in db.session.query(table.c[key])
+                        .filter(table.c[key].in_(keys[start:start + INSERT_BATCH_SIZE])))
+    new = [row for value, row in kept.items() if value not in existing]
+    if new:
+        db.session.execute(table.insert(), new)
+    if on_duplicate != 'update' or not existing:
+        return len(new), 0
+
+    # bound parameters cannot be named after the columns they set
+    columns = [name for name in rows[0] if name != key]
+    statement = table.update().where(table.c[key] == bindparam('_key')) \
+        .values({name: bindparam(f'_{name}') for name in columns})
+    db.session.execute(statement, [dict({f'_{name}': kept[value][name] for name in columns}, _key=value)
+                                   for value in existing])
+    return len(new), len(existing)
+
+
+class ExportStats:
+    """
+    Counters of an export
+    """
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.written = 0
+        self.last_id = None
+
+    @property
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+    @property
+    def rate(self):
+        """
+        :return: Rows written per second
+        """
+        return self.written / max(self.elapsed, 1e-9)
+
+    def __str__(self):
+        return f'{self.written} rows in {self.elapsed:.1f} s ({self.rate:.0f} rows/s), last id {self.last_id}'
+
+
+def _csv_lines(names, rows):
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    return buffer.getvalue().encode()
+
+
+def _jsonl_lines(names, rows):
+    return b''.join(dumps(dict(zip(names, row))) + b'\n' for row in rows)
+
+
+def _columnar_block(names, rows):
+    return dumps(dict(zip(names, map(list, zip(*rows))))) + b'\n'
+
+
+# export format: function encoding a batch of rows
+EXPORT_FORMATS = {
+    'csv': _csv_lines,
+    'jsonl': _jsonl_lines,
+    # one JSON object of column arrays per EXPORT_BATCH_SIZE rows, e.g.
+    # {"id": [1, 2], "title": ["Ludo", "Challang"], "release_date": ["2020-07-11", "2020-07-11"]}
+    'columnar': _columnar_block,
+}
+
+
+def export_rows(model, file, file_format, since_id=None, report=None):
+    """
+    Writes every row of a table in id order. Rows come off a server side cursor (yield_per)
+    and are encoded and written EXPORT_BATCH_SIZE at a time, so memory does not grow with
+    the size of the table.
+    :param model: Movie or Actor
+    :param file: Binary file object, e.g. a gzip.GzipFile
+    :param file_format: "csv" (with a header line), "jsonl" or "columnar", see EXPORT_FORMATS
+    :param since_id: Only rows with a greater id are written, for incremental exports
+    :param report: Function called with the progress, as text
+    :return: ExportStats, its last_id is the since_id of the next incremental export
+    """
+    serialize = get_serializer(model)
+    query = serialize.query()
+    if since_id is not None:
+        query = query.filter(model.id > since_id)
+    rows = query.order_by(model.id).yield_per(EXPORT_BATCH_SIZE)
+    encode = EXPORT_FORMATS[file_format]
+    if file_format == 'csv':
+        file.write(_csv_lines(serialize.names, [serialize.names]))
+
+    stats = ExportStats()
+    stats.last_id = since_id
+    reported = stats.started
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == EXPORT_BATCH_SIZE:
+            _write_batch(file, encode, serialize.names, batch, stats)
+            batch = []
+            if report and time.monotonic() - reported >= PROGRESS_INTERVAL:
+                report(str(stats))
+                reported = time.monotonic()
+    if batch:
+        _write_batch(file, encode, serialize.names, batch, stats)
+    return stats
+
+
+def _write_batch(file, encode, names, batch, stats):
+    file.write(encode(names, batch))
+    stats.written += len(batch)
+    stats.last_id = batch[-1][0]
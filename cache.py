@@ -0,0 +1,243 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from urllib.parse import urlparse
+
+from flask import current_app, g, request
+
+from conditional import request_tables
+from metrics import RESPONSE_CACHE_LOOKUPS
+from models import change_listeners
+
+# response headers kept with a cached body
+CACHED_HEADERS = ('Content-Type', 'ETag', 'Vary')
+
+
+class LocalCache:
+    """
+    In process LRU cache with the subset of the cachelib interface used by this app.
+    Bounded by entry count and by the size of the cached values. Counters (inc) are
+    kept apart and never evicted. Only consistent within a single worker process,
+    use a shared backend otherwise.
+    """
+
+    def __init__(self, max_entries=1024, max_bytes=16 * 1024 * 1024, default_timeout=300):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.default_timeout = default_timeout
+        self._entries = OrderedDict()
+        self._counters = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            if key in self._counters:
+                return self._counters[key]
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if self._expired(entry):
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def get_many(self, *keys):
+        return [self.get(key) for key in keys]
+
+    def set(self, key, value, timeout=None):
+        with self._lock:
+            return self._store(key, value, timeout)
+
+    def add(self, key, value, timeout=None):
+        """
+        Stores a value only if the key is not present yet
+        :return: True if the value was stored
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and not self._expired(entry):
+                return False
+            return self._store(key, value, timeout)
+
+    def delete(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+                return True
+        return False
+
+    def inc(self, key, delta=1):
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + delta
+            return self._counters[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._counters.clear()
+            self._bytes = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _store(self, key, value, timeout):
+        timeout = self.default_timeout if timeout is None else timeout
+        expires_at = time.monotonic() + timeout if timeout else None
+        size = self._size(value)
+        if size > self.max_bytes:
+            return False
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (value, expires_at, size)
+        self._bytes += size
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            self._remove(next(iter(self._entries)))
+            self.evictions += 1
+        return True
+
+    def _remove(self, key):
+        value, expires_at, size = self._entries.pop(key)
+        self._bytes -= size
+
+    @staticmethod
+    def _expired(entry):
+        return entry[1] is not None and entry[1] <= time.monotonic()
+
+    @staticmethod
+    def _size(value):
+        if isinstance(value, tuple):
+            return sum(len(part) for part in value if isinstance(part, (bytes, str)))
+        return len(value) if isinstance(value, (bytes, str)) else 0
+
+
+def create_cache_backend(url, default_timeout=300, max_entries=1024, max_bytes=16 * 1024 * 1024):
+    """
+    Builds the cache backend described by a URL
+    :param url: "local" for an in process LocalCache, "redis://host:port/db" or
+                "memcached://host:port" for a cache shared by all workers (needs cachelib),
+                "none" or empty to disable caching
+    :return: Backend instance or None
+    """
+    if not url or url == 'none':
+        return None
+    if url == 'local':
+        return LocalCache(max_entries=max_entries, max_bytes=max_bytes, default_timeout=default_timeout)
+
+    parsed = urlparse(url)
+    if parsed.scheme == 'redis':
+        from cachelib import RedisCache
+        return RedisCache(
+            host=parsed.hostname, port=parsed.port or 6379, password=parsed.password,
+            db=int(parsed.path.lstrip('/') or 0), default_timeout=default_timeout, key_prefix='fsnd:')
+    if parsed.scheme == 'memcached':
+        from cachelib import MemcachedCache
+        return MemcachedCache([parsed.netloc], default_timeout=default_timeout, key_prefix='fsnd:')
+    raise ValueError(f'Unsupported cache backend {url}')
+
+
+class ResponseCache:
+    """
+    Caches full responses of read end points, keyed by end point, query string and media type.
+
+    Every key embeds a generation counter per table the response is built from. The
+    counters live in the backend and are incremented after each commit that changed
+    the table, so only the responses depending on that table are invalidated, and with
+    a shared backend the invalidation reaches every worker.
+    """
+
+    def __init__(self, backend, timeout=None):
+        """
+        :param backend: LocalCache or a cachelib cache
+        :param timeout: Seconds a response is kept, None for the backend default
+        """
+        self.backend = backend
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        change_listeners.add(self)
+
+    def tables_changed(self, tables):
+        for table in tables:
+            # memcached does not increment missing keys
+            if not self.backend.inc(f'generation:{table}'):
+                self.backend.set(f'generation:{table}', 1, timeout=0)
+
+    def key(self, tables):
+        generations = self.backend.get_many(*(f'generation:{table}' for table in tables))
+        args = '&'.join(f'{name}={value}' for name, value in sorted(request.args.items(multi=True)))
+        raw = '{}:{}:{}?{}:{}'.format(
+            ','.join(tables), ','.join(str(generation or 0) for generation in generations),
+            request.path, args, request.headers.get('Accept', ''))
+        return 'response:' + hashlib.sha1(raw.encode()).hexdigest()
+
+    def get(self, key):
+        cached = self.backend.get(key)
+        with self._lock:
+            if cached is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        RESPONSE_CACHE_LOOKUPS.labels(request.url_rule.rule, 'miss' if cached is None else 'hit').inc()
+        return cached
+
+    def set(self, key, response):
+        headers = [(name, response.headers[name]) for name in CACHED_HEADERS if name in response.headers]
+        self.backend.set(key, (response.get_data(), response.status_code, headers), timeout=self.timeout)
+
+    def stats(self):
+        """
+        :return: Hit/miss counters and hit ratio of this process
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            stats = {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / lookups if lookups else 0.0,
+            }
+        if isinstance(self.backend, LocalCache):
+            stats.update(entries=len(self.backend), evictions=self.backend.evictions)
+        return stats
+
+
+def cached(*tables, related=None):
+    """
+    Serves a GET end point from the app's response cache. Conditional requests are
+    answered from the cached ETag, so a hit does not touch the database at all.
+    Responses read from a replica are not stored: a lagging replica would store data
+    older than the generations in the key. Clients that wrote recently skip the lookup
+    and read their writes from the primary, see replicas.read_replica.
+    Apply below requires_auth and read_replica, and above versioned.
+    :param tables: Names of the tables the response is built from
+    :param related: Tables of the relations that can be embedded, see conditional.request_tables
+    :return: Decorator
+    """
+
+    def cached_decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            cache = current_app.extensions.get('response_cache')
+            if cache is None:
+                return f(*args, **kwargs)
+
+            key = cache.key(request_tables(tables, related))
+            hit = None if g.get('wrote_recently') else cache.get(key)
+            if hit is not None:
+                body, status, headers = hit
+                response = current_app.response_class(body, status=status, headers=headers)
+                return response.make_conditional(request)
+
+            response = current_app.make_response(f(*args, **kwargs))
+            if response.status_code == 200 and not response.is_streamed and g.get('read_replica') is None:
+                cache.set(key, response)
+            return response
+
+        return wrapper
+
+    return cached_decorator
@@ -0,0 +1,112 @@
+from flask import abort, request
+
+from models import BATCH_SIZE, Actor, Movie, TableVersion, db, movie_actors
+from serializers import get_serializer
+
+# relation name: (related model, casting column of the listed model, casting column of the related model)
+RELATIONS = {
+    Movie: {'actors': (Actor, movie_actors.c.movie_id, movie_actors.c.actor_id)},
+    Actor: {'movies': (Movie, movie_actors.c.actor_id, movie_actors.c.movie_id)},
+}
+
+# relation name: tables an embedded relation is read from, see conditional.request_tables
+MOVIE_RELATED_TABLES = {'actors': ('actors', 'movie_actors')}
+ACTOR_RELATED_TABLES = {'movies': ('movies', 'movie_actors')}
+
+# ids per IN list, below the bound parameter limit of older SQLite versions
+LOAD_BATCH_SIZE = BATCH_SIZE
+
+
+def get_includes(model):
+    """
+    Reads the comma separated "include" query parameter, the relations to embed in each row
+    :param model: Movie or Actor
+    :return: Tuple of relation names, empty when nothing is included
+    """
+    include = request.args.get('include', None)
+    if not include:
+        return ()
+    names = [name.strip() for name in include.split(',') if name.strip()]
+    relations = RELATIONS[model]
+    unknown = [name for name in names if name not in relations]
+    if unknown or not names:
+        abort(400, f'Invalid include {",".join(unknown)}, expected a subset of {",".join(relations)}')
+    return tuple(dict.fromkeys(names))
+
+
+def load_related(model, name, ids):
+    """
+    Loads a relation of many rows at once: one query per LOAD_BATCH_SIZE ids, joining the
+    casting table to the related table, instead of one query per row
+    :param model: Movie or Actor
+    :param name: Relation name, see RELATIONS
+    :param ids: Ids of the rows
+    :return: {id: list of related rows as dicts}, rows without relations are missing
+    """
+    related, owner_key, related_key = RELATIONS[model][name]
+    serialize = get_serializer(related)
+    loaded = {}
+    for start in range(0, len(ids), LOAD_BATCH_SIZE):
+        rows = db.session.query(owner_key, *serialize.columns) \
+            .select_from(movie_actors) \
+            .join(related, related.id == related_key) \
+            .filter(owner_key.in_(ids[start:start + LOAD_BATCH_SIZE])) \
+            .order_by(owner_key, related.id)
+        for row in rows:
+            loaded.setdefault(row[0], []).append(serialize(row[1:]))
+    return loaded
+
+
+def attach_related(model, includes, rows, items):
+    """
+    Embeds the included relations into serialized rows. The number of queries depends
+    on the number of relations, not on the number of rows.
+    :param model: Movie or Actor
+    :param includes: Relation names returned by get_includes
+    :param rows: Rows selected through a RowSerializer, their first value is the id
+    :param items: The serialized rows, updated in place
+    :return: items
+    """
+    ids = [row[0] for row in rows]
+    for name in includes:
+        loaded = load_related(model, name, ids)
+        for row_id, item in zip(ids, items):
+            item[name] = loaded.get(row_id, [])
+    return items
+
+
+def add_cast(movie_id, actor_ids):
+    """
+    Casts actors in a movie within the current transaction, actors already cast are skipped
+    :param movie_id: Id of an existing movie
+    :param actor_ids: Ids of the actors
+    :return: Number of castings added
+    :raises LookupError: if some of the actors do not exist
+    """
+    actor_ids = list(dict.fromkeys(actor_ids))
+    found = {actor_id for actor_id, in db.session.query(Actor.id).filter(Actor.id.in_(actor_ids))}
+    missing = [str(actor_id) for actor_id in actor_ids if actor_id not in found]
+    if missing:
+        raise LookupError(f'Actors with ids: {",".join(missing)} do not exist')
+
+    cast = {actor_id for actor_id, in db.session.query(movie_actors.c.actor_id).filter(
+        movie_actors.c.movie_id == movie_id, movie_actors.c.actor_id.in_(actor_ids))}
+    rows = [{'movie_id': movie_id, 'actor_id': actor_id} for actor_id in actor_ids if actor_id not in cast]
+    if rows:
+        db.session.execute(movie_actors.insert(), rows)
+        TableVersion.bump(movie_actors.name)
+    return len(rows)
+
+
+def remove_cast(movie_id, actor_id):
+    """
+    Removes an actor from the cast of a movie within the current transaction
+    :param movie_id: Id of the movie
+    :param actor_id: Id of the actor
+    :return: False if the actor was not cast in the movie
+    """
+    result = db.session.execute(movie_actors.delete().where(
+        (movie_actors.c.movie_id == movie_id) & (movie_actors.c.actor_id == actor_id)))
+    if result.rowcount:
+        TableVersion.bump(movie_actors.name)
+    return result.rowcount > 0
@@ -0,0 +1,146 @@
+import zlib
+
+from flask import request
+
+try:
+    import brotli
+except ImportError:  # optional, only gzip is offered without it
+    brotli = None
+
+# media types worth compressing besides text/*, others (images, archives) are already compressed
+COMPRESSIBLE_TYPES = ('application/json', 'application/x-ndjson', 'application/javascript', 'application/xml',
+                      'image/svg+xml')
+
+# input bytes of a streamed body after which what was compressed so far is flushed to the
+# client, bounds the delay a row can be held back while keeping the compression ratio
+STREAM_FLUSH_BYTES = 16 * 1024
+
+
+class Encoder:
+    """
+    Incremental gzip or brotli compressor with a common interface
+    """
+
+    def __init__(self, encoding, level):
+        """
+        :param encoding: "gzip" or "br"
+        :param level: 1 to 9 for gzip, 0 to 11 for brotli
+        """
+        self.encoding = encoding
+        if encoding == 'br':
+            self._compressor = brotli.Compressor(quality=level)
+        else:
+            # wbits 16 + MAX_WBITS writes the gzip header and trailer
+            self._compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data):
+        """
+        :return: Compressed bytes available so far, often empty as the compressor buffers
+        """
+        if self.encoding == 'br':
+            return self._compressor.process(data)
+        return self._compressor.compress(data)
+
+    def flush(self):
+        """
+        :return: The pending compressed bytes, decodable by the client without the rest of the stream
+        """
+        if self.encoding == 'br':
+            return self._compressor.flush()
+        return self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        if self.encoding == 'br':
+            return self._compressor.finish()
+        return self._compressor.flush(zlib.Z_FINISH)
+
+
+def compressible(mimetype):
+    return bool(mimetype) and (mimetype.startswith('text/') or mimetype in COMPRESSIBLE_TYPES)
+
+
+def supported_encodings(config):
+    """
+    :param config: App config
+    :return: COMPRESSION_ENCODINGS in order of preference, without brotli when it is not installed
+    """
+    names = [name.strip() for name in (config['COMPRESSION_ENCODINGS'] or '').split(',')]
+    return [name for name in names if name == 'gzip' or (name == 'br' and brotli is not None)]
+
+
+def choose_encoding(encodings):
+    """
+    Negotiates the Content-Encoding of the response from the Accept-Encoding header
+    :param encodings: Encodings the server offers, in order of preference
+    :return: The encoding with the highest q-value, ties going to the server's preference,
+             or None to send the response uncompressed
+    """
+    best, best_quality = None, 0
+    for encoding in encodings:
+        quality = request.accept_encodings.quality(encoding)
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def compress_stream(chunks, encoder):
+    """
+    Compresses a streamed body as it is sent
+    :param chunks: Iterable of the body chunks
+    :param encoder: Encoder of the response
+    :return: Generator of the compressed chunks
+    """
+    pending = 0
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode()
+            data = encoder.compress(chunk)
+            pending += len(chunk)
+            if pending >= STREAM_FLUSH_BYTES:
+                data += encoder.flush()
+                pending = 0
+            if data:
+                yield data
+        yield encoder.finish()
+    finally:
+        if hasattr(chunks, 'close'):
+            chunks.close()
+
+
+def init_compression(app):
+    """
+    Compresses the responses of an app with gzip or brotli, as negotiated with Accept-Encoding.
+    Bodies shorter than COMPRESSION_MIN_SIZE are sent as they are, streamed bodies are
+    compressed chunk by chunk as they are generated.
+    :param app: Flask app
+    :return: Nothing
+    """
+
+    @app.after_request
+    def compress_response(response):
+        encodings = supported_encodings(app.config)
+        if (not encodings or request.method == 'HEAD' or response.status_code < 200
+                or response.status_code in (204, 206, 304) or response.direct_passthrough
+                or 'Content-Encoding' in response.headers or not compressible(response.mimetype)):
+            return response
+        if not response.is_streamed and response.calculate_content_length() < app.config['COMPRESSION_MIN_SIZE']:
+            return response
+
+        response.vary.add('Accept-Encoding')
+        encoding = choose_encoding(encodings)
+        if encoding is None:
+            return response
+        level = app.config['COMPRESSION_BROTLI_LEVEL' if encoding == 'br' else 'COMPRESSION_GZIP_LEVEL']
+        encoder = Encoder(encoding, level)
+        if response.is_streamed:
+            response.response = compress_stream(response.response, encoder)
+            response.headers.pop('Content-Length', None)
+        else:
+            response.set_data(encoder.compress(response.get_data()) + encoder.finish())
+        response.headers['Content-Encoding'] = encoding
+        # the compressed body is another representation, so a strong ETag of the original does not apply
+        etag, weak = response.get_etag()
+        if etag and not weak:
+            response.set_etag(etag, weak=True)
+        return response
@@ -0,0 +1,63 @@
+import hashlib
+from functools import wraps
+
+from flask import make_response, request
+
+from models import TableVersion
+
+
+def request_tables(tables, related=None):
+    """
+    Tables the response to the current request is built from
+    :param tables: Tables every response of the end point is built from
+    :param related: {relation name: tables} of the relations that can be embedded with "include"
+    :return: Tuple of table names
+    """
+    if not related:
+        return tables
+    names = request.args.get('include', '').split(',')
+    extra = tuple(table for name in names for table in related.get(name.strip(), ()))
+    return tuple(dict.fromkeys(tables + extra))
+
+
+def list_etag(tables):
+    """
+    Weak ETag of a list response: changes whenever the version of one of its tables changes,
+    and differs between query strings and media types of the same end point.
+    :param tables: Names of the tables the response is built from
+    :return: ETag value (without quotes)
+    """
+    versions = TableVersion.get_many(tables)
+    key = '{}:{}:{}'.format(
+        ','.join(f'{table}={versions[table]}' for table in tables), request.full_path,
+        request.headers.get('Accept', ''))
+    return hashlib.sha1(key.encode()).hexdigest()
+
+
+def versioned(*tables, related=None):
+    """
+    Answers conditional GET requests of a list end point from the table versions alone.
+    When If-None-Match matches, 304 is returned without querying rows or serializing
+    anything. Apply below requires_auth so only authorized clients get an answer.
+    :param tables: Names of the tables the response is built from
+    :param related: Tables of the relations that can be embedded, see request_tables
+    :return: Decorator
+    """
+
+    def versioned_decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            etag = list_etag(request_tables(tables, related))
+            if request.if_none_match.contains_weak(etag):
+                response = make_response('', 304)
+                response.set_etag(etag, weak=True)
+                return response
+
+            response = make_response(f(*args, **kwargs))
+            if response.status_code == 200:
+                response.set_etag(etag, weak=True)
+            return response
+
+        return wrapper
+
+    return versioned_decorator
@@ -0,0 +1,143 @@
+import os
+import threading
+import time
+
+from sqlalchemy import event
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import Pool, QueuePool
+
+# config key: create_engine argument, only used by QueuePool based (non SQLite) engines
+QUEUE_POOL_OPTIONS = {
+    'DB_POOL_SIZE': 'pool_size',
+    'DB_MAX_OVERFLOW': 'max_overflow',
+    'DB_POOL_TIMEOUT': 'pool_timeout',
+}
+
+
+def engine_options(config, database_path):
+    """
+    Builds SQLALCHEMY_ENGINE_OPTIONS from the DB_POOL_* settings of an app
+    :param config: App config, settings missing from it keep the SQLAlchemy defaults
+    :param database_path: Database URL
+    :return: Keyword arguments of create_engine
+    """
+    options = {}
+    if config.get('DB_POOL_RECYCLE') is not None:
+        options['pool_recycle'] = config['DB_POOL_RECYCLE']
+    if config.get('DB_POOL_PRE_PING'):
+        # tests connections on checkout, so connections dropped by a failover are replaced
+        options['pool_pre_ping'] = True
+    if not (database_path or '').startswith('sqlite'):
+        options['poolclass'] = InstrumentedQueuePool
+        for key, option in QUEUE_POOL_OPTIONS.items():
+            if config.get(key) is not None:
+                options[option] = config[key]
+    return options
+
+
+class PoolStats:
+    """
+    Connection pool counters of this process, fed by the SQLAlchemy pool events of every
+    pool and by the checkout timing of InstrumentedQueuePool.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {'connects': 0, 'checkouts': 0, 'checkins': 0, 'invalidations': 0, 'checkout_timeouts': 0}
+        self.in_use = 0
+        self.peak_in_use = 0
+        self.peak_overflow = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._waits = 0
+
+    def listen(self, target=Pool):
+        """
+        Registers the pool event listeners
+        :param target: Pool instance, or a pool class to count the events of all its pools
+        :return: Nothing
+        """
+        event.listen(target, 'connect', self.on_connect)
+        event.listen(target, 'checkout', self.on_checkout)
+        event.listen(target, 'checkin', self.on_checkin)
+        event.listen(target, 'invalidate', self.on_invalidate)
+        event.listen(target, 'soft_invalidate', self.on_invalidate)
+
+    def on_connect(self, dbapi_connection, connection_record):
+        with self._lock:
+            self._stats['connects'] += 1
+
+    def on_checkout(self, dbapi_connection, connection_record, connection_proxy):
+        with self._lock:
+            self._stats['checkouts'] += 1
+            self.in_use += 1
+            self.peak_in_use = max(self.peak_in_use, self.in_use)
+
+    def on_checkin(self, dbapi_connection, connection_record):
+        with self._lock:
+            self._stats['checkins'] += 1
+            self.in_use -= 1
+
+    def on_invalidate(self, dbapi_connection, connection_record, exception):
+        with self._lock:
+            self._stats['invalidations'] += 1
+
+    def record_checkout(self, seconds, overflow):
+        """
+        :param seconds: Time spent waiting for a connection
+        :param overflow: Connections open beyond the pool size after the checkout
+        """
+        with self._lock:
+            self._waits += 1
+            self._wait_total += seconds
+            self._wait_max = max(self._wait_max, seconds)
+            self.peak_overflow = max(self.peak_overflow, overflow)
+
+    def record_timeout(self):
+        with self._lock:
+            self._stats['checkout_timeouts'] += 1
+
+    def stats(self, pool=None):
+        """
+        :param pool: Pool of the app's engine, adds its current sizing when it is a QueuePool
+        :return: Counters, checkout latency in milliseconds and current pool state
+        """
+        with self._lock:
+            stats = dict(
+                self._stats, pid=os.getpid(), in_use=self.in_use, peak_in_use=self.peak_in_use,
+                peak_overflow=self.peak_overflow,
+                checkout_wait_avg_ms=round(self._wait_total / self._waits * 1000, 3) if self._waits else 0.0,
+                checkout_wait_max_ms=round(self._wait_max * 1000, 3))
+        if isinstance(pool, QueuePool):
+            stats.update(size=pool.size(), checked_in=pool.checkedin(), checked_out=pool.checkedout(),
+                         overflow=max(pool.overflow(), 0), timeout=pool.timeout())
+        return stats
+
+
+class InstrumentedQueuePool(QueuePool):
+    """
+    QueuePool timing every checkout, including the wait for a free connection
+    and the pre-ping, and counting checkouts that timed out.
+    """
+
+    def connect(self):
+        return self._timed_checkout(super().connect)
+
+    def unique_connection(self):
+        # used by Engine.connect(), sessions go through connect()
+        return self._timed_checkout(super().unique_connection)
+
+    def _timed_checkout(self, checkout):
+        started = time.perf_counter()
+        try:
+            connection = checkout()
+        except PoolTimeoutError:
+            pool_stats.record_timeout()
+            raise
+        pool_stats.record_checkout(time.perf_counter() - started, max(self.overflow(), 0))
+        return connection
+
+
+# Shared by every pool of this process
+pool_stats = PoolStats()
+pool_stats.listen(Pool)
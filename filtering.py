@@ -0,0 +1,40 @@
+import operator
+from datetime import date
+
+from flask import abort, request
+
+from models import Movie, Actor
+
+# query parameter: (column, comparison, parser, expected format)
+MOVIE_FILTERS = {
+    'released_after': (Movie.release_date, operator.gt, date.fromisoformat, 'YYYY-MM-DD'),
+    'released_before': (Movie.release_date, operator.lt, date.fromisoformat, 'YYYY-MM-DD'),
+}
+ACTOR_FILTERS = {
+    'min_age': (Actor.age, operator.ge, int, 'an integer'),
+    'max_age': (Actor.age, operator.le, int, 'an integer'),
+    'gender': (Actor.gender, operator.eq, str, 'a string'),
+}
+
+# columns the list end points may be sorted by
+MOVIE_SORTS = ('id', 'title', 'release_date')
+ACTOR_SORTS = ('id', 'name', 'age')
+
+
+def get_filters(filters):
+    """
+    Turns the filter query parameters of a list request into SQL criteria, so the
+    database does the filtering (using ix_movies_release_date and ix_actors_gender_age)
+    :param filters: MOVIE_FILTERS or ACTOR_FILTERS
+    :return: List of criteria, empty when no filter is passed
+    """
+    criteria = []
+    for name, (column, compare, parse, expected) in filters.items():
+        value = request.args.get(name, None)
+        if value is None:
+            continue
+        try:
+            criteria.append(compare(column, parse(value)))
+        except ValueError:
+            abort(400, f'Invalid {name} {value}, expected {expected}')
+    return criteria
@@ -0,0 +1,25 @@
+# Loaded by gunicorn from the working directory (see Procfile).
+import glob
+import os
+import tempfile
+
+# Each worker writes its Prometheus metrics to this directory so /metrics can aggregate all of them,
+# see metrics.py. Defaults to a directory in the temporary directory, set PROMETHEUS_MULTIPROC_DIR
+# to use another one. prometheus_client reads it when it is imported, so it is set in the
+# environment first and inherited by the workers.
+MULTIPROC_DIR = os.environ.setdefault(
+    'PROMETHEUS_MULTIPROC_DIR',
+    os.getenv('prometheus_multiproc_dir') or os.path.join(tempfile.gettempdir(), 'capstone-prometheus'))
+
+from prometheus_client import multiprocess  # noqa: E402
+
+
+def on_starting(server):
+    # files left by a previous run would be added to the new counters
+    os.makedirs(MULTIPROC_DIR, exist_ok=True)
+    for path in glob.glob(os.path.join(MULTIPROC_DIR, '*.db')):
+        os.remove(path)
+
+
+def child_exit(server, worker):
+    multiprocess.mark_process_dead(worker.pid, path=MULTIPROC_DIR)
@@ -0,0 +1,122 @@
+import hashlib
+import time
+from functools import wraps
+
+from flask import abort, current_app, request
+
+from cache import CACHED_HEADERS
+from unit_of_work import complete_request
+
+# seconds an in-flight marker is kept, so a key is released if its worker dies mid request
+IN_FLIGHT_TIMEOUT = 60
+# seconds between two looks at the marker of an in-flight duplicate
+POLL_INTERVAL = 0.05
+MAX_KEY_LENGTH = 255
+
+
+class IdempotencyStore:
+    """
+    Responses of requests sent with an Idempotency-Key header, keyed by token subject,
+    method, path and Idempotency-Key.
+
+    A key is claimed by adding an in-flight marker, which the backend only stores if
+    the key is absent, so of concurrent duplicates a single one runs. The others poll
+    until its response is stored, and replay it.
+    """
+
+    def __init__(self, backend, ttl, wait_timeout):
+        """
+        :param backend: LocalCache or a cachelib cache
+        :param ttl: Seconds a response is kept
+        :param wait_timeout: Seconds a duplicate waits for the request in flight
+        """
+        self.backend = backend
+        self.ttl = ttl
+        self.wait_timeout = wait_timeout
+
+    @staticmethod
+    def key(sub, method, path, idempotency_key):
+        raw = f'{sub}:{method}:{path}:{idempotency_key}'
+        return 'idempotency:' + hashlib.sha1(raw.encode()).hexdigest()
+
+    def claim(self, key, fingerprint):
+        """
+        :return: True if no other request holds or has answered the key
+        """
+        return self.backend.add(key, ('in-flight', fingerprint), timeout=IN_FLIGHT_TIMEOUT)
+
+    def release(self, key):
+        self.backend.delete(key)
+
+    def save(self, key, fingerprint, response):
+        headers = [(name, response.headers[name]) for name in CACHED_HEADERS if name in response.headers]
+        self.backend.set(key, ('done', fingerprint, response.get_data(), response.status_code, headers),
+                         timeout=self.ttl)
+
+    def wait(self, key, fingerprint):
+        """
+        Waits for the request holding a key
+        :param key: Key returned by key()
+        :param fingerprint: Hash of the body of the waiting request
+        :return: The stored entry, None if the key was released, or the in-flight
+                 marker if the request is still running after wait_timeout
+        """
+        deadline = time.monotonic() + self.wait_timeout
+        while True:
+            entry = self.backend.get(key)
+            if entry is None or entry[0] == 'done' or entry[1] != fingerprint or time.monotonic() >= deadline:
+                return entry
+            time.sleep(POLL_INTERVAL)
+
+
+def idempotent(f):
+    """
+    Lets clients retry a POST end point safely by sending an Idempotency-Key header.
+    The first successful response is stored for IDEMPOTENCY_KEY_TTL seconds and repeats
+    with the same key and body are answered from the store without touching the database.
+    Error responses are not stored, so a failed request can be retried with the same key.
+    Apply below requires_auth.
+    :param f: View function taking the token payload first
+    :return: Decorated view function
+    """
+
+    @wraps(f)
+    def wrapper(payload, *args, **kwargs):
+        store = current_app.extensions.get('idempotency_store')
+        idempotency_key = request.headers.get('Idempotency-Key')
+        if store is None or idempotency_key is None:
+            return f(payload, *args, **kwargs)
+        if not idempotency_key or len(idempotency_key) > MAX_KEY_LENGTH:
+            abort(400, f'Idempotency-Key must be 1 to {MAX_KEY_LENGTH} characters long')
+
+        key = store.key(payload.get('sub'), request.method, request.path, idempotency_key)
+        fingerprint = hashlib.sha256(request.get_data()).hexdigest()
+        while not store.claim(key, fingerprint):
+            entry = store.wait(key, fingerprint)
+            if entry is None:
+                # the first request failed and released the key
+                continue
+            if entry[1] != fingerprint:
+                abort(422, 'Idempotency-Key was already used with a different request body')
+            if entry[0] != 'done':
+                abort(409, 'A request with this Idempotency-Key is still in progress')
+            body, status_code, headers = entry[2:]
+            response = current_app.response_class(body, status=status_code, headers=headers)
+            response.headers['Idempotent-Replayed'] = 'true'
+            return response
+
+        try:
+            response = current_app.make_response(f(payload, *args, **kwargs))
+        except Exception:
+            store.release(key)
+            raise
+        if response.status_code < 400:
+            # stored only once the writes behind it are committed
+            response = complete_request(response)
+        if response.status_code < 400:
+            store.save(key, fingerprint, response)
+        else:
+            store.release(key)
+        return response
+
+    return wrapper
@@ -1,7 +1,12 @@
+import gzip
+import sys
+from contextlib import ExitStack
+
 from flask_migrate import Migrate, MigrateCommand
-from flask_script import Manager
+from flask_script import Command, Manager, Option
 
 from app import create_app
+from bulk_io import EXPORT_FORMATS, TABLES, detect_format, export_rows, import_rows, read_rows
 from models import db, Actor, Movie
 
 app = create_app()
@@ -24,6 +29,77 @@ def add_test_data():
 
     Actor(name='Amitabh Bachchan', age=78, gender='male').insert()
     Actor(name='Aamir Khan', age=50, gender='male').insert()
+    db.session.commit()
+
+
+class ImportCommand(Command):
+    """
+    Imports movies or actors from a CSV or JSONL file, "-" reads from stdin
+    """
+
+    option_list = (
+        Option('table', choices=list(TABLES)),
+        Option('path'),
+        Option('--format', dest='file_format', choices=('csv', 'jsonl'),
+               help='Format of the file, guessed from its extension by default'),
+        Option('--on-duplicate', dest='on_duplicate', choices=('skip', 'update'), default='skip',
+               help='What to do with rows whose title / name already exists'),
+        Option('--batch-size', dest='batch_size', type=int, help='Rows committed together'),
+    )
+
+    def run(self, table, path, file_format, on_duplicate, batch_size):
+        model, key = TABLES[table]
+        try:
+            file_format = file_format or detect_format(path)
+        except ValueError as e:
+            sys.exit(str(e))
+        file = sys.stdin if path == '-' else open(path, newline='', encoding='utf-8')
+        try:
+            stats = import_rows(model, key, read_rows(file, file_format), on_duplicate, batch_size,
+                                report=lambda message: print(message, file=sys.stderr))
+        finally:
+            if file is not sys.stdin:
+                file.close()
+        print(f'Imported {table}: {stats}')
+
+
+manager.add_command('import', ImportCommand())
+
+# bytes buffered before the export output is written to the file, or compressed
+EXPORT_BUFFER_SIZE = 1024 * 1024
+
+
+class ExportCommand(Command):
+    """
+    Exports movies or actors to a CSV, JSONL or columnar JSONL file in id order, stdout by default
+    """
+
+    option_list = (
+        Option('table', choices=list(TABLES)),
+        Option('--format', dest='file_format', choices=list(EXPORT_FORMATS), default='jsonl'),
+        Option('--output', dest='output', default='-', help='File to write, stdout by default'),
+        Option('--gzip', dest='compress', action='store_true', help='Compress the output with gzip'),
+        Option('--since-id', dest='since_id', type=int,
+               help='Only export rows with a greater id, the last id of the previous export'),
+    )
+
+    def run(self, table, file_format, output, compress, since_id):
+        model, _ = TABLES[table]
+        with ExitStack() as stack:
+            if output == '-':
+                file = stack.enter_context(open(sys.stdout.fileno(), 'wb', buffering=EXPORT_BUFFER_SIZE,
+                                                closefd=False))
+            else:
+                file = stack.enter_context(open(output, 'wb', buffering=EXPORT_BUFFER_SIZE))
+            if compress:
+                file = stack.enter_context(gzip.GzipFile(fileobj=file, mode='wb'))
+            stats = export_rows(model, file, file_format, since_id,
+                                report=lambda message: print(message, file=sys.stderr))
+        # the data may go to stdout
+        print(f'Exported {table}: {stats}', file=sys.stderr)
+
+
+manager.add_command('export', ExportCommand())
 
 
 if __name__ == '__main__':
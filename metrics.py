@@ -0,0 +1,53 @@
+import os
+
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Histogram, generate_latest
+from prometheus_client import multiprocess
+
+# Under gunicorn every worker has its own copy of the metrics. With PROMETHEUS_MULTIPROC_DIR
+# set (gunicorn.conf.py sets a default) the workers write them to files in that directory and
+# /metrics aggregates the files of all workers, whichever worker answers the scrape.
+MULTIPROC_DIR = os.getenv('PROMETHEUS_MULTIPROC_DIR') or os.getenv('prometheus_multiproc_dir')
+
+REQUEST_DURATION = Histogram(
+    'http_request_duration_seconds', 'Time spent answering a request, until the response is returned',
+    ['endpoint', 'method'])
+REQUEST_PHASE_DURATION = Histogram(
+    'http_request_phase_duration_seconds', 'Time spent by a request in the auth, db and serialize phases',
+    ['endpoint', 'phase'])
+REQUEST_QUERIES = Histogram(
+    'http_request_queries', 'SQL statements executed per request', ['endpoint'],
+    buckets=(1, 2, 3, 5, 10, 20, 50, 100, float('inf')))
+REQUESTS = Counter(
+    'http_requests', 'Answered requests by status code', ['endpoint', 'method', 'status'])
+RESPONSE_CACHE_LOOKUPS = Counter(
+    'response_cache_lookups', 'Response cache lookups by result (hit or miss)', ['endpoint', 'result'])
+
+
+def observe_request(endpoint, method, status, total, phases, queries=0):
+    """
+    Records the timing of an answered request
+    :param endpoint: URL rule of the end point, e.g. /api/movie/<int:movie_id>
+    :param method: HTTP method
+    :param status: Response status code
+    :param total: Seconds spent on the request
+    :param phases: {phase: seconds}
+    :param queries: Number of SQL statements executed
+    :return: Nothing
+    """
+    REQUEST_DURATION.labels(endpoint, method).observe(total)
+    for name, seconds in phases.items():
+        REQUEST_PHASE_DURATION.labels(endpoint, name).observe(seconds)
+    REQUEST_QUERIES.labels(endpoint).observe(queries)
+    REQUESTS.labels(endpoint, method, str(status)).inc()
+
+
+def render_metrics():
+    """
+    :return: (body, content type) of the Prometheus text exposition of all workers
+    """
+    if MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry, path=MULTIPROC_DIR)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
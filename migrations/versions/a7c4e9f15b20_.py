@@ -0,0 +1,52 @@
+"""search indexes over movies.title and actors.name
+
+Revision ID: a7c4e9f15b20
+Revises: 5e9a2c71d3b8
+Create Date: 2026-10-17 13:48:52.907135
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a7c4e9f15b20'
+down_revision = '5e9a2c71d3b8'
+branch_labels = None
+depends_on = None
+
+# table: (searched column, rowid offset in the SQLite search_index)
+SEARCH_COLUMNS = {'movies': ('title', 0), 'actors': ('name', 1)}
+
+
+def upgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        for table, (column, _) in SEARCH_COLUMNS.items():
+            op.execute(f'CREATE INDEX ix_{table}_{column}_trgm ON {table} USING gin ({column} gin_trgm_ops)')
+        return
+
+    op.execute('CREATE VIRTUAL TABLE search_index USING fts5(name, tokenize="trigram")')
+    for table, (column, kind) in SEARCH_COLUMNS.items():
+        op.execute(f'INSERT INTO search_index (rowid, name) SELECT 2 * id + {kind}, {column} FROM {table}')
+        op.execute(
+            f'CREATE TRIGGER {table}_search_insert AFTER INSERT ON {table} BEGIN '
+            f'INSERT INTO search_index (rowid, name) VALUES (2 * new.id + {kind}, new.{column}); END')
+        op.execute(
+            f'CREATE TRIGGER {table}_search_update AFTER UPDATE OF {column} ON {table} BEGIN '
+            f'UPDATE search_index SET name = new.{column} WHERE rowid = 2 * old.id + {kind}; END')
+        op.execute(
+            f'CREATE TRIGGER {table}_search_delete AFTER DELETE ON {table} BEGIN '
+            f'DELETE FROM search_index WHERE rowid = 2 * old.id + {kind}; END')
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        for table, (column, _) in SEARCH_COLUMNS.items():
+            op.execute(f'DROP INDEX ix_{table}_{column}_trgm')
+        return
+
+    for table in SEARCH_COLUMNS:
+        for event in ('insert', 'update', 'delete'):
+            op.execute(f'DROP TRIGGER {table}_search_{event}')
+    op.execute('DROP TABLE search_index')
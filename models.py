@@ -1,27 +1,356 @@
+import logging
 import os
+import weakref
+from datetime import date
 
-from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import Column, String, Integer, Date
+from sqlalchemy import Column, String, Integer, Date, ForeignKey, Index, event, select
+from sqlalchemy.engine import Engine
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+from sqlalchemy.orm import Session, validates
+
+from dbpool import engine_options
+from replicas import RoutingSQLAlchemy
+
+logger = logging.getLogger(__name__)
 
 database_path = os.environ.get('DATABASE_URL')
 
-db = SQLAlchemy()
+# sessions are bound to a read replica in the end points decorated with replicas.read_replica
+db = RoutingSQLAlchemy()
+
+# objects with a tables_changed(tables) method, notified after every commit that
+# bumped a TableVersion, e.g. response caches that have to be invalidated
+change_listeners = weakref.WeakSet()
+
+# rows per statement of the bulk helpers and values per IN list, below the bound
+# parameter limit of older SQLite versions
+BATCH_SIZE = 500
 
 
 def setup_db(app, database_path=database_path):
     """
-    Binds a flask application and a SQLAlchemy service
+    Binds a flask application and a SQLAlchemy service, with the pool settings of its config (DB_POOL_*)
     :param app: app
     :param database_path: database path
     :return: Nothing
     """
     app.config["SQLALCHEMY_DATABASE_URI"] = database_path
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options(app.config, database_path)
     db.app = app
     db.init_app(app)
     # db.create_all()
 
 
+class TableVersion(db.Model):
+    """
+    Version counter per table, incremented after the commit of every write made
+    through the Movie / Actor methods and the helpers below, in a transaction of
+    its own so concurrent writers do not queue on the row lock of the counter.
+    Lets readers tell whether a table changed without reading its rows.
+    """
+    __tablename__ = 'table_versions'
+
+    name = Column(String, primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+
+    @classmethod
+    def bump(cls, name):
+        """
+        Marks a table as changed by the current transaction, its version is incremented
+        once the transaction commits, see increment, and left as it is on rollback
+        :param name: Table name
+        :return: Nothing
+        """
+        db.session.info.setdefault('changed_tables', set()).add(name)
+
+    @classmethod
+    def increment(cls, connection, names):
+        """
+        Increments the versions of tables with one UPDATE, in autocommit
+        :param connection: Connection to the primary database
+        :param names: Table names
+        :return: Nothing
+        """
+        table = cls.__table__
+        result = connection.execute(
+            table.update().where(table.c.name.in_(names)).values(version=table.c.version + 1))
+        if result.rowcount < len(names):
+            existing = {name for name, in connection.execute(
+                select([table.c.name]).where(table.c.name.in_(names)))}
+            connection.execute(table.insert(), [{'name': name, 'version': 1}
+                                                for name in names if name not in existing])
+
+    @classmethod
+    def get(cls, name):
+        """
+        :param name: Table name
+        :return: Current version of the table
+        """
+        version = db.session.query(cls.version).filter(cls.name == name).scalar()
+        return version or 0
+
+    @classmethod
+    def get_many(cls, names):
+        """
+        :param names: Table names
+        :return: {table name: current version}
+        """
+        versions = dict(db.session.query(cls.name, cls.version).filter(cls.name.in_(names)))
+        return {name: versions.get(name, 0) for name in names}
+
+
+@event.listens_for(TableVersion.__table__, 'after_create')
+def seed_table_versions(table, connection, **kwargs):
+    connection.execute(table.insert(), [
+        {'name': 'movies', 'version': 0},
+        {'name': 'actors', 'version': 0},
+        {'name': 'movie_actors', 'version': 0},
+    ])
+
+
+@event.listens_for(Engine, 'connect')
+def enable_sqlite_foreign_keys(dbapi_connection, connection_record):
+    # SQLite ignores foreign keys, and so ON DELETE CASCADE, unless enabled per connection
+    if type(dbapi_connection).__module__ == 'sqlite3':
+        cursor = dbapi_connection.cursor()
+        cursor.execute('PRAGMA foreign_keys=ON')
+        cursor.close()
+
+
+@event.listens_for(Session, 'after_commit')
+def notify_change_listeners(session):
+    tables = session.info.pop('changed_tables', None)
+    if tables:
+        # the data is committed: a failure leaves the versions, and so the ETags, behind
+        # until the next write instead of failing the request
+        try:
+            with db.engine.connect() as connection:
+                TableVersion.increment(connection, sorted(tables))
+        except SQLAlchemyError:
+            logger.exception('Unable to increment the versions of %s', ', '.join(sorted(tables)))
+        for listener in list(change_listeners):
+            listener.tables_changed(tables)
+
+
+@event.listens_for(Session, 'after_rollback')
+def discard_changed_tables(session):
+    session.info.pop('changed_tables', None)
+
+
+def parse_integer(value):
+    """
+    :return: The value if it is an integer, booleans are rejected although bool is a subclass of int
+    """
+    if not isinstance(value, int) or isinstance(value, bool):
+        raise ValueError(value)
+    return value
+
+
+def parse_string(value):
+    if not isinstance(value, str):
+        raise ValueError(value)
+    return value
+
+
+def parse_date(value):
+    """
+    :return: The date of a YYYY-MM-DD string
+    """
+    return date.fromisoformat(parse_string(value))
+
+
+# column: (parser, expected format) of the JSON values accepted when creating or updating a row
+MOVIE_JSON_COLUMNS = {
+    'title': (parse_string, 'a string'),
+    'release_date': (parse_date, 'YYYY-MM-DD'),
+}
+ACTOR_JSON_COLUMNS = {
+    'name': (parse_string, 'a string'),
+    'age': (parse_integer, 'an integer'),
+    'gender': (parse_string, 'a string'),
+}
+
+
+def parse_columns(item, columns):
+    """
+    Parses the values of a JSON object, e.g. the body of a POST or PATCH
+    :param item: {column: JSON value}, columns missing from `columns` are ignored
+    :param columns: MOVIE_JSON_COLUMNS or ACTOR_JSON_COLUMNS
+    :return: Column dict of the parsed values
+    :raise ValueError: With the message for the client, when a value has the wrong type or format
+    """
+    values = {}
+    for name, (parse, expected) in columns.items():
+        if name not in item:
+            continue
+        try:
+            values[name] = parse(item[name])
+        except ValueError:
+            raise ValueError(f'Invalid {name} {item[name]}, expected {expected}')
+    return values
+
+
+def is_postgres():
+    """
+    :return: True if the session is bound to Postgres, which supports ON CONFLICT and RETURNING
+    """
+    return db.session.get_bind().dialect.name == 'postgresql'
+
+
+def insert_unique(model, values, key):
+    """
+    Inserts a row in a single round trip, within the current transaction, the caller commits.
+    The unique index on `key` decides about duplicates, so no SELECT is needed beforehand
+    and concurrent inserts of the same value cannot both succeed.
+    :param model: Movie or Actor
+    :param values: Column dict
+    :param key: Name of the unique column
+    :return: Column dict of the new row including its id, or None if `key` already exists
+    """
+    table = model.__table__
+    if is_postgres():
+        statement = pg_insert(table).values(**values) \
+            .on_conflict_do_nothing(index_elements=[key]) \
+            .returning(*table.c)
+        row = db.session.execute(statement).first()
+        if row is not None:
+            TableVersion.bump(table.name)
+        return dict(row) if row is not None else None
+
+    try:
+        result = db.session.execute(table.insert().values(**values))
+    except IntegrityError:
+        # only the failed statement is undone, the transaction goes on
+        return None
+    TableVersion.bump(table.name)
+    return dict(values, id=result.inserted_primary_key[0])
+
+
+def update_by_id(model, row_id, values):
+    """
+    Updates a row without loading it first, within the current transaction, the caller commits.
+    On Postgres this is a single UPDATE ... RETURNING, other backends need a SELECT after
+    the UPDATE to return the row.
+    :param model: Movie or Actor
+    :param row_id: Id of the row
+    :param values: Column dict of the columns to change
+    :return: Column dict of the updated row, or None if no row has this id
+    """
+    table = model.__table__
+    statement = table.update().where(table.c.id == row_id).values(**values)
+    if is_postgres():
+        row = db.session.execute(statement.returning(*table.c)).first()
+    else:
+        result = db.session.execute(statement)
+        row = db.session.execute(table.select().where(table.c.id == row_id)).first() if result.rowcount else None
+    if row is not None:
+        TableVersion.bump(table.name)
+    return dict(row) if row is not None else None
+
+
+def delete_by_id(model, row_id):
+    """
+    Deletes a row without loading it first, in a single DELETE (... RETURNING on Postgres),
+    within the current transaction, the caller commits. Castings are removed by ON DELETE CASCADE.
+    :param model: Movie or Actor
+    :param row_id: Id of the row
+    :return: False if no row has this id
+    """
+    table = model.__table__
+    statement = table.delete().where(table.c.id == row_id)
+    if is_postgres():
+        deleted = db.session.execute(statement.returning(table.c.id)).first() is not None
+    else:
+        deleted = db.session.execute(statement).rowcount > 0
+    if deleted:
+        TableVersion.bump(table.name)
+    return deleted
+
+
+def bulk_insert(model, rows, key, batch_size=BATCH_SIZE):
+    """
+    Inserts rows in batches within the current transaction, the caller commits.
+    On Postgres each batch is a single multi-row INSERT ... ON CONFLICT DO NOTHING
+    RETURNING, other backends fall back to one INSERT per row.
+    :param model: Movie or Actor
+    :param rows: List of column dicts, the values of `key` must be unique
+    :param key: Name of the unique column used to match the returned ids to the rows
+    :param batch_size: Rows per INSERT statement
+    :return: {key value: id}, rows conflicting with an existing `key` are missing
+    """
+    table = model.__table__
+    ids = {}
+    for start in range(0, len(rows), batch_size):
+        batch = rows[start:start + batch_size]
+        if is_postgres():
+            result = db.session.execute(
+                pg_insert(table).values(batch)
+                .on_conflict_do_nothing(index_elements=[key])
+                .returning(table.c.id, table.c[key]))
+            ids.update((row[key], row.id) for row in result)
+        else:
+            for row in batch:
+                result = db.session.execute(table.insert(), row)
+                ids[row[key]] = result.inserted_primary_key[0]
+    if ids:
+        TableVersion.bump(table.name)
+    return ids
+
+
+def bulk_update(model, ids, values, batch_size=BATCH_SIZE):
+    """
+    Sets the same values on rows picked by id, within the current transaction, the caller commits
+    :param model: Movie or Actor
+    :param ids: Ids of the rows, without duplicates
+    :param values: Column dict
+    :param batch_size: Ids per statement
+    :return: Set of the ids that were found and updated
+    """
+    return _write_by_ids(model, ids, model.__table__.update().values(**values), batch_size)
+
+
+def bulk_delete(model, ids, batch_size=BATCH_SIZE):
+    """
+    Deletes rows picked by id, within the current transaction, the caller commits.
+    Castings are removed by ON DELETE CASCADE.
+    :param model: Movie or Actor
+    :param ids: Ids of the rows, without duplicates
+    :param batch_size: Ids per statement
+    :return: Set of the ids that were found and deleted
+    """
+    return _write_by_ids(model, ids, model.__table__.delete(), batch_size)
+
+
+def _write_by_ids(model, ids, statement, batch_size):
+    # On Postgres each batch is a single UPDATE / DELETE ... WHERE id IN (...) RETURNING id,
+    # other backends first select which ids of the batch exist
+    table = model.__table__
+    found = set()
+    for start in range(0, len(ids), batch_size):
+        batch = ids[start:start + batch_size]
+        batch_statement = statement.where(table.c.id.in_(batch))
+        if is_postgres():
+            found.update(row_id for row_id, in db.session.execute(batch_statement.returning(table.c.id)))
+        else:
+            found.update(row_id for row_id, in db.session.query(table.c.id).filter(table.c.id.in_(batch)))
+            db.session.execute(batch_statement)
+    if found:
+        TableVersion.bump(table.name)
+    return found
+
+
+# Casting: which actors play in which movie. The primary key serves the
+# movie -> actors direction, ix_movie_actors_actor_id the reverse one.
+movie_actors = db.Table(
+    'movie_actors',
+    Column('movie_id', Integer, ForeignKey('movies.id', ondelete='CASCADE'), primary_key=True),
+    Column('actor_id', Integer, ForeignKey('actors.id', ondelete='CASCADE'), primary_key=True,
+           index=True),
+)
+
+
 class Movie(db.Model):
     """
     Movie Database
@@ -29,35 +358,61 @@ class Movie(db.Model):
     __tablename__ = 'movies'
 
     id = Column(Integer, primary_key=True)
-    title = Column(String)
-    release_date = Column(Date)
+    title = Column(String, unique=True, index=True)
+    release_date = Column(Date, index=True)
+    # castings are removed by the database when a movie or an actor is deleted
+    actors = db.relationship('Actor', secondary=movie_actors, order_by='Actor.id', passive_deletes=True,
+                             backref=db.backref('movies', order_by='Movie.id', passive_deletes=True))
 
     def __init__(self, title, release_date):
         self.title = title
         self.release_date = release_date
 
+    @staticmethod
+    def columns_from_json(item):
+        """
+        Validates the JSON of a movie to be created
+        :param item: {"title": "Ludo", "release_date": "2020-10-10"}
+        :return: Column dict
+        """
+        if not isinstance(item, dict) or 'title' not in item or 'release_date' not in item:
+            raise ValueError('Invalid JSON, "title" or "release_date" key is not present')
+        return parse_columns(item, MOVIE_JSON_COLUMNS)
+
+    @validates('release_date')
+    def validate_release_date(self, key, value):
+        """
+        Accepts ISO formatted date strings, so every database backend gets a date object
+        """
+        if isinstance(value, str):
+            return date.fromisoformat(value)
+        return value
+
     def insert(self):
         """
-        Insert a new Movie record
+        Insert a new Movie record, flushed only, the caller commits
         :return:
         """
         db.session.add(self)
-        db.session.commit()
+        TableVersion.bump(self.__tablename__)
+        db.session.flush()
 
     def update(self):
         """
-        Update movie record
+        Update movie record, flushed only, the caller commits
         :return:
         """
-        db.session.commit()
+        TableVersion.bump(self.__tablename__)
+        db.session.flush()
 
     def delete(self):
         """
-        Delete movie record
+        Delete movie record, flushed only, the caller commits
         :return:
         """
         db.session.delete(self)
-        db.session.commit()
+        TableVersion.bump(self.__tablename__)
+        db.session.flush()
 
     def serialize(self):
         return {
@@ -72,9 +427,13 @@ class Actor(db.Model):
     Actor database
     """
     __tablename__ = 'actors'
+    __table_args__ = (
+        # serves the gender filter alone and combined with an age range
+        Index('ix_actors_gender_age', 'gender', 'age'),
+    )
 
     id = Column(Integer, primary_key=True)
-    name = Column(String)
+    name = Column(String, unique=True, index=True)
     age = Column(Integer)
     gender = Column(String)
 
@@ -83,27 +442,41 @@ class Actor(db.Model):
         self.age = age
         self.gender = gender
 
+    @staticmethod
+    def columns_from_json(item):
+        """
+        Validates the JSON of an actor to be created
+        :param item: {"name": "Amitabh Bachchan", "age": 78, "gender": "Male"}
+        :return: Column dict
+        """
+        if not isinstance(item, dict) or 'name' not in item or 'age' not in item or 'gender' not in item:
+            raise ValueError('Invalid JSON, "name" or "age" or "gender" key is not present')
+        return parse_columns(item, ACTOR_JSON_COLUMNS)
+
     def insert(self):
         """
-        Insert actor record
+        Insert actor record, flushed only, the caller commits
         :return:
         """
         db.session.add(self)
-        db.session.commit()
+        TableVersion.bump(self.__tablename__)
+        db.session.flush()
 
     def update(self):
         """
-        Update actor record
+        Update actor record, flushed only, the caller commits
         :return:
         """
-        db.session.commit()
+        TableVersion.bump(self.__tablename__)
+        db.session.flush()
 
     def delete(self):
         """
-        Delete actor record
+        Delete actor record, flushed only, the caller commits
         """
         db.session.delete(self)
-        db.session.commit()
+        TableVersion.bump(self.__tablename__)
+        db.session.flush()
 
     def serialize(self):
         return {
@@ -112,3 +485,38 @@ class Actor(db.Model):
             'age': self.age,
             'gender': self.gender
         }
+
+
+# Search indexes, see search.py. On Postgres trigram GIN indexes cover the searched
+# columns directly. On SQLite an FTS5 table with the trigram tokenizer holds a copy of
+# them, kept in sync by triggers: movies under rowid 2 * id, actors under 2 * id + 1.
+SEARCH_COLUMNS = {'movies': ('title', 0), 'actors': ('name', 1)}
+
+
+@event.listens_for(Movie.__table__, 'after_create')
+@event.listens_for(Actor.__table__, 'after_create')
+def create_search_index(table, connection, **kwargs):
+    column, kind = SEARCH_COLUMNS[table.name]
+    if connection.dialect.name == 'postgresql':
+        connection.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        connection.execute(
+            f'CREATE INDEX IF NOT EXISTS ix_{table.name}_{column}_trgm '
+            f'ON {table.name} USING gin ({column} gin_trgm_ops)')
+    elif connection.dialect.name == 'sqlite':
+        connection.execute('CREATE VIRTUAL TABLE IF NOT EXISTS search_index USING fts5(name, tokenize="trigram")')
+        connection.execute(
+            f'CREATE TRIGGER {table.name}_search_insert AFTER INSERT ON {table.name} BEGIN '
+            f'INSERT INTO search_index (rowid, name) VALUES (2 * new.id + {kind}, new.{column}); END')
+        connection.execute(
+            f'CREATE TRIGGER {table.name}_search_update AFTER UPDATE OF {column} ON {table.name} BEGIN '
+            f'UPDATE search_index SET name = new.{column} WHERE rowid = 2 * old.id + {kind}; END')
+        connection.execute(
+            f'CREATE TRIGGER {table.name}_search_delete AFTER DELETE ON {table.name} BEGIN '
+            f'DELETE FROM search_index WHERE rowid = 2 * old.id + {kind}; END')
+
+
+@event.listens_for(Movie.__table__, 'after_drop')
+@event.listens_for(Actor.__table__, 'after_drop')
+def drop_search_index(table, connection, **kwargs):
+    if connection.dialect.name == 'sqlite':
+        connection.execute('DROP TABLE IF EXISTS search_index')
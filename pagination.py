@@ -0,0 +1,184 @@
+import base64
+import binascii
+import json
+from datetime import date
+
+from flask import abort, current_app, request
+from sqlalchemy import and_, or_
+
+
+def encode_cursor(sort, values):
+    """
+    Builds the opaque cursor pointing right after a row
+    :param sort: Name of the sort order the cursor belongs to
+    :param values: Sort key values of the last row of the page
+    :return: base64url encoded cursor
+    """
+    raw = json.dumps({'s': sort, 'k': values}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).rstrip(b'=').decode()
+
+
+def decode_cursor(cursor, sort):
+    """
+    Reverse of encode_cursor
+    :param cursor: Cursor received from the client
+    :param sort: Name of the sort order of the current request
+    :return: Sort key values of the last row of the previous page
+    """
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        data = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        if data['s'] != sort or not isinstance(data['k'], list):
+            raise ValueError(cursor)
+        return data['k']
+    except (binascii.Error, ValueError, KeyError, TypeError):
+        abort(400, 'Invalid cursor')
+
+
+def get_page_args(sort='id'):
+    """
+    Reads the limit and cursor query parameters of a list request.
+    The limit defaults to DEFAULT_PAGE_SIZE and is capped at MAX_PAGE_SIZE.
+    :param sort: Name of the sort order of the request
+    :return: (limit, sort key values after which the page starts or None)
+    """
+    limit = request.args.get('limit', None)
+    if limit is None:
+        limit = current_app.config['DEFAULT_PAGE_SIZE']
+    else:
+        try:
+            limit = int(limit)
+        except ValueError:
+            abort(400, '"limit" must be an integer')
+        if limit < 1:
+            abort(400, '"limit" must be greater than 0')
+    limit = min(limit, current_app.config['MAX_PAGE_SIZE'])
+
+    cursor = request.args.get('cursor', None)
+    after = decode_cursor(cursor, sort) if cursor else None
+    return limit, after
+
+
+class SortOrder:
+    """
+    Order of a list request: one column, ascending or descending, with the primary key
+    as tie breaker so the order is total and a cursor points at exactly one position.
+    Rows whose sort column is NULL come last in either direction, on every database.
+    """
+
+    def __init__(self, column, key, descending=False):
+        """
+        :param column: Column to sort by
+        :param key: Primary key column of the model
+        :param descending: Sort from the largest value down
+        """
+        self.key = key
+        self.descending = descending
+        self.columns = [key] if column is key else [column, key]
+        self.name = ('-' if descending else '') + column.key
+        self.nullable = column is not key and column.expression.nullable
+
+    def order_by(self):
+        """
+        :return: ORDER BY clauses, an index on the sort column serves them in either direction
+        """
+        return [column.desc() if self.descending else column.asc() for column in self.columns]
+
+    def ranges(self, values=None):
+        """
+        Criteria of the consecutive ranges of rows that follow the sort key values of a cursor.
+        A nullable sort column has its NULL rows in a range of their own, after the others,
+        rather than in an OR that would keep the database from scanning the sort column index.
+        The others are selected with "column >= value AND (column > value OR id > last id)"
+        rather than a plain OR, so the leading range lets the database scan that index.
+        :param values: Sort key values decoded from the cursor, None for the first page
+        :return: List of SQL criteria, None for a range without criterion
+        """
+        if values is None:
+            return [self.columns[0].isnot(None), self.columns[0].is_(None)] if self.nullable else [None]
+        if len(values) != len(self.columns):
+            abort(400, 'Invalid cursor')
+        values = [self._from_json(column, value) for column, value in zip(self.columns, values)]
+        if len(values) == 1:
+            return [self.key < values[0] if self.descending else self.key > values[0]]
+
+        (column, value), (key, last_key) = zip(self.columns, values)
+        after_key = key < last_key if self.descending else key > last_key
+        if value is None:
+            return [and_(column.is_(None), after_key)]
+        if self.descending:
+            criterion = and_(column <= value, or_(column < value, after_key))
+        else:
+            criterion = and_(column >= value, or_(column > value, after_key))
+        return [criterion, column.is_(None)] if self.nullable else [criterion]
+
+    def cursor(self, row):
+        """
+        :param row: Last row of a page, it must have the sort columns selected
+        :return: Cursor pointing right after the row
+        """
+        values = [getattr(row, column.key) for column in self.columns]
+        return encode_cursor(self.name, [value.isoformat() if isinstance(value, date) else value
+                                         for value in values])
+
+    def _from_json(self, column, value):
+        if value is None and self.nullable and column is not self.key:
+            return None
+        python_type = column.type.python_type
+        if python_type is date and isinstance(value, str):
+            try:
+                return date.fromisoformat(value)
+            except ValueError:
+                abort(400, 'Invalid cursor')
+        if not isinstance(value, python_type):
+            abort(400, 'Invalid cursor')
+        return value
+
+
+def get_sort_order(model, allowed):
+    """
+    Reads the "sort" query parameter: a column name, prefixed with "-" for descending order
+    :param model: Movie or Actor
+    :param allowed: Names of the columns the list may be sorted by
+    :return: SortOrder, by ascending id when no "sort" is passed
+    """
+    sort = request.args.get('sort', 'id')
+    name = sort[1:] if sort.startswith('-') else sort
+    if name not in allowed:
+        abort(400, f'Invalid sort {sort}, expected one of {",".join(allowed)} with an optional "-" prefix')
+    return SortOrder(getattr(model, name), model.id, descending=sort.startswith('-'))
+
+
+def queries_after(query, sort, after):
+    """
+    Restricts a query to the rows following a cursor, one query per range of SortOrder.ranges
+    :param query: Query to restrict
+    :param sort: SortOrder of the request
+    :param after: Key values returned by get_page_args
+    :return: List of ordered queries, their rows follow each other
+    """
+    return [(query if criterion is None else query.filter(criterion)).order_by(*sort.order_by())
+            for criterion in sort.ranges(after)]
+
+
+def paginate(query, sort, limit, after=None):
+    """
+    Keyset pagination: the page starts right after the sort key of the last row of the previous
+    page, so every page is a single index range scan and deep pages cost the same as the first one.
+    :param query: Query to paginate, selecting the sort columns
+    :param sort: SortOrder of the request
+    :param limit: Page size
+    :param after: Key values returned by get_page_args
+    :return: (rows, next_cursor), next_cursor is None on the last page
+    """
+    rows = []
+    for range_query in queries_after(query, sort, after):
+        rows += range_query.limit(limit + 1 - len(rows)).all()
+        if len(rows) > limit:
+            break
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = sort.cursor(rows[-1])
+    return rows, next_cursor
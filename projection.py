@@ -0,0 +1,19 @@
+from flask import abort, request
+
+
+def get_fields(model):
+    """
+    Reads the comma separated "fields" query parameter and checks it against the model columns
+    :param model: Movie or Actor
+    :return: Tuple of column names in request order, or None when all fields are requested
+    """
+    fields = request.args.get('fields', None)
+    if not fields:
+        return None
+    names = [name.strip() for name in fields.split(',') if name.strip()]
+    columns = model.__table__.columns
+    unknown = [name for name in names if name not in columns]
+    if unknown or not names:
+        abort(400, f'Invalid fields {",".join(unknown)}, expected a subset of {",".join(columns.keys())}')
+    return tuple(dict.fromkeys(names))
+
@@ -0,0 +1,159 @@
+import itertools
+import threading
+import time
+from functools import wraps
+
+from flask import current_app, g, has_request_context, request
+from flask_sqlalchemy import SignallingSession, SQLAlchemy
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import sessionmaker
+
+
+class RoutingSession(SignallingSession):
+    """
+    Session bound to the read replica chosen for the current request, if any,
+    and to the primary database otherwise
+    """
+
+    def get_bind(self, mapper=None, clause=None):
+        replica = g.get('read_replica') if has_request_context() else None
+        if replica is not None:
+            return replica
+        return super().get_bind(mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    """
+    Flask-SQLAlchemy whose sessions can be routed to a read replica, see read_replica
+    """
+
+    def create_session(self, options):
+        return sessionmaker(class_=RoutingSession, db=self, **options)
+
+
+class ReplicaRouter:
+    """
+    Spreads the reads of the read_replica end points over the replicas, round robin.
+    A replica failing to connect is skipped until it answers a health check again,
+    tried at most every `retry_seconds`. Clients that wrote within the last `window`
+    seconds read from the primary, so they see their own writes despite replication lag.
+    """
+
+    def __init__(self, engines, backend, window, retry_seconds):
+        """
+        :param engines: Engines of the replicas
+        :param backend: LocalCache or a cachelib cache remembering recent writers
+        :param window: Seconds a client reads from the primary after a write
+        :param retry_seconds: Seconds a failed replica is skipped before being checked again
+        """
+        self.engines = engines
+        self.backend = backend
+        self.window = window
+        self.retry_seconds = retry_seconds
+        self._down_until = {}
+        self._lock = threading.Lock()
+        self._next = itertools.count()
+        for engine in engines:
+            event.listen(engine, 'handle_error', self.on_error)
+            self.check(engine)
+
+    def on_error(self, context):
+        # connection refused (no connection yet) or dropped, not errors of a statement
+        if context.engine is not None and (context.connection is None or context.is_disconnect):
+            self.mark_down(context.engine)
+
+    def mark_down(self, engine):
+        with self._lock:
+            self._down_until[engine] = time.monotonic() + self.retry_seconds
+
+    def check(self, engine):
+        """
+        Health check of a replica, marks it down or up
+        :return: True if the replica answered
+        """
+        try:
+            with engine.connect() as connection:
+                connection.execute(text('SELECT 1'))
+        except SQLAlchemyError:
+            self.mark_down(engine)
+            return False
+        with self._lock:
+            self._down_until.pop(engine, None)
+        return True
+
+    def choose(self):
+        """
+        :return: Engine of the next healthy replica, or None if all of them are down
+        """
+        now = time.monotonic()
+        for _ in range(len(self.engines)):
+            engine = self.engines[next(self._next) % len(self.engines)]
+            down_until = self._down_until.get(engine)
+            if down_until is None or (down_until <= now and self.check(engine)):
+                return engine
+        return None
+
+    def record_write(self, sub):
+        self.backend.set(f'wrote:{sub}', 1, timeout=self.window)
+
+    def wrote_recently(self, sub):
+        return self.window > 0 and self.backend.get(f'wrote:{sub}') is not None
+
+    def stats(self):
+        """
+        :return: Health of each replica, in REPLICA_URLS order
+        """
+        now = time.monotonic()
+        with self._lock:
+            return [{'replica': index, 'healthy': self._down_until.get(engine, 0) <= now}
+                    for index, engine in enumerate(self.engines)]
+
+
+def init_replicas(app, engine_options, backend):
+    """
+    Sets up the read replicas of REPLICA_URLS for an app, and remembers the clients
+    that wrote so read_replica sends them to the primary for READ_YOUR_WRITES_SECONDS
+    :param app: Flask app
+    :param engine_options: Function building the create_engine arguments from the app config and a URL
+    :param backend: LocalCache or a cachelib cache, shared by the workers to route their clients alike
+    :return: ReplicaRouter, or None when no replica is configured
+    """
+    urls = [url.strip() for url in (app.config['REPLICA_URLS'] or '').split(',') if url.strip()]
+    if not urls:
+        return None
+    engines = [create_engine(url, **engine_options(app.config, url)) for url in urls]
+    router = ReplicaRouter(engines, backend, app.config['READ_YOUR_WRITES_SECONDS'],
+                           app.config['REPLICA_RETRY_SECONDS'])
+    app.extensions['replica_router'] = router
+
+    @app.after_request
+    def remember_writer(response):
+        payload = g.get('token_payload')
+        if request.method in ('POST', 'PATCH', 'DELETE') and response.status_code < 400 and payload:
+            router.record_write(payload.get('sub'))
+        return response
+
+    return router
+
+
+def read_replica(f):
+    """
+    Runs the queries of a read only end point on a read replica, unless the client
+    wrote recently (g.wrote_recently is then set) or no replica is healthy.
+    Apply below requires_auth and above cached.
+    :param f: View function taking the token payload first
+    :return: Decorated view function
+    """
+
+    @wraps(f)
+    def wrapper(payload, *args, **kwargs):
+        router = current_app.extensions.get('replica_router')
+        if router is not None:
+            if router.wrote_recently(payload.get('sub')):
+                g.wrote_recently = True
+            else:
+                g.read_replica = router.choose()
+        return f(payload, *args, **kwargs)
+
+    return wrapper
@@ -0,0 +1,100 @@
+from flask import abort, current_app, request
+from sqlalchemy import text
+
+from models import SEARCH_COLUMNS, db, is_postgres
+from pagination import encode_cursor, get_page_args
+
+# search result type: table
+SEARCH_TYPES = {'movie': 'movies', 'actor': 'actors'}
+
+
+def trigrams(value):
+    """
+    :param value: Text
+    :return: Set of the lower cased three character substrings of the text
+    """
+    value = value.lower()
+    return {value[i:i + 3] for i in range(len(value) - 2)}
+
+
+def get_search_args():
+    """
+    Reads the query parameters of a search request
+    :return: (query text, limit, offset of the page within the ranked results)
+    """
+    q = request.args.get('q', '').strip()
+    if len(q) < 3:
+        abort(400, '"q" must be at least 3 characters long')
+    # a cursor is only valid for the query it was returned with
+    limit, after = get_page_args(f'search:{q}')
+    if after is None:
+        return q, limit, 0
+    if len(after) != 1 or not isinstance(after[0], int) or after[0] < 0:
+        abort(400, 'Invalid cursor')
+    return q, limit, after[0]
+
+
+def search(q, types, limit, offset=0):
+    """
+    Ranked, typo tolerant search over movie titles and actor names.
+    Ranking is by trigram similarity, only the best SEARCH_MAX_RESULTS hits can be paged through.
+    :param q: Query text, at least 3 characters
+    :param types: Result types to search, subset of SEARCH_TYPES
+    :param limit: Page size
+    :param offset: Position of the page within the ranked results
+    :return: (hits, next_cursor), next_cursor is None on the last page
+    """
+    window = current_app.config['SEARCH_MAX_RESULTS']
+    threshold = current_app.config['SEARCH_MIN_SIMILARITY']
+    if offset >= window:
+        return [], None
+    count = min(limit, window - offset)
+    if is_postgres():
+        hits = _search_postgres(q, types, threshold, count + 1, offset)
+    else:
+        hits = _search_sqlite(q, types, threshold, window)[offset:offset + count + 1]
+
+    next_cursor = None
+    if len(hits) > count:
+        hits = hits[:count]
+        if offset + count < window:
+            next_cursor = encode_cursor(f'search:{q}', [offset + count])
+    return hits, next_cursor
+
+
+def _search_postgres(q, types, threshold, limit, offset):
+    # "<%" is the word similarity operator of pg_trgm, answered from the trigram GIN indexes
+    db.session.execute(text("SELECT set_config('pg_trgm.word_similarity_threshold', :threshold, true)"),
+                       {'threshold': str(threshold)})
+    selects = []
+    for name in types:
+        table = SEARCH_TYPES[name]
+        column, _ = SEARCH_COLUMNS[table]
+        selects.append(
+            f"SELECT '{name}' AS type, id, {column} AS name, word_similarity(:q, {column}) AS score "
+            f"FROM {table} WHERE :q <% {column}")
+    statement = text(' UNION ALL '.join(selects) + ' ORDER BY score DESC, type, id LIMIT :limit OFFSET :offset')
+    rows = db.session.execute(statement, {'q': q, 'limit': limit, 'offset': offset})
+    return [{'type': row.type, 'id': row.id, 'name': row.name, 'score': round(row.score, 3)} for row in rows]
+
+
+def _search_sqlite(q, types, threshold, window):
+    # Any shared trigram makes a candidate, so misspelled queries still match. FTS5 returns
+    # the best candidates by bm25, which are then ranked by the share of the query
+    # trigrams they contain, the same measure pg_trgm uses.
+    query_trigrams = trigrams(q)
+    match = ' OR '.join('"{}"'.format(trigram.replace('"', '""')) for trigram in sorted(query_trigrams))
+    kinds = [SEARCH_COLUMNS[SEARCH_TYPES[name]][1] for name in types]
+    statement = 'SELECT rowid, name FROM search_index WHERE search_index MATCH :match'
+    if len(kinds) == 1:
+        statement += f' AND rowid % 2 = {kinds[0]}'
+    rows = db.session.execute(text(statement + ' ORDER BY rank LIMIT :window'), {'match': match, 'window': window})
+
+    hits = []
+    for rowid, name in rows:
+        score = len(query_trigrams & trigrams(name or '')) / len(query_trigrams)
+        if score >= threshold:
+            hits.append({'type': 'actor' if rowid % 2 else 'movie', 'id': rowid // 2, 'name': name,
+                         'score': round(score, 3)})
+    hits.sort(key=lambda hit: (-hit['score'], hit['type'], hit['id']))
+    return hits
@@ -0,0 +1,112 @@
+import json
+from datetime import date
+from functools import lru_cache
+from operator import itemgetter
+
+from flask import current_app
+from flask.json import JSONEncoder
+
+from models import db
+from timing import phase
+
+try:
+    import orjson
+except ImportError:  # optional, the standard library encoder is used without it
+    orjson = None
+
+
+def json_default(value):
+    if isinstance(value, date):
+        return value.isoformat()
+    raise TypeError(f'{type(value).__name__} is not JSON serializable')
+
+
+_encoder = json.JSONEncoder(separators=(',', ':'), default=json_default)
+
+
+def dumps(obj):
+    """
+    Compact JSON encoding with ISO 8601 dates, using orjson when it is installed
+    :param obj: Object to encode
+    :return: UTF-8 encoded JSON
+    """
+    if orjson is not None:
+        return orjson.dumps(obj, default=json_default)
+    return _encoder.encode(obj).encode()
+
+
+def json_response(obj, status=200):
+    """
+    Faster replacement of jsonify for large payloads
+    :param obj: Object to encode
+    :param status: HTTP status code
+    :return: JSON response
+    """
+    with phase('serialize'):
+        body = dumps(obj)
+    return current_app.response_class(body, status=status, mimetype='application/json')
+
+
+class ISODateJSONEncoder(JSONEncoder):
+    """
+    Flask JSON encoder writing dates as YYYY-MM-DD, so jsonify responses match the list end points
+    """
+
+    def default(self, o):
+        if isinstance(o, date):
+            return o.isoformat()
+        return super().default(o)
+
+
+class RowSerializer:
+    """
+    Turns result rows of a column query straight into response dicts.
+
+    The column list and the row-to-dict mapping are worked out once per model and
+    field set (see get_serializer), so serializing a row is a single dict(zip(...))
+    without ORM instances, attribute lookups or a serialize() call per row.
+    """
+
+    def __init__(self, model, fields=None):
+        """
+        :param model: Movie or Actor
+        :param fields: Column names to return, all columns when None
+        """
+        names = list(fields) if fields else list(model.__table__.columns.keys())
+        # the id column is always selected first, pagination is keyed on it
+        selected = ['id'] + [name for name in names if name != 'id']
+        self.names = tuple(names)
+        self.columns = [getattr(model, name) for name in selected]
+
+        indexes = [selected.index(name) for name in names]
+        if indexes == list(range(len(names))):
+            self._pick = None
+        elif len(indexes) == 1:
+            index = indexes[0]
+            self._pick = lambda row: (row[index],)
+        else:
+            self._pick = itemgetter(*indexes)
+
+    def query(self, *extra):
+        """
+        :param extra: Further columns to select, e.g. the sort column of a sparse fieldset.
+                      They come after the serialized ones and are left out of the response
+        :return: Query selecting the serialized columns, rows come back as tuples
+        """
+        selected = {column.key for column in self.columns}
+        columns = self.columns + [column for column in extra if column.key not in selected]
+        return db.session.query(*columns)
+
+    def __call__(self, row):
+        values = row if self._pick is None else self._pick(row)
+        return dict(zip(self.names, values))
+
+
+@lru_cache(maxsize=64)
+def get_serializer(model, fields=None):
+    """
+    :param model: Movie or Actor
+    :param fields: Tuple of column names returned by projection.get_fields, or None
+    :return: Shared RowSerializer for the model and field set
+    """
+    return RowSerializer(model, fields)
@@ -0,0 +1,58 @@
+from itertools import chain
+
+from flask import Response, request, stream_with_context
+
+from pagination import queries_after
+from serializers import dumps
+
+NDJSON_MIMETYPE = 'application/x-ndjson'
+
+# rows fetched per round trip from the server side cursor
+STREAM_BATCH_SIZE = 1000
+
+
+def wants_ndjson():
+    """
+    :return: True if the client prefers newline delimited JSON over a JSON document
+    """
+    return request.accept_mimetypes.best_match(
+        ['application/json', NDJSON_MIMETYPE]) == NDJSON_MIMETYPE
+
+
+def ndjson_response(query, sort, after=None, serialize=None, attach=None):
+    """
+    Streams every row of a query as one JSON object per line.
+    Rows come off a server side cursor (yield_per) and are written out as they arrive,
+    so the full list is never held in memory.
+    :param query: Query to stream
+    :param sort: SortOrder of the request, see pagination.get_sort_order
+    :param after: Key values after which the stream starts, see pagination.get_page_args
+    :param serialize: Function turning a row into a dict, defaults to the row's serialize()
+    :param attach: Function completing a batch of serialized rows, called as attach(rows, items)
+                   once per STREAM_BATCH_SIZE rows, e.g. to embed relations
+    :return: Streaming response
+    """
+    # each range is queried once the previous one is exhausted
+    rows = chain.from_iterable(range_query.yield_per(STREAM_BATCH_SIZE)
+                               for range_query in queries_after(query, sort, after))
+
+    def generate():
+        if attach is None:
+            for row in rows:
+                data = serialize(row) if serialize else row.serialize()
+                yield dumps(data) + b'\n'
+            return
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) == STREAM_BATCH_SIZE:
+                yield write_batch(batch)
+                batch = []
+        if batch:
+            yield write_batch(batch)
+
+    def write_batch(batch):
+        items = attach(batch, [serialize(row) if serialize else row.serialize() for row in batch])
+        return b''.join(dumps(data) + b'\n' for data in items)
+
+    return Response(stream_with_context(generate()), mimetype=NDJSON_MIMETYPE)
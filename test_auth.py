@@ -0,0 +1,257 @@
+import json
+import os
+import tempfile
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from jose import jwk, jwt
+
+from auth.jwks import JWKSFetchError, JWKSKeyStore, PinnedKeyStore, jwk_thumbprint
+from auth.token_cache import VerifiedTokenCache
+
+
+def make_signing_key(kid):
+    """
+    Generate a local RSA keypair to sign test tokens with
+    :param kid: Key id of the public JWK
+    :return: (private key PEM, public key PEM, public JWK dict)
+    """
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    private_pem = private_key.private_bytes(
+        serialization.Encoding.PEM,
+        serialization.PrivateFormat.PKCS8,
+        serialization.NoEncryption()).decode()
+    public_pem = private_key.public_key().public_bytes(
+        serialization.Encoding.PEM,
+        serialization.PublicFormat.SubjectPublicKeyInfo).decode()
+    public_jwk = jwk.construct(public_pem, 'RS256').to_dict()
+    public_jwk.update(kid=kid, use='sig')
+    return private_pem, public_pem, public_jwk
+
+
+def sign_token(private_pem, kid, claims):
+    """
+    Sign a RS256 test token
+    :param private_pem: Private key PEM
+    :param kid: Key id put in the token header
+    :param claims: Token claims
+    :return: Encoded JWT
+    """
+    return jwt.encode(claims, private_pem, algorithm='RS256', headers={'kid': kid})
+
+
+class JWKSStandIn:
+    """
+    Local HTTP stand-in for the identity provider's jwks.json endpoint
+    """
+
+    def __init__(self, kids):
+        self.kids = list(kids)
+        self.public_jwks = {}
+        self.requests = 0
+        self.delay = 0
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                stand_in.requests += 1
+                time.sleep(stand_in.delay)
+                body = json.dumps({'keys': [
+                    stand_in.public_jwk(kid) for kid in stand_in.kids
+                ]}).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = HTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f'http://127.0.0.1:{self.server.server_port}/.well-known/jwks.json'
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def public_jwk(self, kid):
+        if kid not in self.public_jwks:
+            self.public_jwks[kid] = make_signing_key(kid)[2]
+        return self.public_jwks[kid]
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class JWKSKeyStoreTestCase(unittest.TestCase):
+    """This class represents the JWKS key store test cases"""
+
+    def setUp(self):
+        self.stand_in = JWKSStandIn(['kid-1'])
+
+    def tearDown(self):
+        self.stand_in.stop()
+
+    def test_key_set_is_fetched_once(self):
+        store = JWKSKeyStore(self.stand_in.url)
+        for _ in range(5):
+            self.assertIsNotNone(store.get_key('kid-1'))
+        self.assertEqual(self.stand_in.requests, 1)
+        stats = store.stats()
+        self.assertEqual(stats['hits'], 5)
+        self.assertEqual(stats['refreshes'], 1)
+
+    def test_unknown_kid_triggers_refetch(self):
+        store = JWKSKeyStore(self.stand_in.url, min_refetch_interval=0)
+        store.get_key('kid-1')
+        self.stand_in.kids.append('kid-2')
+        self.assertIsNotNone(store.get_key('kid-2'))
+        self.assertEqual(self.stand_in.requests, 2)
+        self.assertEqual(store.stats()['misses'], 1)
+
+    def test_unknown_kid_refetch_is_rate_limited(self):
+        store = JWKSKeyStore(self.stand_in.url, min_refetch_interval=60)
+        store.get_key('kid-1')
+        for _ in range(3):
+            self.assertIsNone(store.get_key('unknown'))
+        self.assertEqual(self.stand_in.requests, 1)
+
+    def concurrently(self, function, count=10):
+        threads = [threading.Thread(target=function) for _ in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def test_concurrent_cold_start_fetches_once(self):
+        self.stand_in.delay = 0.2
+        store = JWKSKeyStore(self.stand_in.url)
+        keys = []
+        self.concurrently(lambda: keys.append(store.get_key('kid-1')))
+        self.assertEqual(len(keys), 10)
+        self.assertTrue(all(key is not None for key in keys))
+        self.assertEqual(self.stand_in.requests, 1)
+
+    def test_concurrent_unknown_kids_refetch_once(self):
+        store = JWKSKeyStore(self.stand_in.url, min_refetch_interval=0)
+        store.get_key('kid-1')
+        self.stand_in.kids.append('kid-2')
+        self.stand_in.delay = 0.2
+        self.concurrently(lambda: store.get_key('kid-2'))
+        self.assertEqual(self.stand_in.requests, 2)
+
+    def test_stale_key_set_is_served_while_refreshing(self):
+        store = JWKSKeyStore(self.stand_in.url, ttl=0)
+        store.get_key('kid-1')
+        self.stand_in.delay = 0.5
+        started = time.monotonic()
+        self.assertIsNotNone(store.get_key('kid-1'))
+        self.assertLess(time.monotonic() - started, 0.5)
+
+    def test_fetch_timeout(self):
+        self.stand_in.delay = 1
+        store = JWKSKeyStore(self.stand_in.url, timeout=0.1)
+        with self.assertRaises(JWKSFetchError):
+            store.get_key('kid-1')
+        self.assertEqual(store.stats()['errors'], 1)
+
+
+class PinnedKeyStoreTestCase(unittest.TestCase):
+    """This class represents the pinned (offline) key store test cases"""
+
+    def setUp(self):
+        self.private_pem, self.public_pem, self.public_jwk = make_signing_key('pinned')
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def write(self, name, content):
+        path = os.path.join(self.directory.name, name)
+        with open(path, 'w') as f:
+            f.write(content)
+        return path
+
+    def test_keys_are_loaded_from_jwks_file(self):
+        path = self.write('jwks.json', json.dumps({'keys': [self.public_jwk]}))
+        store = PinnedKeyStore.from_file(path)
+        key = store.get_key('pinned')
+        self.assertIs(store.get_key('pinned'), key)
+        token = sign_token(self.private_pem, 'pinned', {'sub': 'auth0|user'})
+        self.assertEqual(jwt.decode(token, key, algorithms=['RS256'])['sub'], 'auth0|user')
+
+    def test_keys_are_loaded_from_pem_bundle(self):
+        other_public_pem = make_signing_key('other')[1]
+        path = self.write('keys.pem', self.public_pem + other_public_pem)
+        store = PinnedKeyStore.from_file(path)
+        self.assertEqual(store.stats()['keys'], 2)
+        kid = jwk_thumbprint(jwk.construct(self.public_pem, 'RS256'))
+        token = sign_token(self.private_pem, kid, {'sub': 'auth0|user'})
+        self.assertEqual(jwt.decode(token, store.get_key(kid), algorithms=['RS256'])['sub'], 'auth0|user')
+        self.assertIsNone(store.get_key('unknown'))
+
+    def test_single_pem_key_verifies_token_whatever_its_kid(self):
+        path = self.write('key.pem', self.public_pem)
+        store = PinnedKeyStore.from_file(path)
+        token = sign_token(self.private_pem, 'LpcGWXtVdmGxBbz5M0Tzf', {'sub': 'auth0|user'})
+        key = store.get_key('LpcGWXtVdmGxBbz5M0Tzf')
+        self.assertEqual(jwt.decode(token, key, algorithms=['RS256'])['sub'], 'auth0|user')
+        self.assertEqual(store.stats()['hits'], 1)
+
+    def test_pem_bundle_keys_are_found_by_kid_line(self):
+        other_private_pem, other_public_pem, _ = make_signing_key('other')
+        path = self.write('keys.pem', 'kid: auth0-current\n' + self.public_pem
+                          + 'kid: auth0-next\n' + other_public_pem)
+        store = PinnedKeyStore.from_file(path)
+        self.assertEqual(store.stats()['keys'], 2)
+        token = sign_token(other_private_pem, 'auth0-next', {'sub': 'auth0|user'})
+        key = store.get_key('auth0-next')
+        self.assertEqual(jwt.decode(token, key, algorithms=['RS256'])['sub'], 'auth0|user')
+        self.assertIsNot(store.get_key('auth0-current'), key)
+        self.assertIsNone(store.get_key('unknown'))
+
+
+class VerifiedTokenCacheTestCase(unittest.TestCase):
+    """This class represents the verified token cache test cases"""
+
+    def payload(self, expires_in=3600):
+        return {'sub': 'auth0|user', 'exp': time.time() + expires_in, 'permissions': ['get:movie']}
+
+    def test_cached_payload_is_returned(self):
+        cache = VerifiedTokenCache()
+        payload = self.payload()
+        cache.set('token-1', payload)
+        self.assertEqual(cache.get('token-1'), payload)
+        self.assertIsNone(cache.get('token-2'))
+        self.assertEqual(cache.stats()['hits'], 1)
+        self.assertEqual(cache.stats()['misses'], 1)
+
+    def test_entry_expires_at_exp_claim(self):
+        cache = VerifiedTokenCache()
+        cache.set('token-1', self.payload(expires_in=-1))
+        self.assertIsNone(cache.get('token-1'))
+        cache.set('token-2', {'sub': 'auth0|user'})
+        self.assertEqual(cache.stats()['entries'], 0)
+
+    def test_least_recently_used_entry_is_evicted(self):
+        cache = VerifiedTokenCache(max_entries=2)
+        cache.set('token-1', self.payload())
+        cache.set('token-2', self.payload())
+        cache.get('token-1')
+        cache.set('token-3', self.payload())
+        self.assertIsNotNone(cache.get('token-1'))
+        self.assertIsNone(cache.get('token-2'))
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+    def test_memory_cap(self):
+        cache = VerifiedTokenCache(max_bytes=1000)
+        for i in range(20):
+            cache.set(f'token-{i}', self.payload())
+        self.assertLessEqual(cache.stats()['bytes'], 1000)
+        self.assertIsNotNone(cache.get('token-19'))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,21 +1,88 @@
+import gzip
+import hashlib
+import io
 import json
 import os
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
 import unittest
+import zlib
+from contextlib import contextmanager
+from datetime import date, timedelta
 
-from flask_sqlalchemy import SQLAlchemy
+from flask import abort, jsonify
+from sqlalchemy import event
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
 
-from app import create_app
-from models import setup_db, Movie, Actor
+os.environ.setdefault('AUTH0_DOMAIN', 'fsnd-test.auth0.local')
+os.environ.setdefault('API_AUDIENCE', 'fsnd')
+
+from app import create_app  # noqa: E402
+from auth import auth  # noqa: E402
+from bulk_io import EXPORT_BATCH_SIZE, detect_format, export_rows, import_rows, read_rows  # noqa: E402
+from cache import LocalCache  # noqa: E402
+from casting import add_cast  # noqa: E402
+from compression import Encoder, brotli, compress_stream  # noqa: E402
+from dbpool import InstrumentedQueuePool, engine_options, pool_stats  # noqa: E402
+from filtering import ACTOR_FILTERS, ACTOR_SORTS, MOVIE_FILTERS, MOVIE_SORTS, get_filters  # noqa: E402
+from models import BATCH_SIZE, setup_db, db, movie_actors, Movie, Actor, TableVersion  # noqa: E402
+from pagination import encode_cursor, get_page_args, get_sort_order, queries_after  # noqa: E402
+from serializers import get_serializer  # noqa: E402
+from test_auth import make_signing_key, sign_token  # noqa: E402
+from timing import RequestTimer, normalize_sql  # noqa: E402
+from unit_of_work import UNPROCESSABLE_MESSAGE, abort_unprocessable  # noqa: E402
+
+# Tokens are signed with a local keypair, the app verifies them against the
+# pinned public key so the tests never depend on Auth0 or on expired tokens.
+SIGNING_KEY_ID = 'test-signing-key'
+PRIVATE_KEY, _, PUBLIC_JWK = make_signing_key(SIGNING_KEY_ID)
+JWKS_FILE = os.path.join(tempfile.mkdtemp(), 'jwks.json')
+with open(JWKS_FILE, 'w') as jwks_file:
+    json.dump({'keys': [PUBLIC_JWK]}, jwks_file)
+
+ROLE_PERMISSIONS = {
+    'casting_assistant': ['get:actor', 'get:movie'],
+    'casting_director': [
+        'delete:actor', 'get:actor', 'get:movie', 'patch:actor',
+        'patch:movie', 'post:actor'],
+    'executive_producer': [
+        'delete:actor', 'delete:movie', 'get:actor', 'get:movie',
+        'patch:actor', 'patch:movie', 'post:actor', 'post:movie'],
+}
+
+
+def create_test_token(role):
+    """
+    Create a signed JWT for a role
+    :param role: Key of ROLE_PERMISSIONS
+    :return: Encoded JWT
+    """
+    now = int(time.time())
+    return sign_token(PRIVATE_KEY, SIGNING_KEY_ID, {
+        'iss': f'https://{auth.AUTH0_DOMAIN}/',
+        'aud': auth.API_AUDIENCE,
+        'sub': f'auth0|{role}',
+        'iat': now,
+        'exp': now + 3600,
+        'permissions': ROLE_PERMISSIONS[role],
+    })
 
 
 def create_test_movie(data):
     """
     Create a test movie record
     :param data: {"title": "Movie_Title", "release_data": "2020-10-10"}
-    :return: Created Movie instance
+    :return: Created Movie instance, detached so later requests do not expire it
     """
     movie = Movie(**data)
     movie.insert()
+    db.session.commit()
+    db.session.refresh(movie)
+    db.session.expunge(movie)
     return movie
 
 
@@ -23,19 +90,58 @@ def create_test_actor(data):
     """
     Create a test actor record
     :param data: {"name": "Test Actor", "gender": "Male", "age": 55}
-    :return: Created Actor instance
+    :return: Created Actor instance, detached so later requests do not expire it
     """
     actor = Actor(**data)
     actor.insert()
+    db.session.commit()
+    db.session.refresh(actor)
+    db.session.expunge(actor)
     return actor
 
 
-class MoviesTestCase(unittest.TestCase):
+class QueryCounter:
+    """Counts the SQL statements sent to the database within a with block"""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.statements = []
+
+    @property
+    def count(self):
+        return len(self.statements)
+
+    def __enter__(self):
+        event.listen(self.engine, 'before_cursor_execute', self.on_execute)
+        return self
+
+    def __exit__(self, *exc_info):
+        event.remove(self.engine, 'before_cursor_execute', self.on_execute)
+
+    def on_execute(self, conn, cursor, statement, *args):
+        self.statements.append(normalize_sql(statement))
+
+
+class QueryBudgetMixin:
+    """Fails a test when a block of code runs more SQL statements than its budget"""
+
+    @contextmanager
+    def assertMaxQueries(self, budget):
+        with self.app.app_context():
+            engine = self.db.engine
+        with QueryCounter(engine) as queries:
+            yield queries
+        if queries.count > budget:
+            self.fail('{} queries executed, the budget is {}:\n{}'.format(
+                queries.count, budget, '\n'.join(queries.statements)))
+
+
+class MoviesTestCase(QueryBudgetMixin, unittest.TestCase):
     """This class represents the Capstone Project test cases"""
 
     def setUp(self):
         """Define test variables and initialize app."""
-        self.app = create_app()
+        self.app = create_app({'AUTH0_JWKS_FILE': JWKS_FILE})
         self.client = self.app.test_client
         self.database_name = "capstone_test"
         self.database_path = os.getenv("DATABASE_URL")
@@ -55,13 +161,13 @@ class MoviesTestCase(unittest.TestCase):
             'name': 'Shahrukh Khan Updated',
         }
         # Casting Assistant (can view movies and actors)
-        casting_assistant_token = os.getenv("CASTING_ASSISTANT_TOKEN")
+        casting_assistant_token = create_test_token('casting_assistant')
         # Casting Director (Casting Assistant role + can add, delete, patch
         # actors, can patch movies)
-        casting_director_token = os.getenv("CASTING_DIRECTOR_TOKEN")
+        casting_director_token = create_test_token('casting_director')
         # Executive Producer (Casting Director role + can add, delete, patch
         # actors and movies)
-        executive_producer_token = os.getenv("EXECUTIVE_PRODUCER_TOKEN")
+        executive_producer_token = create_test_token('executive_producer')
         setup_db(self.app, self.database_path)
         # Headers for different roles
         self.casting_assistant_header = {
@@ -78,8 +184,7 @@ class MoviesTestCase(unittest.TestCase):
         }
         # binds the app to the current context
         with self.app.app_context():
-            self.db = SQLAlchemy()
-            self.db.init_app(self.app)
+            self.db = db
             # create all tables
             self.db.create_all()
 
@@ -116,6 +221,229 @@ class MoviesTestCase(unittest.TestCase):
             data['message'],
             f'Movie with name {self.test_movie_data["title"]} already exists.')
 
+    def test_post_movie_when_release_date_is_invalid(self):
+        response = self.client().post(
+            f'/api/movie',
+            data=json.dumps({'title': 'Interstellar', 'release_date': '20-10-2015'}),
+            content_type='application/json',
+            headers=self.executive_producer_header)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(json.loads(response.data)['message'], 'Invalid release_date 20-10-2015, expected YYYY-MM-DD')
+        self.assertEqual(Movie.query.count(), 0)
+
+    def test_post_actor_when_values_have_the_wrong_type(self):
+        for values, message in [({'age': True}, 'Invalid age True, expected an integer'),
+                                ({'gender': {'x': 1}}, "Invalid gender {'x': 1}, expected a string")]:
+            response = self.client().post('/api/actor', data=json.dumps(dict(self.test_actor_data, **values)),
+                                          headers=self.executive_producer_header)
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(json.loads(response.data)['message'], message)
+        response = self.client().post('/api/actor/bulk', data=json.dumps([dict(self.test_actor_data, age=True)]),
+                                      headers=self.executive_producer_header)
+        self.assertEqual(json.loads(response.data)['results'][0]['error'], 400)
+        self.assertEqual(Actor.query.count(), 0)
+
+    def test_database_errors_are_not_sent_to_clients(self):
+        @self.app.route('/test/database-error', methods=['POST'])
+        def database_error():
+            try:
+                db.session.execute('SELECT * FROM no_such_table')
+            except Exception as e:
+                abort_unprocessable(e)
+
+        response = self.client().post('/test/database-error')
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(json.loads(response.data)['message'], UNPROCESSABLE_MESSAGE)
+
+    def test_post_movies_bulk(self):
+        create_test_movie(self.test_movie_data)
+        movies = [
+            {'title': 'Ludo', 'release_date': '2020-10-10'},
+            self.test_movie_data,
+            {'title': 'Challang'},
+            {'title': 'Ludo', 'release_date': '2020-10-11'},
+            {'title': 'Dangal', 'release_date': '2016-12-23'},
+        ]
+        response = self.client().post('/api/movie/bulk', data=json.dumps(movies),
+                                      content_type='application/json',
+                                      headers=self.executive_producer_header)
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.data)
+        self.assertEqual(data['created'], 2)
+        results = data['results']
+        self.assertEqual(results[0]['movie']['title'], 'Ludo')
+        self.assertTrue(results[0]['movie']['id'])
+        self.assertEqual(results[1]['error'], 409)
+        self.assertEqual(results[2]['error'], 400)
+        self.assertEqual(results[3]['error'], 409)
+        self.assertEqual(results[4]['movie']['title'], 'Dangal')
+        self.assertEqual(Movie.query.count(), 3)
+
+    def test_post_movies_bulk_duplicates_looked_up_in_batches(self):
+        create_test_movie({'title': 'Movie 550', 'release_date': '2020-07-11'})
+        movies = [{'title': f'Movie {i}', 'release_date': '2020-07-11'} for i in range(BATCH_SIZE + 100)]
+        response = self.client().post('/api/movie/bulk', data=json.dumps(movies),
+                                      content_type='application/json',
+                                      headers=self.executive_producer_header)
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.data)
+        self.assertEqual(data['created'], BATCH_SIZE + 99)
+        self.assertEqual(data['results'][550]['error'], 409)
+
+    def test_post_movies_bulk_too_many_items(self):
+        self.app.config['BULK_MAX_ITEMS'] = 1
+        response = self.client().post('/api/movie/bulk',
+                                      data=json.dumps([self.test_movie_data] * 2),
+                                      content_type='application/json',
+                                      headers=self.executive_producer_header)
+        self.assertEqual(response.status_code, 400)
+        data = json.loads(response.data)
+        self.assertEqual(data['message'], 'At most 1 items can be sent at once')
+
+    def test_post_movies_bulk_casting_director(self):
+        response = self.client().post('/api/movie/bulk',
+                                      data=json.dumps([self.test_movie_data]),
+                                      content_type='application/json',
+                                      headers=self.casting_director_header)
+        self.assertEqual(response.status_code, 403)
+
+    def test_patch_movies_bulk(self):
+        movie_ids = [create_test_movie(dict(self.test_movie_data, title=f'Movie {i}')).id for i in range(3)]
+        response = self.client().patch('/api/movie/bulk',
+                                       data=json.dumps({'ids': movie_ids[:2] + [987654],
+                                                        'set': {'release_date': '2021-05-06'}}),
+                                       content_type='application/json',
+                                       headers=self.casting_director_header)
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.data)
+        self.assertEqual(data['updated'], movie_ids[:2])
+        self.assertEqual(data['not_found'], [987654])
+        with self.app.app_context():
+            dates = dict(self.db.session.query(Movie.id, Movie.release_date))
+        self.assertEqual(dates[movie_ids[0]], date(2021, 5, 6))
+        self.assertEqual(dates[movie_ids[1]], date(2021, 5, 6))
+        self.assertNotEqual(dates[movie_ids[2]], date(2021, 5, 6))
+
+    def test_patch_movies_bulk_unique_column(self):
+        movie_id = create_test_movie(self.test_movie_data).id
+        response = self.client().patch('/api/movie/bulk',
+                                       data=json.dumps({'ids': [movie_id], 'set': {'title': 'Same'}}),
+                                       content_type='application/json',
+                                       headers=self.executive_producer_header)
+        self.assertEqual(response.status_code, 400)
+        data = json.loads(response.data)
+        self.assertEqual(data['message'], 'Invalid column title, expected one of release_date')
+
+    def test_delete_movies_bulk(self):
+        movie_ids = [create_test_movie(dict(self.test_movie_data, title=f'Movie {i}')).id for i in range(3)]
+        with self.assertMaxQueries(3):
+            response = self.client().delete(f'/api/movie?ids={movie_ids[0]},{movie_ids[1]},987654',
+                                            headers=self.executive_producer_header)
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.data)
+        self.assertEqual(data['deleted'], movie_ids[:2])
+        self.assertEqual(data['not_found'], [987654])
+        with self.app.app_context():
+            self.assertEqual([movie_id for movie_id, in self.db.session.query(Movie.id)], movie_ids[2:])
+
+    def test_delete_movies_bulk_too_many_ids(self):
+        self.app.config['BULK_MAX_ITEMS'] = 2
+        response = self.client().delete('/api/movie?ids=1,2,3', headers=self.executive_producer_header)
+        self.assertEqual(response.status_code, 400)
+        data = json.loads(response.data)
+        self.assertEqual(data['message'], 'At most 2 ids can be sent at once')
+
+    def test_delete_movies_bulk_invalid_ids(self):
+        response = self.client().delete('/api/movie?ids=1,two', headers=self.executive_producer_header)
+        self.assertEqual(response.status_code, 400)
+        response = self.client().delete('/api/movie', headers=self.executive_producer_header)
+        self.assertEqual(response.status_code, 400)
+
+    def test_delete_movies_bulk_casting_director(self):
+        response = self.client().delete('/api/movie?ids=1', headers=self.casting_director_header)
+        self.assertEqual(response.status_code, 403)
+
+    def post_idempotent(self, path, body, key, headers=None):
+        return self.client().post(path, data=json.dumps(body),
+                                  headers=dict(headers or self.executive_producer_header, **{'Idempotency-Key': key}))
+
+    def test_post_movie_idempotency_key_replay(self):
+        first = self.post_idempotent('/api/movie', self.test_movie_data, 'retry-1')
+        self.assertEqual(first.status_code, 200)
+        self.assertNotIn('Idempotent-Replayed', first.headers)
+        with self.assertMaxQueries(0):
+            second = self.post_idempotent('/api/movie', self.test_movie_data, 'retry-1')
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(second.headers['Idempotent-Replayed'], 'true')
+        self.assertEqual(json.loads(second.data), json.loads(first.data))
+        with self.app.app_context():
+            self.assertEqual(Movie.query.count(), 1)
+
+    def test_post_movies_bulk_idempotency_key_replay(self):
+        movies = [self.test_movie_data, {'title': 'Ludo', 'release_date': '2020-10-10'}]
+        first = self.post_idempotent('/api/movie/bulk', movies, 'bulk-1')
+        second = self.post_idempotent('/api/movie/bulk', movies, 'bulk-1')
+        self.assertEqual(json.loads(first.data)['created'], 2)
+        self.assertEqual(json.loads(second.data)['created'], 2)
+        self.assertEqual(second.headers['Idempotent-Replayed'], 'true')
+
+    def test_post_movie_idempotency_key_other_body(self):
+        self.post_idempotent('/api/movie', self.test_movie_data, 'retry-1')
+        response = self.post_idempotent('/api/movie', {'title': 'Ludo', 'release_date': '2020-10-10'}, 'retry-1')
+        self.assertEqual(response.status_code, 422)
+        data = json.loads(response.data)
+        self.assertEqual(data['message'], 'Idempotency-Key was already used with a different request body')
+
+    def test_post_actor_idempotency_key_scoped_by_subject(self):
+        first = self.post_idempotent('/api/actor', self.test_actor_data, 'retry-1')
+        second = self.post_idempotent('/api/actor', dict(self.test_actor_data, name='Aamir Khan'), 'retry-1',
+                                      self.casting_director_header)
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(second.status_code, 200)
+        self.assertNotIn('Idempotent-Replayed', second.headers)
+
+    def test_post_movie_idempotency_key_errors_not_stored(self):
+        response = self.post_idempotent('/api/movie', {'title': 'Ludo'}, 'retry-1')
+        self.assertEqual(response.status_code, 400)
+        response = self.post_idempotent('/api/movie', self.test_movie_data, 'retry-1')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('Idempotent-Replayed', response.headers)
+
+    def in_flight(self, body, key):
+        """
+        Claims an Idempotency-Key as if the executive producer's request was running
+        :return: (store, store key, body fingerprint)
+        """
+        store = self.app.extensions['idempotency_store']
+        store_key = store.key('auth0|executive_producer', 'POST', '/api/movie', key)
+        fingerprint = hashlib.sha256(json.dumps(body).encode()).hexdigest()
+        self.assertTrue(store.claim(store_key, fingerprint))
+        return store, store_key, fingerprint
+
+    def test_post_movie_idempotency_key_waits_for_request_in_flight(self):
+        store, store_key, fingerprint = self.in_flight(self.test_movie_data, 'retry-1')
+        finished = self.app.response_class(json.dumps({'id': 1}), content_type='application/json')
+        timer = threading.Timer(0.1, store.save, (store_key, fingerprint, finished))
+        timer.start()
+        response = self.post_idempotent('/api/movie', self.test_movie_data, 'retry-1')
+        timer.join()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers['Idempotent-Replayed'], 'true')
+        self.assertEqual(json.loads(response.data), {'id': 1})
+        with self.app.app_context():
+            self.assertEqual(Movie.query.count(), 0)
+
+    def test_idempotency_store_size_bounds(self):
+        app = create_app({'AUTH0_JWKS_FILE': JWKS_FILE, 'IDEMPOTENCY_MAX_ENTRIES': 2, 'IDEMPOTENCY_MAX_BYTES': 4096})
+        backend = app.extensions['idempotency_store'].backend
+        self.assertEqual((backend.max_entries, backend.max_bytes), (2, 4096))
+
+    def test_post_movie_idempotency_key_still_in_flight(self):
+        self.app.extensions['idempotency_store'].wait_timeout = 0.1
+        self.in_flight(self.test_movie_data, 'retry-1')
+        response = self.post_idempotent('/api/movie', self.test_movie_data, 'retry-1')
+        self.assertEqual(response.status_code, 409)
+
     def test_post_movie_when_blank_json_body_is_passed(self):
         response = self.client().post(f'/api/movie', data=json.dumps({}),
                                       content_type='application/json',
@@ -203,6 +531,36 @@ class MoviesTestCase(unittest.TestCase):
         self.assertEqual(response.status_code, 400)
         self.assertEqual(data['message'], 'JSON passed is empty')
 
+    def test_patch_movie_release_date(self):
+        movie = create_test_movie(self.test_movie_data)
+        response = self.client().patch(
+            f'/api/movie/{movie.id}',
+            data=json.dumps({'release_date': '2021-05-06'}),
+            content_type='application/json',
+            headers=self.casting_director_header)
+        self.assertEqual(response.status_code, 200)
+        with self.app.app_context():
+            updated = Movie.query.get(movie.id)
+            self.assertEqual(updated.release_date, date(2021, 5, 6))
+            self.assertEqual(updated.title, self.test_movie_data['title'])
+
+    def test_patch_movie_invalid_release_date(self):
+        movie = create_test_movie(self.test_movie_data)
+        response = self.client().patch(
+            f'/api/movie/{movie.id}',
+            data=json.dumps({'release_date': '06/05/2021'}),
+            content_type='application/json',
+            headers=self.casting_director_header)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(json.loads(response.data)['message'], 'Invalid release_date 06/05/2021, expected YYYY-MM-DD')
+
+    def test_patch_movie_invalid_title(self):
+        movie = create_test_movie(self.test_movie_data)
+        response = self.client().patch(f'/api/movie/{movie.id}', data=json.dumps({'title': ['Ludo']}),
+                                       content_type='application/json', headers=self.casting_director_header)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(json.loads(response.data)['message'], "Invalid title ['Ludo'], expected a string")
+
     def test_delete_movie_executive_producer(self):
         movie = create_test_movie(self.test_movie_data)
         response = self.client().delete(f'/api/movie/{movie.id}',
@@ -273,6 +631,580 @@ class MoviesTestCase(unittest.TestCase):
             data['message'],
             'No movie present, please add movies using the API')
 
+    def test_get_movie_pages(self):
+        for i in range(5):
+            create_test_movie({'title': f'Movie {i}', 'release_date': '2020-10-10'})
+        titles = []
+        url = '/api/movie?limit=2'
+        while url:
+            response = self.client().get(url, headers=self.casting_assistant_header)
+            self.assertEqual(response.status_code, 200)
+            data = json.loads(response.data)
+            self.assertLessEqual(len(data['movies']), 2)
+            titles += [movie['title'] for movie in data['movies']]
+            url = data['next_cursor'] and f'/api/movie?limit=2&cursor={data["next_cursor"]}'
+        self.assertEqual(titles, [f'Movie {i}' for i in range(5)])
+
+    def test_get_movie_page_size_is_capped(self):
+        self.app.config['MAX_PAGE_SIZE'] = 2
+        for i in range(3):
+            create_test_movie({'title': f'Movie {i}', 'release_date': '2020-10-10'})
+        response = self.client().get('/api/movie?limit=1000',
+                                     headers=self.casting_assistant_header)
+        data = json.loads(response.data)
+        self.assertEqual(len(data['movies']), 2)
+        self.assertTrue(data['next_cursor'])
+
+    def test_get_movie_when_cursor_is_invalid(self):
+        response = self.client().get('/api/movie?cursor=not-a-cursor',
+                                     headers=self.casting_assistant_header)
+        self.assertEqual(response.status_code, 400)
+        data = json.loads(response.data)
+        self.assertEqual(data['message'], 'Invalid cursor')
+
+    def test_get_actor_pages(self):
+        for i in range(3):
+            create_test_actor({'name': f'Actor {i}', 'age': 30 + i, 'gender': 'Female'})
+        response = self.client().get('/api/actor?limit=2',
+                                     headers=self.casting_assistant_header)
+        data = json.loads(response.data)
+        self.assertEqual([actor['name'] for actor in data['actors']], ['Actor 0', 'Actor 1'])
+        response = self.client().get(f'/api/actor?limit=2&cursor={data["next_cursor"]}',
+                                     headers=self.casting_assistant_header)
+        data = json.loads(response.data)
+        self.assertEqual([actor['name'] for actor in data['actors']], ['Actor 2'])
+        self.assertIsNone(data['next_cursor'])
+
+    def test_get_movie_ndjson_stream(self):
+        for i in range(3):
+            create_test_movie({'title': f'Movie {i}', 'release_date': '2020-10-10'})
+        headers = dict(self.casting_assistant_header, Accept='application/x-ndjson')
+        response = self.client().get('/api/movie?limit=1', headers=headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'application/x-ndjson')
+        self.assertTrue(response.is_streamed)
+        movies = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+        self.assertEqual([movie['title'] for movie in movies], ['Movie 0', 'Movie 1', 'Movie 2'])
+        self.assertEqual(movies[0]['release_date'], '2020-10-10')
+
+    def create_test_movies(self, count):
+        for i in range(count):
+            create_test_movie({'title': f'Movie {i}', 'release_date': '2020-10-10'})
+
+    def test_get_movies_gzip(self):
+        self.create_test_movies(30)
+        plain = self.client().get('/api/movie', headers=self.casting_assistant_header)
+        headers = dict(self.casting_assistant_header, **{'Accept-Encoding': 'gzip'})
+        response = self.client().get('/api/movie', headers=headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response.vary)
+        self.assertLess(int(response.headers['Content-Length']), len(plain.data))
+        self.assertEqual(json.loads(gzip.decompress(response.data)), json.loads(plain.data))
+
+    @unittest.skipIf(brotli is None, 'brotli is not installed')
+    def test_get_movies_encoding_negotiation(self):
+        self.create_test_movies(30)
+        for accept_encoding, expected in [('gzip, deflate, br', 'br'), ('br;q=0.5, gzip', 'gzip'),
+                                          ('*', 'br'), ('gzip;q=0, identity', None), ('', None)]:
+            headers = dict(self.casting_assistant_header, **{'Accept-Encoding': accept_encoding})
+            response = self.client().get('/api/movie', headers=headers)
+            self.assertEqual(response.headers.get('Content-Encoding'), expected, accept_encoding)
+            self.assertIn('Accept-Encoding', response.vary)
+        headers = dict(self.casting_assistant_header, **{'Accept-Encoding': 'br'})
+        response = self.client().get('/api/movie', headers=headers)
+        self.assertEqual(len(json.loads(brotli.decompress(response.data))['movies']), 30)
+
+    def test_small_response_is_not_compressed(self):
+        headers = dict(self.casting_assistant_header, **{'Accept-Encoding': 'gzip'})
+        response = self.client().get('/api/movie/987654/actors', headers=headers)
+        self.assertNotIn('Content-Encoding', response.headers)
+        self.assertNotIn('Accept-Encoding', response.vary)
+
+    def test_compression_disabled(self):
+        self.app.config['COMPRESSION_ENCODINGS'] = ''
+        self.create_test_movies(30)
+        headers = dict(self.casting_assistant_header, **{'Accept-Encoding': 'gzip'})
+        response = self.client().get('/api/movie', headers=headers)
+        self.assertNotIn('Content-Encoding', response.headers)
+
+    def test_get_movie_ndjson_stream_gzip(self):
+        self.create_test_movies(3)
+        headers = dict(self.casting_assistant_header, Accept='application/x-ndjson', **{'Accept-Encoding': 'gzip'})
+        response = self.client().get('/api/movie', headers=headers)
+        self.assertTrue(response.is_streamed)
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertNotIn('Content-Length', response.headers)
+        lines = gzip.decompress(response.get_data()).decode().splitlines()
+        self.assertEqual([json.loads(line)['title'] for line in lines], ['Movie 0', 'Movie 1', 'Movie 2'])
+
+    def test_movie_dates_are_iso_formatted(self):
+        response = self.client().post('/api/movie', data=json.dumps(self.test_movie_data),
+                                      content_type='application/json',
+                                      headers=self.executive_producer_header)
+        self.assertEqual(json.loads(response.data)['release_date'], '2015-10-20')
+        response = self.client().get('/api/movie', headers=self.casting_assistant_header)
+        self.assertEqual(json.loads(response.data)['movies'], [
+            {'id': json.loads(response.data)['movies'][0]['id'],
+             'title': 'Interstellar', 'release_date': '2015-10-20'}])
+
+    def test_get_movie_fields(self):
+        create_test_movie(self.test_movie_data)
+        response = self.client().get('/api/movie?fields=title',
+                                     headers=self.casting_assistant_header)
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.data)
+        self.assertEqual(data['movies'], [{'title': self.test_movie_data['title']}])
+
+        headers = dict(self.casting_assistant_header, Accept='application/x-ndjson')
+        response = self.client().get('/api/movie?fields=id,release_date', headers=headers)
+        movie = json.loads(response.get_data(as_text=True).splitlines()[0])
+        self.assertEqual(sorted(movie), ['id', 'release_date'])
+
+    def test_get_movie_when_fields_are_invalid(self):
+        response = self.client().get('/api/movie?fields=title,budget',
+                                     headers=self.casting_assistant_header)
+        self.assertEqual(response.status_code, 400)
+        data = json.loads(response.data)
+        self.assertEqual(data['message'], 'Invalid fields budget, expected a subset of id,title,release_date')
+
+    def test_get_actor_fields_pages(self):
+        for i in range(3):
+            create_test_actor({'name': f'Actor {i}', 'age': 30 + i, 'gender': 'Female'})
+        response = self.client().get('/api/actor?fields=name&limit=2',
+                                     headers=self.casting_assistant_header)
+        data = json.loads(response.data)
+        self.assertEqual(data['actors'], [{'name': 'Actor 0'}, {'name': 'Actor 1'}])
+        response = self.client().get(f'/api/actor?fields=name&limit=2&cursor={data["next_cursor"]}',
+                                     headers=self.casting_assistant_header)
+        self.assertEqual(json.loads(response.data)['actors'], [{'name': 'Actor 2'}])
+
+    def test_get_movie_filtered_and_sorted(self):
+        for title, release_date in [('A', '1999-01-01'), ('B', '2005-05-05'), ('C', '2010-10-10'),
+                                    ('D', '2005-05-05'), ('E', '2020-02-02')]:
+            create_test_movie({'title': title, 'release_date': release_date})
+        titles = []
+        url = '/api/movie?released_after=2000-01-01&released_before=2020-01-01&sort=-release_date&limit=2'
+        while url:
+            response = self.client().get(url, headers=self.casting_assistant_header)
+            self.assertEqual(response.status_code, 200)
+            data = json.loads(response.data)
+            titles += [movie['title'] for movie in data['movies']]
+            url = data['next_cursor'] and (
+                '/api/movie?released_after=2000-01-01&released_before=2020-01-01&sort=-release_date'
+                f'&limit=2&cursor={data["next_cursor"]}')
+        # ties on release_date are broken by id, in the same direction
+        self.assertEqual(titles, ['C', 'D', 'B'])
+
+    def test_get_actor_filtered_and_sorted(self):
+        for name, age, gender in [('Dev', 40, 'Male'), ('Cara', 35, 'Female'), ('Bea', 30, 'Female'),
+                                  ('Ada', 60, 'Female'), ('Eve', 25, 'Female')]:
+            create_test_actor({'name': name, 'age': age, 'gender': gender})
+        response = self.client().get('/api/actor?gender=Female&min_age=30&max_age=60&sort=name&limit=2',
+                                     headers=self.casting_assistant_header)
+        data = json.loads(response.data)
+        self.assertEqual([actor['name'] for actor in data['actors']], ['Ada', 'Bea'])
+        response = self.client().get(
+            f'/api/actor?gender=Female&min_age=30&max_age=60&sort=name&limit=2&cursor={data["next_cursor"]}',
+            headers=self.casting_assistant_header)
+        data = json.loads(response.data)
+        self.assertEqual([actor['name'] for actor in data['actors']], ['Cara'])
+        self.assertIsNone(data['next_cursor'])
+
+        # the sort column is selected even when it is not one of the requested fields
+        response = self.client().get('/api/actor?fields=name&sort=-age&limit=1',
+                                     headers=self.casting_assistant_header)
+        data = json.loads(response.data)
+        self.assertEqual(data['actors'], [{'name': 'Ada'}])
+        response = self.client().get(f'/api/actor?fields=name&sort=-age&limit=1&cursor={data["next_cursor"]}',
+                                     headers=self.casting_assistant_header)
+        self.assertEqual(json.loads(response.data)['actors'], [{'name': 'Dev'}])
+
+    def test_pages_sorted_by_a_nullable_column(self):
+        with self.app.app_context():
+            db.session.execute(Actor.__table__.insert(), [
+                {'name': name, 'age': age, 'gender': 'Female'}
+                for name, age in [('Ada', None), ('Bea', 30), ('Cara', None), ('Dev', 40)]])
+            db.session.commit()
+        for sort, expected in [('age', ['Bea', 'Dev', 'Ada', 'Cara']), ('-age', ['Dev', 'Bea', 'Cara', 'Ada'])]:
+            names, cursor = [], ''
+            for _ in range(5):
+                response = self.client().get(f'/api/actor?sort={sort}&limit=1&cursor={cursor}',
+                                             headers=self.casting_assistant_header)
+                self.assertEqual(response.status_code, 200)
+                data = json.loads(response.data)
+                names += [actor['name'] for actor in data['actors']]
+                cursor = data['next_cursor']
+                if cursor is None:
+                    break
+            # NULLs come last in either direction, ties in id order of the direction
+            self.assertEqual(names, expected)
+
+            response = self.client().get(f'/api/actor?sort={sort}&limit=3', headers=self.casting_assistant_header)
+            self.assertEqual([actor['name'] for actor in json.loads(response.data)['actors']], expected[:3])
+            response = self.client().get(f'/api/actor?sort={sort}', headers={
+                **self.casting_assistant_header, 'Accept': 'application/x-ndjson'})
+            self.assertEqual([json.loads(line)['name'] for line in response.data.splitlines()], expected)
+
+    def test_get_movie_when_filter_matches_nothing(self):
+        create_test_movie(self.test_movie_data)
+        response = self.client().get('/api/movie?released_before=1900-01-01',
+                                     headers=self.casting_assistant_header)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.data)['movies'], [])
+
+    def test_get_movie_when_filter_or_sort_is_invalid(self):
+        response = self.client().get('/api/movie?released_after=yesterday',
+                                     headers=self.casting_assistant_header)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(json.loads(response.data)['message'],
+                         'Invalid released_after yesterday, expected YYYY-MM-DD')
+        response = self.client().get('/api/actor?sort=-gender', headers=self.casting_assistant_header)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(json.loads(response.data)['message'],
+                         'Invalid sort -gender, expected one of id,name,age with an optional "-" prefix')
+
+    def test_cursor_is_bound_to_its_sort_order(self):
+        for i in range(3):
+            create_test_movie({'title': f'Movie {i}', 'release_date': '2020-10-10'})
+        response = self.client().get('/api/movie?limit=1', headers=self.casting_assistant_header)
+        cursor = json.loads(response.data)['next_cursor']
+        response = self.client().get(f'/api/movie?limit=1&sort=title&cursor={cursor}',
+                                     headers=self.casting_assistant_header)
+        self.assertEqual(response.status_code, 400)
+
+    def test_search_is_ranked_and_typo_tolerant(self):
+        for title in ['Interstellar', 'Inception', 'Stellar Days', 'Ludo']:
+            create_test_movie({'title': title, 'release_date': '2020-10-10'})
+        create_test_actor({'name': 'Stella Stevens', 'age': 80, 'gender': 'Female'})
+        response = self.client().get('/api/search?q=intersteller', headers=self.casting_assistant_header)
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.data)
+        self.assertEqual(data['results'][0]['name'], 'Interstellar')
+        self.assertEqual(data['results'][0]['type'], 'movie')
+        self.assertNotIn('Ludo', [hit['name'] for hit in data['results']])
+        scores = [hit['score'] for hit in data['results']]
+        self.assertEqual(scores, sorted(scores, reverse=True))
+
+        response = self.client().get('/api/search?q=stella&type=actor', headers=self.casting_assistant_header)
+        data = json.loads(response.data)
+        self.assertEqual([hit['name'] for hit in data['results']], ['Stella Stevens'])
+
+    def test_search_pages(self):
+        for i in range(5):
+            create_test_movie({'title': f'Movie {i}', 'release_date': '2020-10-10'})
+        names = []
+        url = '/api/search?q=movie&limit=2'
+        while url:
+            response = self.client().get(url, headers=self.casting_assistant_header)
+            data = json.loads(response.data)
+            names += [hit['name'] for hit in data['results']]
+            url = data['next_cursor'] and f'/api/search?q=movie&limit=2&cursor={data["next_cursor"]}'
+        self.assertEqual(sorted(names), [f'Movie {i}' for i in range(5)])
+
+    def test_search_follows_writes(self):
+        movie_id = create_test_movie(self.test_movie_data).id
+        self.client().patch(f'/api/movie/{movie_id}', data=json.dumps({'title': 'Gravity'}),
+                            headers=self.executive_producer_header)
+        response = self.client().get('/api/search?q=gravity', headers=self.casting_assistant_header)
+        self.assertEqual(json.loads(response.data)['results'][0]['id'], movie_id)
+        self.client().delete(f'/api/movie/{movie_id}', headers=self.executive_producer_header)
+        response = self.client().get('/api/search?q=gravity', headers=self.casting_assistant_header)
+        self.assertEqual(json.loads(response.data)['results'], [])
+
+    def test_search_when_query_is_invalid(self):
+        response = self.client().get('/api/search?q=ab', headers=self.casting_assistant_header)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(json.loads(response.data)['message'], '"q" must be at least 3 characters long')
+        response = self.client().get('/api/search?q=abc&type=studio', headers=self.casting_assistant_header)
+        self.assertEqual(response.status_code, 400)
+
+    def cast(self, movie_id, actor_ids):
+        return self.client().post(f'/api/movie/{movie_id}/actors', data=json.dumps({'actor_ids': actor_ids}),
+                                  headers=self.casting_director_header)
+
+    def test_cast_actors_in_movie(self):
+        movie_id = create_test_movie(self.test_movie_data).id
+        actor_ids = [create_test_actor({'name': f'Actor {i}', 'age': 30, 'gender': 'Female'}).id
+                     for i in range(3)]
+        response = self.cast(movie_id, actor_ids[:2])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.data)['added'], 2)
+        response = self.cast(movie_id, actor_ids[1:])
+        data = json.loads(response.data)
+        self.assertEqual(data['added'], 1)
+        self.assertEqual([actor['id'] for actor in data['actors']], actor_ids)
+
+        response = self.client().get(f'/api/movie/{movie_id}/actors', headers=self.casting_assistant_header)
+        self.assertEqual([actor['name'] for actor in json.loads(response.data)['actors']],
+                         ['Actor 0', 'Actor 1', 'Actor 2'])
+        response = self.client().get(f'/api/actor/{actor_ids[0]}/movies', headers=self.casting_assistant_header)
+        self.assertEqual(json.loads(response.data)['movies'],
+                         [{'id': movie_id, 'title': 'Interstellar', 'release_date': '2015-10-20'}])
+
+        response = self.client().delete(f'/api/movie/{movie_id}/actors/{actor_ids[0]}',
+                                        headers=self.casting_director_header)
+        self.assertEqual(response.status_code, 200)
+        response = self.client().get(f'/api/actor/{actor_ids[0]}/movies', headers=self.casting_assistant_header)
+        self.assertEqual(json.loads(response.data)['movies'], [])
+
+        # castings go away with the actor
+        self.client().delete(f'/api/actor/{actor_ids[1]}', headers=self.casting_director_header)
+        response = self.client().get(f'/api/movie/{movie_id}/actors', headers=self.casting_assistant_header)
+        self.assertEqual([actor['id'] for actor in json.loads(response.data)['actors']], actor_ids[2:])
+
+    def test_cast_actors_when_ids_are_invalid(self):
+        movie_id = create_test_movie(self.test_movie_data).id
+        response = self.cast(movie_id, [987654])
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(json.loads(response.data)['message'], 'Actors with ids: 987654 do not exist')
+        response = self.cast(movie_id + 1, [1])
+        self.assertEqual(response.status_code, 404)
+        response = self.cast(movie_id, 'all')
+        self.assertEqual(response.status_code, 400)
+        response = self.client().delete(f'/api/movie/{movie_id}/actors/987654', headers=self.casting_director_header)
+        self.assertEqual(response.status_code, 404)
+
+    def test_failed_request_rolls_back(self):
+        movie_id = create_test_movie(self.test_movie_data).id
+
+        @self.app.route('/test/failing-write', methods=['POST'])
+        def failing_write():
+            Actor(name='Rolled Back', age=40, gender='Male').insert()
+            add_cast(movie_id, [Actor.query.filter_by(name='Rolled Back').one().id])
+            abort(409, 'Conflict after the writes')
+
+        response = self.client().post('/test/failing-write')
+        self.assertEqual(response.status_code, 409)
+        with self.app.app_context():
+            self.assertEqual(Actor.query.filter_by(name='Rolled Back').count(), 0)
+            self.assertEqual(db.session.query(movie_actors).count(), 0)
+
+    def test_cast_actors_casting_assistant(self):
+        movie_id = create_test_movie(self.test_movie_data).id
+        response = self.client().post(f'/api/movie/{movie_id}/actors', data=json.dumps({'actor_ids': [1]}),
+                                      headers=self.casting_assistant_header)
+        self.assertEqual(response.status_code, 403)
+
+    def test_get_movie_include_actors(self):
+        movie_ids = [create_test_movie({'title': f'Movie {i}', 'release_date': '2020-10-10'}).id for i in range(2)]
+        actor_id = create_test_actor(self.test_actor_data).id
+        self.cast(movie_ids[0], [actor_id])
+        response = self.client().get('/api/movie?include=actors', headers=self.casting_assistant_header)
+        movies = json.loads(response.data)['movies']
+        self.assertEqual([actor['id'] for actor in movies[0]['actors']], [actor_id])
+        self.assertEqual(movies[1]['actors'], [])
+
+        headers = dict(self.casting_assistant_header, Accept='application/x-ndjson')
+        response = self.client().get('/api/actor?include=movies&fields=name', headers=headers)
+        actor = json.loads(response.get_data(as_text=True).splitlines()[0])
+        self.assertEqual(actor['name'], self.test_actor_data['name'])
+        self.assertEqual([movie['id'] for movie in actor['movies']], movie_ids[:1])
+
+        response = self.client().get('/api/movie?include=studios', headers=self.casting_assistant_header)
+        self.assertEqual(response.status_code, 400)
+
+    def test_get_movie_include_actors_is_cache_safe(self):
+        movie_id = create_test_movie(self.test_movie_data).id
+        actor_id = create_test_actor(self.test_actor_data).id
+        response = self.client().get('/api/movie?include=actors', headers=self.casting_assistant_header)
+        etag = response.headers['ETag']
+        self.cast(movie_id, [actor_id])
+        response = self.client().get('/api/movie?include=actors', headers=self.casting_assistant_header)
+        self.assertNotEqual(response.headers['ETag'], etag)
+        self.assertEqual(len(json.loads(response.data)['movies'][0]['actors']), 1)
+
+    def test_get_movie_include_actors_query_count(self):
+        """The cast of a page is loaded with the same number of queries whatever the page size"""
+        counts = []
+        for movies in (2, 20):
+            with self.app.app_context():
+                self.db.session.query(Movie).delete()
+                self.db.session.commit()
+            actor_ids = [create_test_actor({'name': f'Actor {movies} {i}', 'age': 30, 'gender': 'Male'}).id
+                         for i in range(3)]
+            for i in range(movies):
+                movie_id = create_test_movie({'title': f'Movie {i}', 'release_date': '2020-10-10'}).id
+                self.cast(movie_id, actor_ids)
+            with self.app.app_context(), QueryCounter(self.db.engine) as queries:
+                response = self.client().get(f'/api/movie?include=actors&limit={movies}',
+                                             headers=self.casting_assistant_header)
+            movie_list = json.loads(response.data)['movies']
+            self.assertEqual(len(movie_list), movies)
+            self.assertTrue(all(len(movie['actors']) == 3 for movie in movie_list))
+            counts.append(queries.count)
+        self.assertEqual(counts[0], counts[1])
+        # table versions (ETag), the page, the cast of the page
+        self.assertEqual(counts[0], 3)
+
+    def test_internal_stats(self):
+        response = self.client().get('/internal/stats', headers={'Authorization': 'Bearer secret'})
+        self.assertEqual(response.status_code, 404)
+        self.app.config['INTERNAL_STATS_TOKEN'] = 'secret'
+        response = self.client().get('/internal/stats', headers=self.casting_assistant_header)
+        self.assertEqual(response.status_code, 401)
+        response = self.client().get('/internal/stats', headers={'Authorization': 'Bearer secret'})
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.data)
+        self.assertEqual(data['pool']['pid'], os.getpid())
+        self.assertGreater(data['pool']['checkouts'], 0)
+        self.assertIn('hits', data['jwks'])
+        self.assertIn('hit_ratio', data['response_cache'])
+        self.assertIn('hits', data['token_cache'])
+
+    def test_server_timing_header(self):
+        create_test_movie(self.test_movie_data)
+        response = self.client().get('/api/movie', headers=self.casting_assistant_header)
+        entries = [entry.split(';') for entry in response.headers['Server-Timing'].split(', ')]
+        timings = {entry[0]: entry[1][len('dur='):] for entry in entries}
+        self.assertEqual(list(timings), ['auth', 'db', 'serialize', 'total'])
+        # table versions (ETag) and the page
+        self.assertEqual(entries[1][2], 'desc="2 queries"')
+        self.assertGreater(float(timings['db']), 0)
+        self.assertGreaterEqual(float(timings['total']),
+                                float(timings['auth']) + float(timings['db']) + float(timings['serialize']))
+
+    def test_metrics(self):
+        self.app.config['INTERNAL_STATS_TOKEN'] = 'secret'
+        self.client().get('/api/movie', headers=self.casting_assistant_header)
+        response = self.client().get('/metrics', headers={'Authorization': 'Bearer secret'})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.content_type.startswith('text/plain'))
+        body = response.get_data(as_text=True)
+        self.assertIn('http_requests_total{endpoint="/api/movie",method="GET",status="404"}', body)
+        self.assertIn('http_request_phase_duration_seconds_count{endpoint="/api/movie",phase="auth"}', body)
+        self.assertIn('response_cache_lookups_total{endpoint="/api/movie",result="miss"}', body)
+        response = self.client().get('/metrics', headers=self.casting_assistant_header)
+        self.assertEqual(response.status_code, 401)
+
+    def test_query_budget_list_movies(self):
+        create_test_movie(self.test_movie_data)
+        # table versions (ETag) and the page
+        with self.assertMaxQueries(2):
+            res = self.client().get('/api/movie', headers=self.casting_assistant_header)
+        self.assertEqual(res.status_code, 200)
+
+    def test_query_budget_create_movie(self):
+        # insert, and version bump after the commit
+        with self.assertMaxQueries(2):
+            res = self.client().post('/api/movie', data=json.dumps(self.test_movie_data),
+                                     headers=self.executive_producer_header)
+        self.assertEqual(res.status_code, 200)
+
+    def test_query_budget_update_movie(self):
+        movie_id = create_test_movie(self.test_movie_data).id
+        # update, and version bump after the commit, plus a select where UPDATE ... RETURNING is not available
+        with self.assertMaxQueries(3):
+            res = self.client().patch(f'/api/movie/{movie_id}', data=json.dumps({'title': 'Other'}),
+                                      headers=self.executive_producer_header)
+        self.assertEqual(res.status_code, 200)
+
+    def test_query_budget_delete_movie(self):
+        movie_id = create_test_movie(self.test_movie_data).id
+        # delete, and version bump after the commit
+        with self.assertMaxQueries(2):
+            res = self.client().delete(f'/api/movie/{movie_id}', headers=self.executive_producer_header)
+        self.assertEqual(res.status_code, 200)
+
+    def test_table_version_bumped_on_commit_only(self):
+        with self.app.app_context():
+            version = TableVersion.get('movies')
+            Movie(**self.test_movie_data).insert()
+            self.assertEqual(TableVersion.get('movies'), version)
+            self.db.session.rollback()
+            self.assertEqual(TableVersion.get('movies'), version)
+            Movie(**self.test_movie_data).insert()
+            self.db.session.commit()
+            self.assertEqual(TableVersion.get('movies'), version + 1)
+
+    def test_query_budget_exceeded(self):
+        with self.assertRaises(AssertionError) as raised:
+            with self.assertMaxQueries(1):
+                self.client().get('/api/movie', headers=self.casting_assistant_header)
+        self.assertIn('2 queries executed, the budget is 1', str(raised.exception))
+        self.assertIn('FROM movies ORDER BY movies.id ASC LIMIT ? OFFSET ?', str(raised.exception))
+
+    def test_normalize_sql(self):
+        self.assertEqual(normalize_sql("SELECT *\n  FROM movies WHERE title = 'It''s' AND id IN (1, 2, 3)"),
+                         'SELECT * FROM movies WHERE title = ? AND id IN (...)')
+        self.assertEqual(normalize_sql('SELECT * FROM actors WHERE id = %(id_1)s'),
+                         normalize_sql('SELECT * FROM actors WHERE id = :id_1'))
+        self.assertEqual(normalize_sql('INSERT INTO movies (title) VALUES ($1), ($2)'),
+                         'INSERT INTO movies (title) VALUES (...), (...)')
+
+    def test_slow_query_log(self):
+        self.app.config['SLOW_QUERY_MS'] = 0
+        with self.assertLogs('timing', 'WARNING') as logs:
+            self.client().get('/api/movie', headers=self.casting_assistant_header)
+        self.assertTrue(any('Slow query' in line and 'FROM movies' in line for line in logs.output))
+
+    def test_n_plus_one_warning(self):
+        self.app.config['N_PLUS_ONE_THRESHOLD'] = 3
+        movie_ids = [create_test_movie(dict(self.test_movie_data, title=f'Movie {i}')).id for i in range(3)]
+
+        @self.app.route('/test/n-plus-one')
+        def n_plus_one():
+            return jsonify([Movie.query.get(movie_id).title for movie_id in movie_ids])
+
+        with self.assertLogs('timing', 'WARNING') as logs:
+            res = self.client().get('/test/n-plus-one')
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(any('Possible N+1 query in GET /test/n-plus-one, 3 executions' in line
+                            for line in logs.output))
+
+    def test_get_movie_not_modified(self):
+        movie_id = create_test_movie(self.test_movie_data).id
+        response = self.client().get('/api/movie', headers=self.casting_assistant_header)
+        etag = response.headers['ETag']
+        headers = dict(self.casting_assistant_header, **{'If-None-Match': etag})
+        response = self.client().get('/api/movie', headers=headers)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.headers['ETag'], etag)
+        self.assertEqual(response.data, b'')
+
+        response = self.client().get('/api/movie?limit=1', headers=headers)
+        self.assertEqual(response.status_code, 200)
+
+        self.client().patch(f'/api/movie/{movie_id}', data=json.dumps(self.patch_test_movie_data),
+                            content_type='application/json', headers=self.executive_producer_header)
+        response = self.client().get('/api/movie', headers=headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['ETag'], etag)
+
+    def test_get_actor_etag_changes_on_write(self):
+        create_test_actor(self.test_actor_data)
+        response = self.client().get('/api/actor', headers=self.casting_assistant_header)
+        etag = response.headers['ETag']
+        self.client().post('/api/actor', data=json.dumps({'name': 'Aamir Khan', 'age': 50, 'gender': 'Male'}),
+                           headers=self.casting_director_header)
+        headers = dict(self.casting_assistant_header, **{'If-None-Match': etag})
+        response = self.client().get('/api/actor', headers=headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(json.loads(response.data)['actors']), 2)
+
+    def test_get_movie_served_from_response_cache(self):
+        movie_id = create_test_movie(self.test_movie_data).id
+        cache = self.app.extensions['response_cache']
+        first = self.client().get('/api/movie', headers=self.casting_assistant_header)
+        second = self.client().get('/api/movie', headers=self.casting_director_header)
+        self.assertEqual(first.data, second.data)
+        self.assertEqual(cache.stats()['hits'], 1)
+
+        self.client().patch(f'/api/movie/{movie_id}', data=json.dumps(self.patch_test_movie_data),
+                            content_type='application/json', headers=self.executive_producer_header)
+        response = self.client().get('/api/movie', headers=self.casting_assistant_header)
+        data = json.loads(response.data)
+        self.assertEqual(data['movies'][0]['title'], 'Interstellar Updated')
+        self.assertEqual(cache.stats()['misses'], 2)
+
+    def test_actor_write_does_not_invalidate_cached_movies(self):
+        create_test_movie(self.test_movie_data)
+        cache = self.app.extensions['response_cache']
+        self.client().get('/api/movie', headers=self.casting_assistant_header)
+        create_test_actor(self.test_actor_data)
+        self.client().get('/api/movie', headers=self.casting_assistant_header)
+        self.assertEqual(cache.stats()['hits'], 1)
+
     def test_get_actor_casting_assistant(self):
         create_test_actor(self.test_actor_data)
         response = self.client().get(f'/api/actor',
@@ -351,6 +1283,51 @@ class MoviesTestCase(unittest.TestCase):
             data['message'],
             f'Actor with name {self.test_actor_data["name"]} already exists.')
 
+    def test_post_actors_bulk(self):
+        actors = [self.test_actor_data, {'name': 'Aamir Khan', 'age': 'fifty', 'gender': 'Male'}]
+        response = self.client().post('/api/actor/bulk', data=json.dumps(actors),
+                                      content_type='application/json',
+                                      headers=self.casting_director_header)
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.data)
+        self.assertEqual(data['created'], 1)
+        self.assertEqual(data['results'][0]['actor']['name'], self.test_actor_data['name'])
+        self.assertEqual(data['results'][1]['error'], 400)
+
+    def test_patch_actors_bulk(self):
+        actor_ids = [create_test_actor(dict(self.test_actor_data, name=f'Actor {i}')).id for i in range(2)]
+        response = self.client().patch('/api/actor/bulk',
+                                       data=json.dumps({'ids': actor_ids, 'set': {'age': 30, 'gender': 'Female'}}),
+                                       content_type='application/json',
+                                       headers=self.casting_director_header)
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.data)
+        self.assertEqual(data['updated'], actor_ids)
+        self.assertEqual(data['not_found'], [])
+        with self.app.app_context():
+            rows = self.db.session.query(Actor.age, Actor.gender).all()
+        self.assertEqual(rows, [(30, 'Female'), (30, 'Female')])
+
+    def test_patch_actors_bulk_invalid_value(self):
+        actor_id = create_test_actor(self.test_actor_data).id
+        response = self.client().patch('/api/actor/bulk',
+                                       data=json.dumps({'ids': [actor_id], 'set': {'age': 'thirty'}}),
+                                       content_type='application/json',
+                                       headers=self.casting_director_header)
+        self.assertEqual(response.status_code, 400)
+        data = json.loads(response.data)
+        self.assertEqual(data['message'], 'Invalid age thirty, expected an integer')
+
+    def test_delete_actors_bulk_removes_castings(self):
+        movie_id = create_test_movie(self.test_movie_data).id
+        actor_ids = [create_test_actor(dict(self.test_actor_data, name=f'Actor {i}')).id for i in range(2)]
+        self.cast(movie_id, actor_ids)
+        response = self.client().delete(f'/api/actor?ids={actor_ids[0]}', headers=self.casting_director_header)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.data)['deleted'], actor_ids[:1])
+        response = self.client().get(f'/api/movie/{movie_id}/actors', headers=self.casting_assistant_header)
+        self.assertEqual([actor['id'] for actor in json.loads(response.data)['actors']], actor_ids[1:])
+
     def test_post_actor_when_blank_json_body_is_passed(self):
         response = self.client().post(f'/api/actor', data=json.dumps({}),
                                       content_type='application/json',
@@ -438,6 +1415,37 @@ class MoviesTestCase(unittest.TestCase):
         self.assertEqual(response.status_code, 400)
         self.assertEqual(data['message'], 'JSON passed is empty')
 
+    def test_patch_actor_gender_and_age(self):
+        actor = create_test_actor(self.test_actor_data)
+        response = self.client().patch(
+            f'/api/actor/{actor.id}',
+            data=json.dumps({'age': 41, 'gender': 'Female'}),
+            content_type='application/json',
+            headers=self.casting_director_header)
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.data)
+        self.assertEqual(data['updated_actor'], {'id': actor.id, 'name': self.test_actor_data['name'],
+                                                 'age': 41, 'gender': 'Female'})
+
+    def test_patch_actor_invalid_age(self):
+        actor = create_test_actor(self.test_actor_data)
+        response = self.client().patch(f'/api/actor/{actor.id}', data=json.dumps({'age': '41'}),
+                                       content_type='application/json', headers=self.casting_director_header)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(json.loads(response.data)['message'], 'Invalid age 41, expected an integer')
+        response = self.client().patch(f'/api/actor/{actor.id}', data=json.dumps({'age': True}),
+                                       content_type='application/json', headers=self.casting_director_header)
+        self.assertEqual(response.status_code, 400)
+
+    def test_patch_actor_invalid_name(self):
+        actor = create_test_actor(self.test_actor_data)
+        response = self.client().patch(f'/api/actor/{actor.id}', data=json.dumps({'name': 42}),
+                                       content_type='application/json', headers=self.casting_director_header)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(json.loads(response.data)['message'], 'Invalid name 42, expected a string')
+        with self.app.app_context():
+            self.assertEqual(Actor.query.get(actor.id).name, self.test_actor_data['name'])
+
     def test_delete_actor_executive_producer(self):
         actor = create_test_actor(self.test_actor_data)
         response = self.client().delete(f'/api/actor/{actor.id}',
@@ -473,6 +1481,461 @@ class MoviesTestCase(unittest.TestCase):
             f'Actor with id: {actor_id} does not exist')
 
 
+def explain(query):
+    """
+    Query plan of an ORM query, as the database would run it
+    :param query: Query to explain
+    :return: Plan as a single string
+    """
+    compiled = query.statement.compile(dialect=db.engine.dialect)
+    cursor = db.session.connection().connection.cursor()
+    if db.engine.dialect.name == 'sqlite':
+        cursor.execute('EXPLAIN QUERY PLAN ' + str(compiled), [compiled.params[name] for name in compiled.positiontup])
+    else:
+        cursor.execute('EXPLAIN ' + str(compiled), compiled.params)
+    return '\n'.join(str(row[-1]) for row in cursor.fetchall())
+
+
+class ListQueryPlanTestCase(unittest.TestCase):
+    """Checks that filtered and sorted list queries are served by their indexes on a large table"""
+
+    ROWS = 20000
+
+    @classmethod
+    def setUpClass(cls):
+        cls.app = create_app({'AUTH0_JWKS_FILE': JWKS_FILE})
+        with cls.app.app_context():
+            db.create_all()
+            first_date = date(1950, 1, 1)
+            db.session.execute(Movie.__table__.insert(), [
+                {'title': f'Movie {i}', 'release_date': first_date + timedelta(days=i)} for i in range(cls.ROWS)])
+            db.session.execute(Actor.__table__.insert(), [
+                {'name': f'Actor {i}', 'age': 18 + i % 70, 'gender': ('Male', 'Female', 'Non-binary')[i % 3]}
+                for i in range(cls.ROWS)])
+            db.session.commit()
+            # refresh the planner statistics
+            db.session.execute('ANALYZE')
+            db.session.commit()
+
+    @classmethod
+    def tearDownClass(cls):
+        with cls.app.app_context():
+            db.session.query(Movie).delete()
+            db.session.query(Actor).delete()
+            db.session.commit()
+
+    def list_query_plan(self, url, model, filters, sorts):
+        """
+        Builds the page query of a list request the way the end point does and explains it
+        """
+        with self.app.test_request_context(url):
+            sort = get_sort_order(model, sorts)
+            limit, after = get_page_args(sort.name)
+            query = get_serializer(model).query(*sort.columns).filter(*get_filters(filters))
+            query = queries_after(query, sort, after)[0].limit(limit + 1)
+            return explain(query)
+
+    def test_movie_release_date_filter_and_sort_use_index(self):
+        plan = self.list_query_plan('/api/movie?released_after=2000-01-01&sort=-release_date',
+                                    Movie, MOVIE_FILTERS, MOVIE_SORTS)
+        self.assertIn('ix_movies_release_date', plan)
+        cursor = encode_cursor('-release_date', ['2000-01-01', 100])
+        plan = self.list_query_plan(f'/api/movie?sort=-release_date&cursor={cursor}',
+                                    Movie, MOVIE_FILTERS, MOVIE_SORTS)
+        self.assertIn('ix_movies_release_date', plan)
+
+    def test_actor_gender_and_age_filters_use_index(self):
+        plan = self.list_query_plan('/api/actor?gender=Female&min_age=30&max_age=35',
+                                    Actor, ACTOR_FILTERS, ACTOR_SORTS)
+        self.assertIn('ix_actors_gender_age', plan)
+        plan = self.list_query_plan('/api/actor?gender=Female&sort=age', Actor, ACTOR_FILTERS, ACTOR_SORTS)
+        self.assertIn('ix_actors_gender_age', plan)
+
+    def test_nullable_sort_column_ranges_use_index(self):
+        for url in ('/api/movie?sort=release_date', '/api/movie?sort=-release_date'):
+            with self.app.test_request_context(url):
+                sort = get_sort_order(Movie, MOVIE_SORTS)
+                for after in (None, ['2000-01-01', 100], [None, 100]):
+                    for query in queries_after(get_serializer(Movie).query(*sort.columns), sort, after):
+                        plan = explain(query.limit(51))
+                        self.assertIn('ix_movies_release_date', plan)
+                        self.assertNotIn('TEMP B-TREE', plan)
+
+
+class LocalCacheTestCase(unittest.TestCase):
+    """This class represents the local response cache backend test cases"""
+
+    def test_least_recently_used_entry_is_evicted(self):
+        cache = LocalCache(max_entries=2)
+        cache.set('a', b'1')
+        cache.set('b', b'2')
+        cache.get('a')
+        cache.set('c', b'3')
+        self.assertEqual(cache.get('a'), b'1')
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.evictions, 1)
+
+    def test_size_bound(self):
+        cache = LocalCache(max_bytes=10)
+        cache.set('a', b'12345')
+        cache.set('b', b'12345')
+        cache.set('c', b'12345')
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(len(cache), 2)
+        self.assertFalse(cache.set('d', b'x' * 11))
+
+    def test_counters_are_not_evicted(self):
+        cache = LocalCache(max_entries=1)
+        cache.inc('generation:movies')
+        cache.set('a', b'1')
+        cache.set('b', b'2')
+        self.assertEqual(cache.get('generation:movies'), 1)
+
+    def test_add_only_stores_missing_keys(self):
+        cache = LocalCache()
+        self.assertTrue(cache.add('a', b'1'))
+        self.assertFalse(cache.add('a', b'2'))
+        self.assertEqual(cache.get('a'), b'1')
+
+
+class CompressionTestCase(unittest.TestCase):
+    """This class represents the response compression test cases"""
+
+    def stream(self, encoding, chunks):
+        flushed = []
+
+        def body():
+            for chunk in chunks:
+                yield chunk
+                # what the client could decode by now
+                flushed.append(len(b''.join(compressed)))
+
+        compressed = []
+        for data in compress_stream(body(), Encoder(encoding, 6)):
+            compressed.append(data)
+        return b''.join(compressed), flushed
+
+    def test_stream_is_flushed_incrementally(self):
+        chunks = [json.dumps({'id': i, 'title': f'Movie {i}'}).encode() + b'\n' for i in range(5000)]
+        body, flushed = self.stream('gzip', chunks)
+        self.assertEqual(gzip.decompress(body), b''.join(chunks))
+        # data is sent while rows are still being generated, not only at the end
+        self.assertGreater(flushed[len(chunks) // 2], 0)
+        # a client decodes the first flushed part without waiting for the rest
+        decoder = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        self.assertTrue(decoder.decompress(body[:flushed[len(chunks) // 2]]).startswith(chunks[0]))
+
+    @unittest.skipIf(brotli is None, 'brotli is not installed')
+    def test_brotli_stream(self):
+        chunks = [b'{"id": %d}\n' % i for i in range(5000)]
+        body, flushed = self.stream('br', chunks)
+        self.assertEqual(brotli.decompress(body), b''.join(chunks))
+        self.assertGreater(flushed[len(chunks) // 2], 0)
+
+    def test_stream_closes_body(self):
+        closed = []
+
+        def body():
+            try:
+                yield b'x'
+            finally:
+                closed.append(True)
+
+        stream = compress_stream(body(), Encoder('gzip', 6))
+        next(stream)
+        stream.close()
+        self.assertEqual(closed, [True])
+
+
+class ReplicaTestCase(unittest.TestCase):
+    """Read replica routing with two local SQLite databases as replicas, see replicas.py"""
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.replica_urls = [f'sqlite:///{directory}/replica_{name}.db' for name in 'ab']
+        self.app = self.create_app(self.replica_urls)
+        self.client = self.app.test_client
+        self.router = self.app.extensions['replica_router']
+        with self.app.app_context():
+            db.create_all()
+        for name, engine in zip('AB', self.router.engines):
+            db.metadata.create_all(engine)
+            engine.execute(Movie.__table__.insert(), title=f'Replica {name}', release_date=date(2020, 1, 1))
+        self.assistant_header = {'Authorization': 'Bearer ' + create_test_token('casting_assistant')}
+        self.producer_header = {'Authorization': 'Bearer ' + create_test_token('executive_producer')}
+
+    def tearDown(self):
+        with self.app.app_context():
+            db.session.query(Movie).delete()
+            db.session.commit()
+        for engine in self.router.engines:
+            engine.dispose()
+
+    def create_app(self, replica_urls, **config):
+        # responses are not cached, so every request shows which database answered
+        return create_app(dict({'AUTH0_JWKS_FILE': JWKS_FILE, 'RESPONSE_CACHE_URL': 'none',
+                                'REPLICA_URLS': ','.join(replica_urls), 'READ_YOUR_WRITES_SECONDS': 0.5},
+                               **config))
+
+    def titles(self, headers):
+        response = self.client().get('/api/movie', headers=headers)
+        self.assertEqual(response.status_code, 200)
+        return [movie['title'] for movie in json.loads(response.data)['movies']]
+
+    def test_reads_are_spread_over_the_replicas(self):
+        seen = [self.titles(self.assistant_header) for _ in range(4)]
+        self.assertEqual(sorted(map(tuple, seen)), [('Replica A',)] * 2 + [('Replica B',)] * 2)
+        self.assertNotEqual(seen[0], seen[1])
+
+    def test_writes_go_to_the_primary_and_the_writer_reads_them(self):
+        response = self.client().post('/api/movie', data=json.dumps({'title': 'Ludo', 'release_date': '2020-10-10'}),
+                                      headers=dict(self.producer_header, **{'Content-Type': 'application/json'}))
+        self.assertEqual(response.status_code, 200)
+        with self.app.app_context():
+            self.assertEqual([movie.title for movie in Movie.query], ['Ludo'])
+        for engine in self.router.engines:
+            self.assertEqual(engine.execute('SELECT count(*) FROM movies WHERE title = ?', 'Ludo').scalar(), 0)
+        # the writer reads from the primary for READ_YOUR_WRITES_SECONDS, other clients from the replicas
+        self.assertEqual(self.titles(self.producer_header), ['Ludo'])
+        self.assertNotIn('Ludo', self.titles(self.assistant_header))
+        time.sleep(0.6)
+        self.assertNotIn('Ludo', self.titles(self.producer_header))
+
+    def test_replica_reads_are_not_cached(self):
+        app = self.create_app(self.replica_urls, RESPONSE_CACHE_URL='local')
+        self.client = app.test_client
+        cache = app.extensions['response_cache']
+        self.titles(self.assistant_header)
+        response = self.client().post('/api/movie', data=json.dumps({'title': 'Ludo', 'release_date': '2020-10-10'}),
+                                      headers=dict(self.producer_header, **{'Content-Type': 'application/json'}))
+        self.assertEqual(response.status_code, 200)
+        # another client reads a replica that does not have the write yet, between the write and the writer's read
+        self.assertNotIn('Ludo', self.titles(self.assistant_header))
+        self.assertEqual(self.titles(self.producer_header), ['Ludo'])
+        self.assertEqual(cache.stats()['hits'], 0)
+        # what the writer read from the primary is cached for everyone
+        self.assertEqual(self.titles(self.assistant_header), ['Ludo'])
+        self.assertEqual(cache.stats()['hits'], 1)
+
+    def test_failed_replica_is_skipped(self):
+        broken = 'sqlite:////nonexistent/directory/replica.db'
+        app = self.create_app([broken, self.replica_urls[0]], REPLICA_RETRY_SECONDS=60)
+        router = app.extensions['replica_router']
+        self.assertEqual(router.stats(), [{'replica': 0, 'healthy': False}, {'replica': 1, 'healthy': True}])
+        for _ in range(3):
+            self.assertIs(router.choose(), router.engines[1])
+
+        # without any healthy replica the primary answers
+        app = self.create_app([broken])
+        with app.app_context():
+            create_test_movie({'title': 'Primary', 'release_date': '2020-01-01'})
+        self.client = app.test_client
+        self.assertEqual(self.titles(self.assistant_header), ['Primary'])
+
+    def test_replica_is_checked_again_after_retry_seconds(self):
+        engine = self.router.engines[0]
+        self.router.retry_seconds = 0
+        self.router.mark_down(engine)
+        with self.router._lock:
+            self.assertIn(engine, self.router._down_until)
+        chosen = {self.router.choose() for _ in range(2)}
+        self.assertIn(engine, chosen)
+        self.assertEqual(self.router.stats()[0]['healthy'], True)
+
+
+class ConnectionPoolTestCase(unittest.TestCase):
+    """Pool settings and instrumentation, see dbpool.py"""
+
+    def setUp(self):
+        self.database_file = os.path.join(tempfile.mkdtemp(), 'pool.db')
+
+    def connect(self):
+        return sqlite3.connect(self.database_file, check_same_thread=False)
+
+    def test_engine_options(self):
+        config = {'DB_POOL_SIZE': 8, 'DB_MAX_OVERFLOW': 2, 'DB_POOL_TIMEOUT': 5.0,
+                  'DB_POOL_RECYCLE': 300, 'DB_POOL_PRE_PING': True}
+        self.assertEqual(engine_options(config, 'postgresql://localhost/capstone'), {
+            'poolclass': InstrumentedQueuePool, 'pool_size': 8, 'max_overflow': 2, 'pool_timeout': 5.0,
+            'pool_recycle': 300, 'pool_pre_ping': True})
+        # SQLite keeps its own pool classes, which take no size settings
+        self.assertEqual(engine_options(config, 'sqlite:////tmp/capstone.db'),
+                         {'pool_recycle': 300, 'pool_pre_ping': True})
+        self.assertEqual(engine_options({}, 'sqlite://'), {})
+
+    def test_checkouts_overflow_and_timeouts_are_counted(self):
+        pool = InstrumentedQueuePool(self.connect, pool_size=1, max_overflow=1, timeout=0.05)
+        before = pool_stats.stats()
+        first = pool.connect()
+        second = pool.connect()
+        stats = pool_stats.stats(pool)
+        self.assertEqual(stats['checked_out'], 2)
+        self.assertEqual(stats['overflow'], 1)
+        self.assertGreaterEqual(stats['peak_overflow'], 1)
+        self.assertEqual(stats['checkouts'] - before['checkouts'], 2)
+        self.assertEqual(stats['in_use'] - before['in_use'], 2)
+
+        with self.assertRaises(PoolTimeoutError):
+            pool.connect()
+        stats = pool_stats.stats(pool)
+        self.assertEqual(stats['checkout_timeouts'] - before['checkout_timeouts'], 1)
+
+        first.close()
+        second.close()
+        stats = pool_stats.stats(pool)
+        self.assertEqual(stats['in_use'], before['in_use'])
+        self.assertEqual(stats['checked_in'], 1)
+        pool.dispose()
+
+
+class RequestTimingTestCase(unittest.TestCase):
+    """Phase timing and metrics aggregation, see timing.py and metrics.py"""
+
+    def test_database_time_is_not_counted_twice(self):
+        timer = RequestTimer()
+        with timer.phase('serialize'):
+            time.sleep(0.02)
+            with timer.phase('db'):
+                time.sleep(0.05)
+            with timer.phase('serialize'):
+                time.sleep(0.01)
+        self.assertGreaterEqual(timer.phases['db'], 0.05)
+        self.assertGreaterEqual(timer.phases['serialize'], 0.03)
+        self.assertLess(timer.phases['serialize'], 0.05)
+
+    def test_metrics_of_all_workers_are_aggregated(self):
+        directory = tempfile.mkdtemp()
+        env = dict(os.environ, PROMETHEUS_MULTIPROC_DIR=directory)
+        record = ("from metrics import observe_request; "
+                  "observe_request('/api/movie', 'GET', 200, 0.01, {'db': 0.002})")
+        for worker in range(2):
+            subprocess.run([sys.executable, '-c', record], env=env, check=True, cwd=os.path.dirname(__file__) or '.')
+        render = "from metrics import render_metrics; print(render_metrics()[0].decode())"
+        output = subprocess.run([sys.executable, '-c', render], env=env, check=True, stdout=subprocess.PIPE,
+                                cwd=os.path.dirname(__file__) or '.').stdout.decode()
+        self.assertIn('http_requests_total{endpoint="/api/movie",method="GET",status="200"} 2.0', output)
+
+    def test_gunicorn_config_enables_multiprocess_metrics_by_default(self):
+        env = {name: value for name, value in os.environ.items()
+               if name.lower() != 'prometheus_multiproc_dir'}
+        env['TMPDIR'] = tempfile.mkdtemp()
+        check = ("import os, runpy; config = runpy.run_path('gunicorn.conf.py'); config['on_starting'](None); "
+                 "from prometheus_client import values; "
+                 "print(os.environ['PROMETHEUS_MULTIPROC_DIR'], values.ValueClass._multiprocess)")
+        output = subprocess.run([sys.executable, '-c', check], env=env, check=True, stdout=subprocess.PIPE,
+                                cwd=os.path.dirname(__file__) or '.').stdout.decode().split()
+        self.assertEqual(output, [os.path.join(env['TMPDIR'], 'capstone-prometheus'), 'True'])
+        self.assertTrue(os.path.isdir(output[0]))
+
+
+class ImportTestCase(unittest.TestCase):
+    """This class represents the bulk import test cases"""
+
+    def setUp(self):
+        self.app = create_app({'AUTH0_JWKS_FILE': JWKS_FILE, 'RESPONSE_CACHE_URL': 'none'})
+        with self.app.app_context():
+            db.create_all()
+
+    def tearDown(self):
+        with self.app.app_context():
+            db.session.query(Movie).delete()
+            db.session.query(Actor).delete()
+            db.session.commit()
+
+    def import_text(self, model, key, content, file_format, **kwargs):
+        with self.app.app_context():
+            return import_rows(model, key, read_rows(io.StringIO(content), file_format), **kwargs)
+
+    def test_import_csv_in_batches(self):
+        errors = []
+        content = 'title,release_date\n' + ''.join(f'Movie {i},2020-01-{i % 28 + 1:02d}\n' for i in range(25)) + \
+            'Broken,2020-13-01\nMovie 3,1999-12-31\n'
+        stats = self.import_text(Movie, 'title', content, 'csv', batch_size=10, report=errors.append)
+        self.assertEqual((stats.read, stats.inserted, stats.updated, stats.duplicates, stats.invalid),
+                         (27, 25, 0, 1, 1))
+        self.assertEqual(errors, ['Line 27: Invalid release_date 2020-13-01, expected YYYY-MM-DD'])
+        with self.app.app_context():
+            self.assertEqual(Movie.query.count(), 25)
+            self.assertEqual(Movie.query.filter_by(title='Movie 3').one().release_date, date(2020, 1, 4))
+
+    def test_import_jsonl_updates_duplicates(self):
+        self.import_text(Actor, 'name', '{"name": "Aamir Khan", "age": 50, "gender": "Male"}\n', 'jsonl')
+        content = ('{"name": "Aamir Khan", "age": 55, "gender": "Male"}\n\n'
+                   '{"name": "Vidya Balan", "age": 41, "gender": "Female"}\n'
+                   '{"name": "Vidya Balan", "age": 42, "gender": "Female"}\n'
+                   'not json\n'
+                   '{"name": "Kajol", "age": "old", "gender": "Female"}\n')
+        stats = self.import_text(Actor, 'name', content, 'jsonl', on_duplicate='update')
+        self.assertEqual((stats.read, stats.inserted, stats.updated, stats.duplicates, stats.invalid),
+                         (5, 1, 1, 1, 2))
+        with self.app.app_context():
+            self.assertEqual(dict(db.session.query(Actor.name, Actor.age)), {'Aamir Khan': 55, 'Vidya Balan': 42})
+
+    def test_import_skips_existing_rows_by_default(self):
+        content = 'name,age,gender\nKajol,46,Female\n'
+        self.import_text(Actor, 'name', content, 'csv')
+        stats = self.import_text(Actor, 'name', content.replace('46', '47'), 'csv')
+        self.assertEqual((stats.inserted, stats.duplicates), (0, 1))
+        with self.app.app_context():
+            self.assertEqual(Actor.query.one().age, 46)
+
+    def test_import_skip_keeps_first_row_of_file(self):
+        content = 'name,age,gender\nKajol,46,Female\nKajol,47,Female\nRani,44,Female\nKajol,48,Female\n'
+        stats = self.import_text(Actor, 'name', content, 'csv', batch_size=2)
+        self.assertEqual((stats.inserted, stats.duplicates), (2, 2))
+        with self.app.app_context():
+            self.assertEqual(dict(db.session.query(Actor.name, Actor.age)), {'Kajol': 46, 'Rani': 44})
+        self.import_text(Actor, 'name', content, 'csv', on_duplicate='update', batch_size=2)
+        with self.app.app_context():
+            self.assertEqual(dict(db.session.query(Actor.name, Actor.age)), {'Kajol': 48, 'Rani': 44})
+
+    def export_text(self, model, file_format, **kwargs):
+        with self.app.app_context():
+            file = io.BytesIO()
+            stats = export_rows(model, file, file_format, **kwargs)
+            return file.getvalue().decode(), stats
+
+    def test_export_csv_round_trip(self):
+        content = 'title,release_date\n' + ''.join(f'Movie {i},2020-01-{i % 28 + 1:02d}\n'
+                                                   for i in range(EXPORT_BATCH_SIZE + 5))
+        self.import_text(Movie, 'title', content, 'csv')
+        exported, stats = self.export_text(Movie, 'csv')
+        self.assertEqual(stats.written, EXPORT_BATCH_SIZE + 5)
+        lines = exported.splitlines()
+        self.assertEqual(lines[0], 'id,title,release_date')
+        self.assertEqual([line.split(',', 1)[1] for line in lines[1:]], content.splitlines()[1:])
+        self.assertEqual(int(lines[-1].split(',')[0]), stats.last_id)
+
+    def test_export_jsonl_since_id(self):
+        self.import_text(Actor, 'name', 'name,age,gender\nKajol,46,Female\nAamir Khan,55,Male\n', 'csv')
+        exported, stats = self.export_text(Actor, 'jsonl')
+        first, second = [json.loads(line) for line in exported.splitlines()]
+        self.assertEqual(second, {'id': stats.last_id, 'name': 'Aamir Khan', 'age': 55, 'gender': 'Male'})
+        exported, stats = self.export_text(Actor, 'jsonl', since_id=first['id'])
+        self.assertEqual([json.loads(line) for line in exported.splitlines()], [second])
+        exported, stats = self.export_text(Actor, 'jsonl', since_id=second['id'])
+        self.assertEqual((exported, stats.written, stats.last_id), ('', 0, second['id']))
+
+    def test_export_columnar_gzip(self):
+        self.import_text(Movie, 'title', 'title,release_date\n' + ''.join(f'Movie {i},2020-01-01\n'
+                                                                          for i in range(EXPORT_BATCH_SIZE + 1)),
+                         'csv')
+        with self.app.app_context():
+            file = io.BytesIO()
+            with gzip.GzipFile(fileobj=file, mode='wb') as compressed:
+                export_rows(Movie, compressed, 'columnar')
+        blocks = [json.loads(line) for line in gzip.decompress(file.getvalue()).splitlines()]
+        self.assertEqual([len(block['id']) for block in blocks], [EXPORT_BATCH_SIZE, 1])
+        self.assertEqual(blocks[1], {'id': [blocks[0]['id'][-1] + 1], 'title': [f'Movie {EXPORT_BATCH_SIZE}'],
+                                     'release_date': ['2020-01-01']})
+
+    def test_detect_format(self):
+        self.assertEqual(detect_format('movies.CSV'), 'csv')
+        self.assertEqual(detect_format('actors.ndjson'), 'jsonl')
+        with self.assertRaises(ValueError):
+            detect_format('movies.xlsx')
+
+
 # # Make the tests conveniently executable
 if __name__ == "__main__":
     unittest.main()
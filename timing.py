@@ -0,0 +1,175 @@
+import logging
+import re
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+
+from flask import current_app, g, has_app_context, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from metrics import observe_request
+
+# phases reported in Server-Timing besides "total", in this order
+PHASES = ('auth', 'db', 'serialize')
+
+# defaults of SLOW_QUERY_MS and N_PLUS_ONE_THRESHOLD, used outside of an app context
+SLOW_QUERY_MS = 200
+N_PLUS_ONE_THRESHOLD = 10
+
+logger = logging.getLogger(__name__)
+
+_NORMALIZE_SQL = [
+    (re.compile(r"'(?:[^']|'')*'"), '?'),  # string literals
+    (re.compile(r'%\(\w+\)s|(?<!:):\w+|\$\d+'), '?'),  # named and numbered bind parameters
+    (re.compile(r'\b\d+(?:\.\d+)?\b'), '?'),  # numbers
+    (re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)'), '(...)'),  # IN lists and VALUES of any length
+    (re.compile(r'\s+'), ' '),
+]
+
+
+def normalize_sql(statement):
+    """
+    Reduces a statement to its shape, so statements differing only by their values compare equal
+    :param statement: SQL statement
+    :return: Statement with literals and parameters replaced by "?" and whitespace collapsed
+    """
+    for pattern, replacement in _NORMALIZE_SQL:
+        statement = pattern.sub(replacement, statement)
+    return statement.strip()
+
+
+def app_setting(name, default):
+    return current_app.config.get(name, default) if has_app_context() else default
+
+
+class RequestTimer:
+    """
+    Time spent by one request in each phase. Phases do not overlap: database time
+    spent inside another phase (e.g. loading relations while serializing) is only
+    counted as "db".
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases = defaultdict(float)
+        self.queries = 0
+        # executions per statement, bound values are parameters so repeats of a query compare equal
+        self.statements = Counter()
+        self._open = set()
+
+    @contextmanager
+    def phase(self, name):
+        if name in self._open:
+            # nested timing of the same phase, already counted by the outer one
+            yield
+            return
+        self._open.add(name)
+        db_before = self.phases['db']
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            if name != 'db':
+                elapsed -= self.phases['db'] - db_before
+            self.phases[name] += elapsed
+            self._open.discard(name)
+
+    def record_query(self, statement, seconds):
+        self.queries += 1
+        self.statements[statement] += 1
+        self.phases['db'] += seconds
+
+    def repeated_statements(self, threshold):
+        """
+        :param threshold: Least number of executions of the same statement to report
+        :return: [(executions, statement)], typically N+1 queries issued row by row
+        """
+        return [(count, statement) for statement, count in self.statements.most_common() if count >= threshold]
+
+    def total(self):
+        return time.perf_counter() - self.started
+
+    def server_timing(self):
+        """
+        :return: Server-Timing header value, durations in milliseconds
+        """
+        entries = [f'{name};dur={self.phases[name] * 1000:.2f}' for name in PHASES]
+        entries[PHASES.index('db')] += f';desc="{self.queries} queries"'
+        entries.append(f'total;dur={self.total() * 1000:.2f}')
+        return ', '.join(entries)
+
+
+def current_timer():
+    """
+    :return: RequestTimer of the current request, or None outside of a timed request
+    """
+    if has_request_context():
+        return g.get('request_timer')
+    return None
+
+
+@contextmanager
+def phase(name):
+    """
+    Adds the time spent in the with block to a phase of the current request
+    :param name: One of PHASES
+    """
+    timer = current_timer()
+    if timer is None:
+        yield
+    else:
+        with timer.phase(name):
+            yield
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def start_query_timer(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def stop_query_timer(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['query_started'].pop()
+    timer = current_timer()
+    if timer is not None:
+        timer.record_query(statement, elapsed)
+    if elapsed * 1000 >= app_setting('SLOW_QUERY_MS', SLOW_QUERY_MS):
+        logger.warning('Slow query (%.1f ms): %s', elapsed * 1000, normalize_sql(statement))
+
+
+@event.listens_for(Engine, 'handle_error')
+def discard_query_timer(context):
+    # after_cursor_execute is not called for failed statements
+    if context.connection is not None and context.connection.info.get('query_started'):
+        context.connection.info['query_started'].pop()
+
+
+def init_request_timing(app):
+    """
+    Times every request of an app: adds a Server-Timing header with the auth, db,
+    serialize and total durations and the number of queries, records them in the
+    Prometheus metrics and logs statements repeated N_PLUS_ONE_THRESHOLD times or more.
+    Queries of a streamed body run after the response is returned and are not included.
+    :param app: Flask app
+    :return: Nothing
+    """
+
+    @app.before_request
+    def start_request_timer():
+        g.request_timer = RequestTimer()
+
+    @app.after_request
+    def record_request_timing(response):
+        timer = g.pop('request_timer', None)
+        if timer is None:
+            return response
+        response.headers['Server-Timing'] = timer.server_timing()
+        endpoint = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        observe_request(endpoint, request.method, response.status_code, timer.total(),
+                        {name: timer.phases[name] for name in PHASES}, timer.queries)
+        for count, statement in timer.repeated_statements(app.config['N_PLUS_ONE_THRESHOLD']):
+            logger.warning('Possible N+1 query in %s %s, %d executions of: %s',
+                           request.method, endpoint, count, normalize_sql(statement))
+        return response
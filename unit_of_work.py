@@ -0,0 +1,62 @@
+from flask import abort, current_app, request
+from sqlalchemy.exc import SQLAlchemyError
+from werkzeug.exceptions import HTTPException, UnprocessableEntity
+
+from models import db
+
+# methods whose successful requests commit, other requests only read
+WRITE_METHODS = ('POST', 'PUT', 'PATCH', 'DELETE')
+
+# message of the 422 answered for unexpected errors, whose own text may carry SQL and driver details
+UNPROCESSABLE_MESSAGE = 'The request could not be processed'
+
+
+def abort_unprocessable(error):
+    """
+    Answers 422 for an error raised while handling a request. Validation errors (ValueError)
+    keep their message, others are logged and answered with UNPROCESSABLE_MESSAGE.
+    :param error: The exception
+    :return: Nothing, always raises
+    """
+    if isinstance(error, HTTPException):
+        raise error
+    if isinstance(error, ValueError):
+        abort(422, str(error))
+    current_app.logger.exception('%s %s failed', request.method, request.path, exc_info=error)
+    abort(422, UNPROCESSABLE_MESSAGE)
+
+
+def complete_request(response):
+    """
+    Ends the unit of work of the current request: its writes are committed at once
+    if the response is a success, and rolled back otherwise. Either way the session
+    gives its connection back to the pool.
+    :param response: Response of the request
+    :return: The response, or a 422 response if the commit failed
+    """
+    if response.status_code >= 400:
+        db.session.rollback()
+    elif request.method in WRITE_METHODS:
+        try:
+            db.session.commit()
+        except SQLAlchemyError as e:
+            db.session.rollback()
+            current_app.logger.exception('Commit of %s %s failed', request.method, request.path, exc_info=e)
+            error = UnprocessableEntity(UNPROCESSABLE_MESSAGE)
+            return current_app.make_response(current_app.handle_user_exception(error))
+    return response
+
+
+def init_unit_of_work(app):
+    """
+    Gives each request of an app one unit of work: the model methods and write helpers
+    only flush, and the request's session is committed or rolled back once, after the
+    view returned. Register it after the other after_request hooks, so it runs first
+    and they see the outcome of the commit.
+    :param app: Flask app
+    :return: Nothing
+    """
+
+    @app.after_request
+    def complete_unit_of_work(response):
+        return complete_request(response)